@@ -0,0 +1,286 @@
+"""
+End-to-end onboarder benchmarks: azure_onboarder, aws_onboarder and profiles_tool validate run against synthetic
+profiles and local stand-ins of terraform, Azure CLI and Azure APIs; wall time, CPU time and peak RSS are measured
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import synthetic
+from results import Measurement, compare, default_name, load_results, save_results
+from standins.fake_azure import FakeAzure
+
+log = logging.getLogger(__name__)
+
+SUITE: str = "e2e"
+REPO_DIRECTORY: Path = Path(__file__).resolve().parent.parent
+STANDINS_DIRECTORY: Path = Path(__file__).resolve().parent / "standins"
+AZURE_EXAMPLE: Path = Path(
+    "cloud_Azure", "terraform", "module", "examples", "multiple_accounts_multiple_resource_group"
+)
+AWS_EXAMPLE: Path = Path("cloud_AWS", "terraform", "module", "examples", "multiple-aws-accounts-multiple-vpc-setup")
+EXAMPLE_FILE_SUFFIXES = (".py", ".tf", ".tfvars", ".hcl")  # files of an example directory needed to run it
+DEFAULT_SIZES: List[int] = [10, 100, 1000]
+PROFILES_FILE_NAME: str = "bench_profiles.ini"
+OUTPUT_FILE_NAME: str = "bench_output.log"
+KEYS = ("scenario", "profiles", "jobs")
+METRICS = ("wall_sec", "cpu_sec", "peak_rss_mb")
+
+
+@dataclass
+class Scenario:
+    name: str
+    example: Path  # example directory the tool runs in, relative to the repository
+    command: Callable[[int], List[str]]  # command line for given number of jobs, run in a copy of the example
+    uses_az_cli: bool = False  # the az.cli stand-in must be importable
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    s.name: s
+    for s in [
+        Scenario(
+            "azure-cli",
+            AZURE_EXAMPLE,
+            lambda jobs: ["azure_onboarder.py", "--filename", PROFILES_FILE_NAME, "--jobs", str(jobs), "apply"],
+            uses_az_cli=True,
+        ),
+        Scenario(
+            "azure-env",
+            AZURE_EXAMPLE,
+            lambda jobs: ["azure_onboarder.py", "--filename", PROFILES_FILE_NAME, "--jobs", str(jobs)]
+            + ["--login", "env", "apply"],
+        ),
+        Scenario("aws", AWS_EXAMPLE, lambda jobs: ["aws_onboarder.py", "apply", "--profiles=*", "--jobs", str(jobs)]),
+        Scenario(
+            "validate",
+            AZURE_EXAMPLE,
+            lambda jobs: ["profiles_tool.py", "--filename", PROFILES_FILE_NAME, "--jobs", str(jobs), "validate"],
+        ),
+        Scenario(
+            "validate-resource-graph",
+            AZURE_EXAMPLE,
+            lambda jobs: ["profiles_tool.py", "--filename", PROFILES_FILE_NAME, "--jobs", str(jobs)]
+            + ["--resource-graph", "validate"],
+        ),
+    ]
+}
+
+
+@dataclass
+class RunResult:
+    exit_code: int
+    wall_sec: float
+    cpu_sec: float  # user + system, of the tool and all its descendants: terraform, worker processes
+    peak_rss_mb: float  # of the largest of the tool and its descendants
+
+
+def run_measured(command: List[str], cwd: Path, env: Dict[str, str], output_path: Path) -> RunResult:
+    """
+    Run the command to completion, its output going to output_path
+    Resource usage reported when waiting for a child covers the child and all its waited-for descendants
+    """
+
+    with open(output_path, "w", encoding="utf-8") as output:
+        start = time.monotonic()
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=output, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_sec = time.monotonic() - start
+
+    exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    process.returncode = exit_code  # already waited for
+    rss_scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    return RunResult(
+        exit_code=exit_code,
+        wall_sec=round(wall_sec, 3),
+        cpu_sec=round(usage.ru_utime + usage.ru_stime, 3),
+        peak_rss_mb=round(usage.ru_maxrss * rss_scale / 2**20, 1),
+    )
+
+
+def prepare_workdir(scenario: Scenario, profiles: int, root: Path) -> Path:
+    """
+    Copy the example and the top-level files of its module (hashed for profile fingerprints) into a fresh directory,
+    so that plans, logs and fingerprints of a run affect neither the repository nor other runs
+    Return the example directory of the copy, with synthetic profiles in place
+    """
+
+    module = scenario.example.parent.parent
+    workdir = Path(tempfile.mkdtemp(prefix=f"{scenario.name}-{profiles}-", dir=root))
+    for path in (REPO_DIRECTORY / module).iterdir():
+        if path.is_file():
+            shutil.copy2(path, workdir / path.name)
+    example = workdir / scenario.example.relative_to(module)
+    example.mkdir(parents=True)
+    for path in (REPO_DIRECTORY / scenario.example).iterdir():
+        if path.is_file() and path.name.endswith(EXAMPLE_FILE_SUFFIXES):
+            shutil.copy2(path, example / path.name)
+
+    if scenario.example == AWS_EXAMPLE:
+        synthetic.write_aws_profiles(example / "credentials", example / "config", profiles)
+    else:
+        synthetic.write_profiles(example / PROFILES_FILE_NAME, profiles)
+    return example
+
+
+def scenario_environment(
+    scenario: Scenario, example: Path, azure: FakeAzure, args: argparse.Namespace
+) -> Dict[str, str]:
+    env = dict(os.environ)
+    home = example / "home"  # token cache, Terraform plugin cache and such stay in the work directory
+    home.mkdir()
+    env.update(azure.environment())
+    env.update(
+        {
+            "HOME": str(home),
+            "PATH": f"{STANDINS_DIRECTORY}{os.pathsep}{env.get('PATH', '')}",
+            "TF_PLUGIN_CACHE_DIR": str(home / "plugin-cache"),
+            "AWS_SHARED_CREDENTIALS_FILE": str(example / "credentials"),
+            "AWS_CONFIG_FILE": str(example / "config"),
+            "KTAPI_AUTH_EMAIL": "bench@example.com",
+            "KTAPI_AUTH_TOKEN": "bench",
+            "FAKE_TF_WORKSPACE_SEC": str(args.tf_workspace_sec),
+            "FAKE_TF_PLAN_SEC": str(args.tf_plan_sec),
+            "FAKE_TF_APPLY_SEC": str(args.tf_apply_sec),
+            "FAKE_TF_PLAN_EXIT": str(args.tf_plan_exit),
+            "FAKE_AZ_SEC": str(args.az_sec),
+        }
+    )
+    env.pop("TF_WORKSPACE", None)
+    env.pop("TF_DATA_DIR", None)
+    if scenario.uses_az_cli:
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(STANDINS_DIRECTORY), env.get("PYTHONPATH")]))
+    return env
+
+
+def run_benchmarks(args: argparse.Namespace) -> List[Measurement]:
+    measurements: List[Measurement] = []
+    root = Path(tempfile.mkdtemp(prefix="onboarder-bench-"))
+    azure = FakeAzure(root, args.api_latency_sec)
+    azure.start()
+    try:
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]
+            for profiles in args.sizes:
+                measurements.append(run_scenario(scenario, profiles, root, azure, args))
+    finally:
+        azure.stop()
+        if args.keep_workdirs:
+            print(f"Work directories kept in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    return measurements
+
+
+def run_scenario(
+    scenario: Scenario, profiles: int, root: Path, azure: FakeAzure, args: argparse.Namespace
+) -> Measurement:
+    """Median of the repeated runs; every run starts from scratch, eg. with no workspaces and no fingerprints"""
+
+    runs: List[RunResult] = []
+    requests = azure.requests
+    for _ in range(args.repeat):
+        example = prepare_workdir(scenario, profiles, root)
+        env = scenario_environment(scenario, example, azure, args)
+        output_path = example / OUTPUT_FILE_NAME
+        result = run_measured([sys.executable] + scenario.command(args.jobs), example, env, output_path)
+        if result.exit_code != 0:
+            tail = output_path.read_text(encoding="utf-8", errors="replace").splitlines()[-20:]
+            log.error(
+                "%s with %d profiles failed with code %d:\n%s",
+                scenario.name,
+                profiles,
+                result.exit_code,
+                "\n".join(tail),
+            )
+        runs.append(result)
+        if not args.keep_workdirs:
+            shutil.rmtree(example.parent.parent, ignore_errors=True)
+
+    measurement: Measurement = {"scenario": scenario.name, "profiles": profiles, "jobs": args.jobs}
+    for metric in METRICS:
+        measurement[metric] = round(statistics.median(getattr(r, metric) for r in runs), 3)
+    measurement["failed_runs"] = sum(1 for r in runs if r.exit_code != 0)
+    measurement["api_requests"] = (azure.requests - requests) // args.repeat
+    print(
+        f"{scenario.name:24} {profiles:6} profiles {args.jobs:3} jobs: wall {measurement['wall_sec']:8.2f}s"
+        f"  cpu {measurement['cpu_sec']:8.2f}s  peak rss {measurement['peak_rss_mb']:7.1f}MB"
+        f"  api requests {measurement['api_requests']:6}" + ("  FAILED" if measurement["failed_runs"] else ""),
+        flush=True,
+    )
+    return measurement
+
+
+def parse_cmd_line() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS), help="(default: all)"
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="Numbers of profiles (default: %(default)s)"
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="Passed to the tools (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per benchmark; median is reported (default: 1)")
+    parser.add_argument("--tf-workspace-sec", type=float, default=0.0, help="Latency of terraform workspace commands")
+    parser.add_argument("--tf-plan-sec", type=float, default=0.0, help="Latency of terraform plan")
+    parser.add_argument("--tf-apply-sec", type=float, default=0.0, help="Latency of terraform apply")
+    parser.add_argument(
+        "--tf-plan-exit", type=int, default=2, help="Exit code of terraform plan: 0 no changes, 2 changes (default)"
+    )
+    parser.add_argument("--az-sec", type=float, default=0.0, help="Latency of Azure CLI commands")
+    parser.add_argument("--api-latency-sec", type=float, default=0.0, help="Latency of Azure AD and ARM responses")
+    parser.add_argument(
+        "--keep-workdirs", default=False, action="store_true", help="Keep work directories with output of the tools"
+    )
+    parser.add_argument(
+        "--save",
+        nargs="?",
+        const="",
+        default=None,
+        help="Store results under the name (default: e2e-<commit>) in benchmarks/results",
+    )
+    parser.add_argument("--compare", default="", help="Compare with stored results (name or path)")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=None,
+        help="Fail if any metric grew by more than the percentage against --compare results",
+    )
+    args = parser.parse_args()
+    if args.jobs < 1 or args.repeat < 1 or any(s < 1 for s in args.sizes):
+        parser.error("--jobs, --repeat and --sizes must be at least 1")
+    if args.max_regression is not None and not args.compare:
+        parser.error("--max-regression requires --compare")
+    return args
+
+
+def main() -> int:
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    args = parse_cmd_line()
+    measurements = run_benchmarks(args)
+    if args.save is not None:
+        settings = {k: v for k, v in vars(args).items() if k not in ("save", "compare", "max_regression")}
+        path = save_results(args.save or default_name(SUITE), SUITE, settings, measurements)
+        print(f"Results saved to {path}")
+
+    failed = any(m["failed_runs"] for m in measurements)
+    if args.compare:
+        baseline = load_results(args.compare)
+        regressions = compare(baseline["measurements"], measurements, KEYS, METRICS, args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.max_regression:g}%")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
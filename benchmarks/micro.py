@@ -0,0 +1,264 @@
+"""
+Micro-benchmarks of the pure-Python profile handling of profiles.py and profiles_tool.py: loading, saving, parsing
+and validating profiles, finding secrets, checking resource groups and formatting columns. Every function is run
+over synthetic profile files of given sizes; time and memory allocated while running are measured
+"""
+
+import argparse
+import gc
+import logging
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import synthetic
+from results import Measurement, compare, default_name, load_results, save_results
+
+SUITE: str = "micro"
+AZURE_EXAMPLE_DIRECTORY: Path = (
+    Path(__file__).resolve().parent.parent
+    / "cloud_Azure"
+    / "terraform"
+    / "module"
+    / "examples"
+    / "multiple_accounts_multiple_resource_group"
+)
+sys.path.insert(0, str(AZURE_EXAMPLE_DIRECTORY))
+
+# pylint: disable=wrong-import-position
+from inventory import Inventory, SnapshotClient, SubscriptionInventory
+from profiles import (
+    AzureProfile,
+    ProfileCollection,
+    ProfileConfigurationError,
+    SqliteProfileBackend,
+    ini_sections,
+    load_complete_profiles,
+    load_incomplete_profiles,
+    save_profiles,
+    validate_profile_configuration,
+)
+from profiles_tool import find_secret, format_columns, list_invalid_resource_groups
+
+DEFAULT_SIZES: List[int] = [100, 1000, 10000]  # 100000 takes ~10 minutes, mostly loading under tracemalloc
+INVALID_EVERY: int = 10  # every n-th profile refers to a missing resource group, as found by validation
+FORMAT_COLUMNS: int = 3  # as profiles_tool prints locations and resource groups
+KEYS = ("benchmark", "profiles")
+METRICS = ("time_sec", "peak_alloc_kb", "retained_kb")
+
+
+@dataclass
+class Fixture:
+    """Synthetic profiles of a single size, in every form the benchmarked functions take"""
+
+    size: int
+    directory: Path
+    ini_path: Path
+    sqlite_path: Path
+    sections: List[Dict[str, str]]
+    profiles: List[AzureProfile]
+    collection: ProfileCollection
+    clients: Dict[str, SnapshotClient]  # by subscription ID
+
+    @classmethod
+    def create(cls, directory: Path, size: int) -> "Fixture":
+        ini_path = directory / f"profiles-{size}.ini"
+        synthetic.write_profiles(ini_path, size, INVALID_EVERY)
+        profiles = load_incomplete_profiles(str(ini_path))
+        sqlite_path = directory / f"profiles-{size}.db"
+        SqliteProfileBackend(str(sqlite_path)).upsert(profiles)
+        return cls(
+            size=size,
+            directory=directory,
+            ini_path=ini_path,
+            sqlite_path=sqlite_path,
+            sections=[data for _, data in ini_sections(str(ini_path))],
+            profiles=profiles,
+            collection=ProfileCollection(profiles),
+            clients=snapshot_clients(profiles),
+        )
+
+
+def snapshot_clients(profiles: List[AzureProfile]) -> Dict[str, SnapshotClient]:
+    """
+    Inventory-backed clients of the subscriptions of the profiles, holding the synthetic resource groups;
+    list_invalid_resource_groups then runs without network, like profiles_tool validate with --inventory
+    """
+
+    resource_groups: Dict[str, List[str]] = {}
+    for name, location in synthetic.subscription_resource_groups():
+        resource_groups.setdefault(location, []).append(name)
+    inventory = Inventory()
+    for subscription_id in {p.subscription_id for p in profiles}:
+        inventory.subscriptions[subscription_id] = SubscriptionInventory(
+            synthetic.TENANT_ID, list(synthetic.LOCATIONS), resource_groups
+        )
+    return {s: SnapshotClient(inventory, synthetic.TENANT_ID, s) for s in inventory.subscriptions}
+
+
+def validate_all(profiles: List[AzureProfile]) -> int:
+    invalid = 0
+    for profile in profiles:
+        try:
+            validate_profile_configuration(profile)
+        except ProfileConfigurationError:
+            invalid += 1
+    return invalid
+
+
+def list_all_invalid_resource_groups(fixture: Fixture) -> int:
+    return sum(len(list_invalid_resource_groups(fixture.clients[p.subscription_id], p)) for p in fixture.profiles)
+
+
+def find_all_secrets(fixture: Fixture) -> int:
+    return sum(1 for p in fixture.profiles if find_secret(p.principal_id, fixture.collection))
+
+
+@dataclass
+class Benchmark:
+    name: str
+    setup: Callable[[Fixture], Any]  # prepares the argument of run, not measured; called before every run
+    run: Callable[[Any], Any]
+
+
+def unchanged(fixture: Fixture) -> Fixture:
+    return fixture
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    b.name: b
+    for b in [
+        Benchmark("load_incomplete_profiles", lambda f: str(f.ini_path), load_incomplete_profiles),
+        Benchmark("load_incomplete_profiles_sqlite", lambda f: str(f.sqlite_path), load_incomplete_profiles),
+        Benchmark("load_complete_profiles", lambda f: str(f.ini_path), load_complete_profiles),
+        Benchmark("save_profiles", lambda f: (str(f.directory / "saved.ini"), f.profiles), lambda a: save_profiles(*a)),
+        # from_dict splits CSV fields of the dict in place, so every run gets fresh copies
+        Benchmark(
+            "AzureProfile.from_dict",
+            lambda f: [dict(s) for s in f.sections],
+            lambda sections: [AzureProfile.from_dict(s) for s in sections],
+        ),
+        Benchmark("validate_profile_configuration", lambda f: f.profiles, validate_all),
+        Benchmark("list_invalid_resource_groups", unchanged, list_all_invalid_resource_groups),
+        Benchmark("find_secret", unchanged, find_all_secrets),
+        Benchmark(
+            "format_columns", lambda f: [p.name for p in f.profiles], lambda n: format_columns(n, FORMAT_COLUMNS)
+        ),
+    ]
+}
+
+
+def measure(benchmark: Benchmark, fixture: Fixture, repeat: int) -> Measurement:
+    """
+    Best time of the repeated runs - the run least disturbed by the rest of the system;
+    allocations of a separate run under tracemalloc, which slows Python down too much to be timed:
+    peak of memory allocated while running, and how much of it was still referenced by the result
+    """
+
+    times: List[float] = []
+    for _ in range(repeat):
+        argument = benchmark.setup(fixture)
+        gc.collect()
+        start = time.perf_counter()
+        benchmark.run(argument)
+        times.append(time.perf_counter() - start)
+
+    argument = benchmark.setup(fixture)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = benchmark.run(argument)
+        _, peak = tracemalloc.get_traced_memory()
+        gc.collect()  # eg. ConfigParser sections reference their parser; such garbage isn't retained
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    return {
+        "benchmark": benchmark.name,
+        "profiles": fixture.size,
+        "time_sec": round(min(times), 6),
+        "peak_alloc_kb": round(peak / 1024, 1),
+        "retained_kb": round(retained / 1024, 1),
+    }
+
+
+def run_benchmarks(args: argparse.Namespace) -> List[Measurement]:
+    measurements: List[Measurement] = []
+    root = Path(tempfile.mkdtemp(prefix="profiles-bench-"))
+    try:
+        for size in args.sizes:
+            fixture = Fixture.create(root, size)
+            for name in args.benchmarks:
+                measurement = measure(BENCHMARKS[name], fixture, args.repeat)
+                print(
+                    f"{name:34} {size:7} profiles: {measurement['time_sec'] * 1000:10.2f}ms"
+                    f"  {measurement['time_sec'] / size * 1e6:8.2f}us/profile"
+                    f"  peak alloc {measurement['peak_alloc_kb']:10.1f}KB"
+                    f"  retained {measurement['retained_kb']:10.1f}KB",
+                    flush=True,
+                )
+                measurements.append(measurement)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return measurements
+
+
+def parse_cmd_line() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS), help="(default: all)"
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="Numbers of profiles (default: %(default)s)"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark; best is reported (default: 3)")
+    parser.add_argument(
+        "--save",
+        nargs="?",
+        const="",
+        default=None,
+        help="Store results under the name (default: micro-<commit>) in benchmarks/results",
+    )
+    parser.add_argument("--compare", default="", help="Compare with stored results (name or path)")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=None,
+        help="Fail if any metric grew by more than the percentage against --compare results",
+    )
+    args = parser.parse_args()
+    if args.repeat < 1 or any(s < 1 for s in args.sizes):
+        parser.error("--repeat and --sizes must be at least 1")
+    if args.max_regression is not None and not args.compare:
+        parser.error("--max-regression requires --compare")
+    return args
+
+
+def main() -> int:
+    # the benchmarked functions log on every call; measure them, not the log handlers
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.ERROR)
+    args = parse_cmd_line()
+    measurements = run_benchmarks(args)
+    if args.save is not None:
+        settings = {k: v for k, v in vars(args).items() if k not in ("save", "compare", "max_regression")}
+        path = save_results(args.save or default_name(SUITE), SUITE, settings, measurements)
+        print(f"Results saved to {path}")
+
+    if args.compare:
+        baseline = load_results(args.compare)
+        regressions = compare(baseline["measurements"], measurements, KEYS, METRICS, args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.max_regression:g}%")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
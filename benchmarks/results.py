@@ -0,0 +1,95 @@
+"""Benchmark results stored per commit, and comparison of results between commits"""
+
+import json
+import logging
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+RESULTS_DIRECTORY: Path = Path(__file__).resolve().parent / "results"
+RESULTS_VERSION: int = 1
+
+Measurement = Dict[str, Any]  # identifying keys plus metrics of a single benchmark
+Regression = Tuple[str, str, float, float, float]  # benchmark, metric, baseline, current, change in percent
+
+
+def default_name(suite: str) -> str:
+    """<suite>-<commit>[-dirty], so that results of every commit are kept apart"""
+
+    def git(*args: str) -> str:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=False).stdout.strip()
+
+    commit = git("rev-parse", "--short", "HEAD") or "nocommit"
+    dirty = "-dirty" if git("status", "--porcelain", "--untracked-files=no") else ""
+    return f"{suite}-{commit}{dirty}"
+
+
+def results_path(name: str) -> Path:
+    """Name of stored results, or path of a results file"""
+
+    path = Path(name)
+    if path.suffix == ".json" or len(path.parts) > 1:
+        return path
+    return RESULTS_DIRECTORY / f"{name}.json"
+
+
+def save_results(name: str, suite: str, settings: Dict[str, Any], measurements: List[Measurement]) -> Path:
+    path = results_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        "version": RESULTS_VERSION,
+        "suite": suite,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "settings": settings,
+        "measurements": measurements,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    return path
+
+
+def load_results(name: str) -> Dict[str, Any]:
+    with open(results_path(name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(
+    baseline: List[Measurement],
+    current: List[Measurement],
+    keys: Sequence[str],
+    metrics: Sequence[str],
+    threshold_pct: Optional[float] = None,
+) -> List[Regression]:
+    """
+    Print a table of metrics of benchmarks present in both, with relative change against baseline
+    Return the benchmarks whose metric grew more than threshold_pct; none without threshold
+    """
+
+    def benchmark_id(measurement: Measurement) -> str:
+        return " ".join(str(measurement[k]) for k in keys)
+
+    baseline_by_id = {benchmark_id(m): m for m in baseline}
+    regressions: List[Regression] = []
+    print(f"{'benchmark':40} {'metric':16} {'baseline':>12} {'current':>12} {'change':>8}")
+    for measurement in current:
+        old = baseline_by_id.get(benchmark_id(measurement))
+        if old is None:
+            continue
+        for metric in metrics:
+            before, after = old.get(metric), measurement.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            flag = ""
+            if threshold_pct is not None and change > threshold_pct:
+                regressions.append((benchmark_id(measurement), metric, before, after, change))
+                flag = " REGRESSION"
+            print(f"{benchmark_id(measurement):40} {metric:16} {before:12.4g} {after:12.4g} {change:+7.1f}%{flag}")
+    return regressions
@@ -0,0 +1,20 @@
+"""
+Stand-in for the az.cli package (Azure CLI wrapper) in onboarder benchmarks: every command succeeds
+FAKE_AZ_SEC sets latency of every command in (fractional) seconds (default: 0)
+"""
+
+import os
+import time
+from typing import Any, Tuple
+
+LATENCY_SEC: float = float(os.environ.get("FAKE_AZ_SEC", "0"))
+
+
+def az(command: str) -> Tuple[int, Any, str]:
+    """Return code, result and logs, like az.cli.az"""
+
+    if LATENCY_SEC > 0:
+        time.sleep(LATENCY_SEC)
+    if command.startswith("login"):
+        return 0, [{"cloudName": "AzureCloud", "state": "Enabled"}], ""
+    return 0, {}, ""
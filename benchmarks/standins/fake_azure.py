@@ -0,0 +1,247 @@
+"""
+Stand-in for Azure AD, Azure Resource Manager and Azure Resource Graph in onboarder benchmarks
+Serves over HTTPS with a self-signed certificate - azure-identity and ARM SDK clients refuse plain HTTP for bearer
+tokens. Every subscription holds the same synthetic resource groups, see synthetic.subscription_resource_groups
+"""
+
+import datetime
+import ipaddress
+import json
+import logging
+import re
+import ssl
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from synthetic import LOCATIONS, TENANT_ID, subscription_resource_groups
+
+log = logging.getLogger(__name__)
+
+HOST: str = "localhost"
+ARM_PAGE_SIZE: int = 100  # resource groups per page of ARM listing; real ARM pages are larger, but paging matters
+TOKEN_LIFETIME_SEC: int = 3600
+
+OPENID_CONFIGURATION_PATH = re.compile(r"^/(?P<tenant>[^/]+)(/v2\.0)?/\.well-known/openid-configuration$")
+TOKEN_PATH = re.compile(r"^/(?P<tenant>[^/]+)/oauth2/v2\.0/token$")
+SUBSCRIPTION_PATH = re.compile(r"^/subscriptions/(?P<subscription>[^/]+)$")
+LOCATIONS_PATH = re.compile(r"^/subscriptions/(?P<subscription>[^/]+)/locations$")
+RESOURCE_GROUPS_PATH = re.compile(r"^/subscriptions/(?P<subscription>[^/]+)/resourcegroups$", re.IGNORECASE)
+RESOURCE_GRAPH_PATH: str = "/providers/Microsoft.ResourceGraph/resources"
+
+
+class FakeAzure:
+    """
+    Local server answering token requests of any principal, and subscription lookups and location and resource group
+    listings (ARM and Resource Graph) of any subscription; latency_sec is added to every response
+    """
+
+    def __init__(self, directory: Path, latency_sec: float = 0.0) -> None:
+        self.latency_sec = latency_sec
+        self.cert_path = directory / "fake_azure.pem"
+        key_path = directory / "fake_azure.key"
+        _write_self_signed_certificate(self.cert_path, key_path)
+
+        self._resource_groups = subscription_resource_groups()
+        self._requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((HOST, 0), _make_handler(self))
+        self._server.daemon_threads = True
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(str(self.cert_path), str(key_path))
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"https://{HOST}:{self._server.server_address[1]}"
+
+    @property
+    def requests(self) -> int:
+        """Requests served so far"""
+
+        with self._lock:
+            return self._requests
+
+    def start(self) -> None:
+        self._thread.start()
+        log.info("Fake Azure listening at %s", self.url)
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def environment(self) -> Dict[str, str]:
+        """Environment variables pointing azure-identity, AzureClient and requests at the server"""
+
+        return {
+            "AZURE_AUTHORITY_HOST": self.url,
+            "AZURE_RESOURCE_MANAGER_ENDPOINT": self.url,
+            "AZURE_RESOURCE_GRAPH_ENDPOINT": self.url,
+            "REQUESTS_CA_BUNDLE": str(self.cert_path),
+            "SSL_CERT_FILE": str(self.cert_path),
+        }
+
+    def count_request(self) -> None:
+        with self._lock:
+            self._requests += 1
+
+    def respond(self, method: str, path: str, query: Dict[str, List[str]], body: Any) -> Tuple[int, Any]:
+        """Status and JSON body of the response"""
+
+        match = OPENID_CONFIGURATION_PATH.match(path)
+        if match and method == "GET":
+            return 200, self._openid_configuration(match["tenant"])
+        match = TOKEN_PATH.match(path)
+        if match and method == "POST":
+            return 200, {
+                "token_type": "Bearer",
+                "expires_in": TOKEN_LIFETIME_SEC,
+                "ext_expires_in": TOKEN_LIFETIME_SEC,
+                "access_token": f"fake-{uuid.uuid4()}",
+            }
+        match = SUBSCRIPTION_PATH.match(path)
+        if match and method == "GET":
+            return 200, _subscription(match["subscription"])
+        match = LOCATIONS_PATH.match(path)
+        if match and method == "GET":
+            return 200, {"value": [_location(match["subscription"], l) for l in LOCATIONS]}
+        match = RESOURCE_GROUPS_PATH.match(path)
+        if match and method == "GET":
+            return 200, self._resource_groups_page(match["subscription"], path, query)
+        if path == RESOURCE_GRAPH_PATH and method == "POST":
+            return 200, self._resource_graph_page(body)
+        return 404, {"error": {"code": "NotFound", "message": f"{method} {path} is not supported by fake Azure"}}
+
+    def _openid_configuration(self, tenant: str) -> Dict[str, Any]:
+        base = f"{self.url}/{tenant}"
+        return {
+            "issuer": f"{base}/v2.0",
+            "authorization_endpoint": f"{base}/oauth2/v2.0/authorize",
+            "token_endpoint": f"{base}/oauth2/v2.0/token",
+            "device_authorization_endpoint": f"{base}/oauth2/v2.0/devicecode",
+            "tenant_region_scope": "NA",
+        }
+
+    def _resource_groups_page(self, subscription: str, path: str, query: Dict[str, List[str]]) -> Dict[str, Any]:
+        skip = int(query.get("$skiptoken", ["0"])[0])
+        groups = self._resource_groups[skip : skip + ARM_PAGE_SIZE]
+        page: Dict[str, Any] = {"value": [_resource_group(subscription, n, l) for n, l in groups]}
+        if skip + ARM_PAGE_SIZE < len(self._resource_groups):
+            next_query = {k: v[0] for k, v in query.items()}
+            next_query["$skiptoken"] = str(skip + ARM_PAGE_SIZE)
+            page["nextLink"] = f"{self.url}{path}?{urlencode(next_query)}"
+        return page
+
+    def _resource_graph_page(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Resource group queries only; any other query has no results"""
+
+        rows: List[Dict[str, Any]] = []
+        if body["query"].startswith("resourcecontainers"):
+            for subscription in body["subscriptions"]:
+                rows.extend(
+                    {"subscriptionId": subscription, "name": n, "location": l} for n, l in self._resource_groups
+                )
+        options = body.get("options", {})
+        skip = int(options.get("$skipToken") or 0)
+        top = int(options.get("$top", 1000))
+        page: Dict[str, Any] = {"data": rows[skip : skip + top], "totalRecords": len(rows)}
+        page["count"] = len(page["data"])
+        if skip + top < len(rows):
+            page["$skipToken"] = str(skip + top)
+        return page
+
+
+def _subscription(subscription: str) -> Dict[str, Any]:
+    return {
+        "id": f"/subscriptions/{subscription}",
+        "subscriptionId": subscription,
+        "tenantId": TENANT_ID,
+        "displayName": f"subscription {subscription}",
+        "state": "Enabled",
+    }
+
+
+def _location(subscription: str, name: str) -> Dict[str, Any]:
+    return {"id": f"/subscriptions/{subscription}/locations/{name}", "name": name, "displayName": name}
+
+
+def _resource_group(subscription: str, name: str, location: str) -> Dict[str, Any]:
+    return {
+        "id": f"/subscriptions/{subscription}/resourceGroups/{name}",
+        "name": name,
+        "type": "Microsoft.Resources/resourceGroups",
+        "location": location,
+        "properties": {"provisioningState": "Succeeded"},
+    }
+
+
+def _make_handler(azure: FakeAzure) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, as with real Azure endpoints
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            self._handle("GET")
+
+        def do_POST(self) -> None:  # pylint: disable=invalid-name
+            self._handle("POST")
+
+        def _handle(self, method: str) -> None:
+            azure.count_request()
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            data = self.rfile.read(length) if length else b""
+            body: Optional[Any] = None
+            if data and self.headers.get("Content-Type", "").startswith("application/json"):
+                body = json.loads(data)
+            if azure.latency_sec > 0:
+                time.sleep(azure.latency_sec)
+
+            status, response = azure.respond(method, url.path, parse_qs(url.query), body)
+            payload = json.dumps(response).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+            log.debug(format, *args)
+
+    return Handler
+
+
+def _write_self_signed_certificate(cert_path: Path, key_path: Path) -> None:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, HOST)])
+    now = datetime.datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(HOST), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+            critical=False,
+        )
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()
+        )
+    )
@@ -0,0 +1,87 @@
+"""Deterministic synthetic onboarding data: Azure profiles, the Azure subscriptions they refer to, and AWS profiles"""
+
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+LOCATIONS: Tuple[str, ...] = (
+    "eastus",
+    "eastus2",
+    "westus2",
+    "westeurope",
+    "northeurope",
+    "uksouth",
+    "japaneast",
+    "australiaeast",
+)
+AWS_REGIONS: Tuple[str, ...] = ("us-east-1", "us-west-2", "eu-west-1", "eu-central-1", "ap-southeast-2")
+TENANT_ID: str = "00000000-0000-4000-8000-00000000feed"
+PROFILES_PER_SUBSCRIPTION: int = 10  # profiles sharing subscription and principal, thus Azure API clients
+RESOURCE_GROUPS_PER_LOCATION: int = 40  # in every subscription
+MAX_RESOURCE_GROUPS_PER_PROFILE: int = 8
+STORAGE_ACCOUNT_NAME_LENGTH: int = 24  # Azure limit
+
+
+def subscription_id(profile_no: int) -> str:
+    return f"00000000-0000-4000-8000-{profile_no // PROFILES_PER_SUBSCRIPTION:012d}"
+
+
+def principal_id(profile_no: int) -> str:
+    return f"11111111-0000-4000-8000-{profile_no // PROFILES_PER_SUBSCRIPTION:012d}"
+
+
+def resource_group_name(location: str, group_no: int) -> str:
+    return f"rg-{location}-{group_no:03d}"
+
+
+def subscription_resource_groups() -> List[Tuple[str, str]]:
+    """(name, location) of resource groups existing in every synthetic subscription"""
+
+    return [(resource_group_name(l, n), l) for l in LOCATIONS for n in range(RESOURCE_GROUPS_PER_LOCATION)]
+
+
+def profile_sections(count: int, invalid_every: int = 0) -> Iterator[str]:
+    """
+    INI sections of complete profiles, with 1 to MAX_RESOURCE_GROUPS_PER_PROFILE existing resource groups
+    and a storage account for each; with invalid_every > 0, every n-th profile refers to a missing resource group
+    """
+
+    for i in range(count):
+        location = LOCATIONS[i % len(LOCATIONS)]
+        group_count = 1 + i % MAX_RESOURCE_GROUPS_PER_PROFILE
+        groups = [resource_group_name(location, (i + g * 7) % RESOURCE_GROUPS_PER_LOCATION) for g in range(group_count)]
+        if invalid_every and i % invalid_every == invalid_every - 1:
+            groups[-1] = resource_group_name(location, RESOURCE_GROUPS_PER_LOCATION + i)
+        accounts = [f"st{location}{i:x}{g}"[:STORAGE_ACCOUNT_NAME_LENGTH] for g in range(group_count)]
+        yield (
+            f"[profile-{i:06d}]\n"
+            f"name = profile-{i:06d}\n"
+            f"subscription_id = {subscription_id(i)}\n"
+            f"tenant_id = {TENANT_ID}\n"
+            f"principal_id = {principal_id(i)}\n"
+            f"principal_secret = secret-{i // PROFILES_PER_SUBSCRIPTION}\n"
+            f"location = {location}\n"
+            f"resource_group_names = {','.join(groups)}\n"
+            f"storage_account_names = {','.join(accounts)}\n"
+            f"tags = env={'prod' if i % 3 else 'dev'},team-{i % 5}\n"
+        )
+
+
+def write_profiles(file_path: Path, count: int, invalid_every: int = 0) -> None:
+    """Azure profiles file in the format of profiles.ini"""
+
+    with open(file_path, "w", encoding="utf-8") as f:
+        for section in profile_sections(count, invalid_every):
+            f.write(section + "\n")
+
+
+def write_aws_profiles(credentials_path: Path, config_path: Path, count: int) -> None:
+    """AWS shared credentials and config files with static keys and a region for every profile"""
+
+    with open(credentials_path, "w", encoding="utf-8") as credentials, open(
+        config_path, "w", encoding="utf-8"
+    ) as config:
+        for i in range(count):
+            credentials.write(
+                f"[profile-{i:06d}]\naws_access_key_id = AKIA{i:016d}\naws_secret_access_key = secret-{i}\n\n"
+            )
+            config.write(f"[profile profile-{i:06d}]\nregion = {AWS_REGIONS[i % len(AWS_REGIONS)]}\n\n")
@@ -2,17 +2,35 @@ import argparse
 import logging
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
 from dataclasses import dataclass
 from hashlib import blake2b
-from typing import Callable, List, Optional, Tuple
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import boto3.session as aws
 from botocore.exceptions import BotoCoreError
-from python_terraform import IsFlagged, IsNotFlagged, Terraform
+from python_terraform import IsFlagged, Terraform
+
+from fingerprints import FingerprintCache, configuration_hash
+from metrics import save_prometheus, save_trace
+from profile_terraform import PrefixedOutput, PrefixedStream, ProfileTerraform
+from run_report import STATUS_SKIPPED, ProfileReport, RunReport
 
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.WARNING)
 EX_FAILED: int = 1  # exit  code for failed command
+EX_CHANGES_PRESENT: int = 2  # exit code for successful "terraform plan -detailed-exitcode" with changes to apply
+MODULE_DIRECTORY: str = "../.."  # source of "kentik_aws_integration" module, see main.tf
+DEFAULT_JOBS: int = 1  # number of profiles processed concurrently
+DEFAULT_PLUGIN_CACHE_DIRECTORY: str = os.environ.get(
+    "TF_PLUGIN_CACHE_DIR", str(Path.home().joinpath(".terraform.d", "plugin-cache"))
+)
+DEFAULT_PROVIDERS_MIRROR_DIRECTORY: str = "terraform_providers_mirror"  # local provider mirror for offline mode
+PLANS_DIRECTORY: str = "plans"  # saved Terraform plans, one per workspace
+PROFILE_LOGS_DIRECTORY: str = "profile_logs"  # Terraform output of the last run, one log file per profile
 
 
 @dataclass
@@ -23,34 +41,162 @@ class AwsProfile:
     secret_key: str
 
 
-TerraformAction = Callable[[Terraform, str], bool]  # terraform plan/apply/destroy for specified region
+TerraformAction = Callable[[Terraform, str, str], bool]  # terraform plan/apply/destroy for workspace and region
 RequestedProfileNames = Optional[List[str]]  # list of profile names matching profiles in ~/.aws/credentials
 
 
-# execute an action for every profile
-def execute_action(action: TerraformAction, profiles: List[AwsProfile]) -> bool:
-    t = Terraform()
-    successful_count = 0
+# initialize Terraform working directory once, before any profile is processed; all workspaces share it.
+# Providers are installed through the plugin cache shared by all runs, or - in offline mode - from local providers
+# mirror, which is populated from the registry only when it doesn't exist yet (warm-up)
+def init_terraform(plugin_cache_dir: str, mirror_dir: str, offline: bool) -> bool:
+    Path(plugin_cache_dir).mkdir(parents=True, exist_ok=True)
+    env = os.environ.copy()
+    env["TF_PLUGIN_CACHE_DIR"] = str(Path(plugin_cache_dir).resolve())
+    t = ProfileTerraform(env)
+
+    init_options: Dict[str, Any] = {}
+    if offline:
+        mirror_path = Path(mirror_dir).resolve()
+        if not mirror_path.is_dir() or not any(mirror_path.iterdir()):
+            print(f'Populating Terraform providers mirror "{mirror_path}"')
+            return_code, stdout, stderr = t.cmd("providers mirror", str(mirror_path))
+            if return_code != os.EX_OK:
+                report_tf_output(return_code, stdout, stderr)
+                return False
+        init_options["plugin_dir"] = str(mirror_path)  # -plugin-dir disables provider installation from registry
+
+    print("Initializing Terraform")
+    return_code, stdout, stderr = t.init(**init_options)
+    if return_code != os.EX_OK:
+        report_tf_output(return_code, stdout, stderr)
+        return False
+    return True
+
+
+# execute an action for every profile, processing up to "jobs" profiles concurrently.
+# With fingerprints cache, plan and apply skip profiles unchanged since their last successful apply, unless forced.
+# With report, outcome, duration and resource changes of every phase of every profile are added to it
+def execute_action(
+    action: TerraformAction,
+    profiles: List[AwsProfile],
+    jobs: int = DEFAULT_JOBS,
+    fingerprints: Optional[FingerprintCache] = None,
+    force: bool = False,
+    report: Optional[RunReport] = None,
+) -> bool:
+    # AWS profiles are mapped to Terraform workspaces; names are generated upfront as they must be unique in the run
+    pending: List[Tuple[AwsProfile, str]] = []
+    skipped: List[ProfileReport] = []
     for profile in profiles:
-        print(f'Profile: "{profile.name}" ({profile.region})')
+        workspace = prepare_workspace_name(profile.name)
+        if fingerprints is not None and action is not action_destroy and not force:
+            if fingerprints.is_unchanged(workspace, profile_inputs(profile)):
+                print(f'Profile: "{profile.name}" unchanged since last successful apply. Skipped')
+                skipped.append(ProfileReport(profile.name, workspace, status=STATUS_SKIPPED))
+                continue
+        pending.append((profile, workspace))
+
+    results: List[bool] = []
+    profile_reports: List[ProfileReport] = []
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(execute_profile_in_worker, action, p, w) for p, w in pending]
+            for future in futures:  # collect results in the order of profiles
+                successful, profile_report = future.result()
+                results.append(successful)
+                profile_reports.append(profile_report)
+    else:
+        for p, w in pending:
+            profile_reports.append(ProfileReport(p.name, w))
+            results.append(execute_profile(action, p, w, profile_reports[-1]))
 
-        os.environ["AWS_ACCESS_KEY_ID"] = profile.access_key
-        os.environ["AWS_SECRET_ACCESS_KEY"] = profile.secret_key
-        workspace = prepare_workspace_name(profile.name)  # AWS profiles are mapped to Terraform workspaces
+    if report is not None:
+        for profile_report in profile_reports + skipped:
+            report.add(profile_report)
 
-        if prepare_workspace(t, workspace) and action(t, profile.region):
-            successful_count += 1
+    if fingerprints is not None:
+        update_fingerprints(fingerprints, action, pending, results)
 
+    successful_count = len(profiles) - len(pending) + results.count(True)
     print(f"Terraform action successfully executed for {successful_count}/{len(profiles)} AWS profile(s).")
     return successful_count == len(profiles)
 
 
+# remember profiles successfully applied; forget profiles destroyed or failed to apply
+def update_fingerprints(
+    fingerprints: FingerprintCache, action: TerraformAction, profiles: List[Tuple[AwsProfile, str]], results: List[bool]
+) -> None:
+    for (profile, workspace), successful in zip(profiles, results):
+        if action is action_apply and successful:
+            fingerprints.record_applied(workspace, profile_inputs(profile))
+        elif action is not action_plan:
+            fingerprints.forget(workspace)
+
+    if not fingerprints.save():
+        log.warning("Failed to save profile fingerprints")
+
+
+# everything that makes a workspace differ from the others
+def profile_inputs(profile: AwsProfile) -> Dict[str, str]:
+    return {"region": profile.region, "access_key": profile.access_key, "secret_key": profile.secret_key}
+
+
+# execute an action for single profile; credentials and workspace are passed to Terraform in its environment only.
+# Terraform output is streamed live to the console, prefixed with the profile name, and to the profile's log file.
+# Every Terraform command is recorded in report as a phase
+def execute_profile(action: TerraformAction, profile: AwsProfile, workspace: str, report: ProfileReport) -> bool:
+    print(f'Profile: "{profile.name}" ({profile.region})')
+    start = time.monotonic()
+    successful = execute_profile_commands(action, profile, workspace, report)
+    report.finish(successful, time.monotonic() - start)
+    return successful
+
+
+def execute_profile_commands(
+    action: TerraformAction, profile: AwsProfile, workspace: str, report: ProfileReport
+) -> bool:
+    env = os.environ.copy()
+    env["AWS_ACCESS_KEY_ID"] = profile.access_key
+    env["AWS_SECRET_ACCESS_KEY"] = profile.secret_key
+    env.pop("TF_WORKSPACE", None)  # "terraform workspace" commands refuse to work when TF_WORKSPACE is set
+
+    log_path = Path(PROFILE_LOGS_DIRECTORY, f"{profile.name}.log")
+    log_path.parent.mkdir(exist_ok=True)
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        t = ProfileTerraform(env, PrefixedOutput(profile.name, log_file), report)
+        with report.phase("prepare_workspace") as phase:
+            phase.successful = prepare_workspace(t, workspace)
+        if not phase.successful:
+            return False
+
+        # TF_WORKSPACE overrides workspace selected in shared .terraform directory, which other workers may switch
+        t.env["TF_WORKSPACE"] = workspace
+        return action(t, workspace, profile.region)
+
+
+# execute an action for single profile in worker process. Everything printed on the way goes to the console live,
+# prefixed with the profile name like Terraform output, so that status lines of the profile are in line with its output
+def execute_profile_in_worker(
+    action: TerraformAction, profile: AwsProfile, workspace: str
+) -> Tuple[bool, ProfileReport]:
+    output = PrefixedOutput(profile.name)
+    stdout, stderr = PrefixedStream(output, is_stderr=False), PrefixedStream(output, is_stderr=True)
+    report = ProfileReport(profile.name, workspace)
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            successful = execute_profile(action, profile, workspace, report)
+    finally:
+        stdout.flush()
+        stderr.flush()
+    return successful, report
+
+
 # create or just switch workspace
 def prepare_workspace(t: Terraform, workspace: str) -> bool:
     print(f'Preparing TF workspace "{workspace}"')
 
-    # try switch to workspace
-    return_code, _, _ = t.set_workspace(workspace)
+    # try switch to workspace; output captured, failure is expected for new workspace
+    return_code, _, _ = t.cmd("workspace", "select", workspace, capture_output=True)
     if return_code == os.EX_OK:
         print("Workspace activated")
         return True
@@ -67,22 +213,61 @@ def prepare_workspace(t: Terraform, workspace: str) -> bool:
 
 
 # TerraformAction
-def action_plan(t: Terraform, region: str) -> bool:
-    code, stdout, stderr = t.plan(detailed_exitcode=IsNotFlagged, var=f"region={region}")
+def action_plan(t: Terraform, workspace: str, region: str) -> bool:
+    try:
+        return save_plan(t, workspace, region) != EX_FAILED
+    finally:
+        remove_plan(workspace)
+
+
+# TerraformAction; apply the plan saved just before, skip apply entirely when the plan contains no changes
+def action_apply(t: Terraform, workspace: str, region: str) -> bool:
+    try:
+        code = save_plan(t, workspace, region)
+        if code == EX_FAILED:
+            return False
+
+        if code == os.EX_OK:
+            print("No changes. Apply skipped")
+            print()
+            return True
+
+        # variables are already in the plan - Terraform refuses any -var/-var-file when applying saved plan
+        code, stdout, stderr = t.apply(str(plan_file_path(workspace)), skip_plan=True, var=None, json=IsFlagged)
+        report_tf_output(code, stdout, stderr)
+        return code != EX_FAILED
+    finally:
+        remove_plan(workspace)
+
+
+# run terraform plan and save the plan to workspace plan file
+# return detailed exit code: EX_OK - no changes, EX_CHANGES_PRESENT - plan has changes, EX_FAILED - failure
+def save_plan(t: Terraform, workspace: str, region: str) -> int:
+    plan_path = plan_file_path(workspace)
+    plan_path.parent.mkdir(exist_ok=True)
+    code, stdout, stderr = t.plan(
+        detailed_exitcode=IsFlagged, out=str(plan_path), var=f"region={region}", json=IsFlagged
+    )
     report_tf_output(code, stdout, stderr)
-    return code != EX_FAILED
+    return code
 
 
-# TerraformAction
-def action_apply(t: Terraform, region: str) -> bool:
-    code, stdout, stderr = t.apply(skip_plan=True, var=f"region={region}")  # skip_plan means auto-approve
-    report_tf_output(code, stdout, stderr)
-    return code != EX_FAILED
+def plan_file_path(workspace: str) -> Path:
+    return Path(PLANS_DIRECTORY, f"{workspace}.tfplan")
+
+
+# saved plan holds the variables in plaintext; it must not outlive the action
+def remove_plan(workspace: str) -> None:
+    plan_path = plan_file_path(workspace)
+    if plan_path.exists():
+        plan_path.unlink()
 
 
 # TerraformAction
-def action_destroy(t: Terraform, region: str) -> bool:
-    code, stdout, stderr = t.apply(destroy=IsFlagged, skip_plan=True, var=f"region={region}")  # auto-approve
+def action_destroy(t: Terraform, _workspace: str, region: str) -> bool:
+    code, stdout, stderr = t.apply(
+        destroy=IsFlagged, skip_plan=True, var=f"region={region}", json=IsFlagged
+    )  # auto-approve
     report_tf_output(code, stdout, stderr)
     return code != EX_FAILED
 
@@ -116,6 +301,8 @@ def report_tf_output(return_code: int, stdout: str, stderr: str) -> None:
         print("Success")
     elif return_code == EX_FAILED:
         print("FAILED", file=sys.stderr)
+    elif return_code == EX_CHANGES_PRESENT:
+        print("Success, changes to apply are present")
     else:
         print("Return code: ", return_code)  # Terraform uses codes > 1 for reporting detailed status
 
@@ -158,7 +345,7 @@ def get_aws_profiles(requested: RequestedProfileNames) -> List[AwsProfile]:
     return profiles
 
 
-def parse_cmd_line() -> Tuple[TerraformAction, RequestedProfileNames]:
+def parse_cmd_line() -> Tuple[TerraformAction, RequestedProfileNames, argparse.Namespace]:
     ACTIONS = {"plan": action_plan, "apply": action_apply, "destroy": action_destroy}
     ALL_PROFILES = "*"
     parser = argparse.ArgumentParser()
@@ -168,14 +355,83 @@ def parse_cmd_line() -> Tuple[TerraformAction, RequestedProfileNames]:
         required=True,
         help=f'Required. List of AWS profiles, eg. profile1,profile2,profile3. Use "{ALL_PROFILES}" to select all profiles',
     )
+    parser.add_argument(
+        "--jobs", type=int, default=DEFAULT_JOBS, help="Number of profiles to process concurrently (default: 1)"
+    )
+    parser.add_argument(
+        "--plugin-cache-dir",
+        default=DEFAULT_PLUGIN_CACHE_DIRECTORY,
+        help="Terraform provider plugin cache shared by all runs (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--providers-mirror-dir",
+        default=DEFAULT_PROVIDERS_MIRROR_DIRECTORY,
+        help="Local Terraform providers mirror used in offline mode (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--offline",
+        default=False,
+        action="store_true",
+        help="Install providers only from the local mirror; the mirror is populated once if it doesn't exist",
+    )
+    parser.add_argument(
+        "--force",
+        default=False,
+        action="store_true",
+        help="Process also profiles unchanged since their last successful apply",
+    )
+    parser.add_argument(
+        "--report",
+        default="",
+        help="Save JSON report with outcome, duration and resource changes of every phase of every profile",
+    )
+    parser.add_argument("--junit", default="", help="Save the report also as JUnit XML, a test case per profile")
+    parser.add_argument(
+        "--metrics",
+        default="",
+        help="Save phase durations and Terraform exit codes in Prometheus text format (textfile collector)",
+    )
+    parser.add_argument("--trace", default="", help="Save the run, every profile and every phase as JSON lines")
     args = parser.parse_args()
-    return ACTIONS[args.action], args.profiles.split(",") if args.profiles != ALL_PROFILES else None
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    profiles = args.profiles.split(",") if args.profiles != ALL_PROFILES else None
+    return ACTIONS[args.action], profiles, args
+
+
+# save the reports requested on command line; return False if any failed to save
+def save_reports(report: RunReport, args: argparse.Namespace) -> bool:
+    successful = True
+    if args.report and not report.save_json(args.report):
+        successful = False
+    if args.junit and not report.save_junit(args.junit):
+        successful = False
+    if args.metrics and not save_prometheus(report, args.metrics, "aws"):
+        successful = False
+    if args.trace and not save_trace(report, args.trace):
+        successful = False
+    return successful
 
 
 if __name__ == "__main__":
     check_kentik_credentials()
-    terraform_action, requested_profiles = parse_cmd_line()
-    aws_profiles = get_aws_profiles(requested_profiles)
-    execution_successful = execute_action(terraform_action, aws_profiles)
+    terraform_action, requested_profiles, cmd_line_args = parse_cmd_line()
+    run_report = RunReport(cmd_line_args.action)
+    with run_report.phase("get_aws_profiles") as credentials_phase:
+        aws_profiles = get_aws_profiles(requested_profiles)
+        credentials_phase.successful = True  # profiles without credentials are reported and skipped
+    with run_report.phase("init") as init_phase:
+        init_phase.successful = init_terraform(
+            cmd_line_args.plugin_cache_dir, cmd_line_args.providers_mirror_dir, cmd_line_args.offline
+        )
+    if not init_phase.successful:
+        save_reports(run_report, cmd_line_args)
+        sys.exit(EX_FAILED)
+    profile_fingerprints = FingerprintCache(configuration_hash(MODULE_DIRECTORY))
+    execution_successful = execute_action(
+        terraform_action, aws_profiles, cmd_line_args.jobs, profile_fingerprints, cmd_line_args.force, run_report
+    )
+    if not save_reports(run_report, cmd_line_args):
+        execution_successful = False
     exit_code = os.EX_OK if execution_successful else EX_FAILED
     sys.exit(exit_code)
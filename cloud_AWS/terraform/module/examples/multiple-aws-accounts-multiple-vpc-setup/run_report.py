@@ -0,0 +1,176 @@
+import json
+import logging
+import time
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+log = logging.getLogger(__name__)
+
+REPORT_VERSION: int = 1
+STATUS_SUCCESSFUL: str = "successful"
+STATUS_FAILED: str = "failed"
+STATUS_SKIPPED: str = "skipped"  # unchanged since last successful apply
+STATUS_INVALID: str = "invalid"  # profile configuration invalid or missing
+
+
+@dataclass
+class PhaseReport:
+    """Single step of processing a profile, eg. login, or a Terraform command"""
+
+    name: str
+    successful: bool = False
+    start_time: float = 0.0  # seconds since the epoch
+    duration_sec: float = 0.0
+    exit_code: Optional[int] = None  # Terraform commands only
+    retries: int = 0  # transient failures retried, eg. of Azure CLI commands
+    add: int = 0  # resources to add, or added; from Terraform change summary
+    change: int = 0
+    remove: int = 0
+
+    def count_retry(self, _attempt: int, _err: Exception) -> None:
+        """RetryHandler"""
+
+        self.retries += 1
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        """Consume single message of Terraform machine-readable (-json) UI output"""
+
+        if event.get("type") == "change_summary":
+            changes = event.get("changes", {})
+            self.add = changes.get("add", 0)
+            self.change = changes.get("change", 0)
+            self.remove = changes.get("remove", 0)
+
+
+@dataclass
+class ProfileReport:
+    name: str
+    workspace: str
+    status: str = STATUS_FAILED  # until the profile is processed successfully
+    start_time: float = 0.0  # seconds since the epoch
+    duration_sec: float = 0.0
+    message: str = ""  # reason of invalid status
+    phases: List[PhaseReport] = field(default_factory=list)
+
+    def phase(self, name: str) -> ContextManager[PhaseReport]:
+        """Time the phase; the caller sets its outcome"""
+
+        return _timed_phase(name, self.phases)
+
+    def finish(self, successful: bool, duration_sec: float) -> None:
+        self.status = STATUS_SUCCESSFUL if successful else STATUS_FAILED
+        self.start_time = round(time.time() - duration_sec, 3)
+        self.duration_sec = round(duration_sec, 3)
+
+
+class RunReport:
+    """
+    Outcome of every profile of an onboarder run, saved as JSON and/or JUnit XML
+    Phases not specific to any profile, eg. Terraform init, are recorded in the run itself
+    """
+
+    def __init__(self, action: str) -> None:
+        self.action = action
+        self.started = datetime.now()
+        self.profiles: List[ProfileReport] = []
+        self.phases: List[PhaseReport] = []
+        self._start = time.monotonic()
+
+    def add(self, profile: ProfileReport) -> None:
+        self.profiles.append(profile)
+
+    def phase(self, name: str) -> ContextManager[PhaseReport]:
+        """Time the run-wide phase; the caller sets its outcome"""
+
+        return _timed_phase(name, self.phases)
+
+    def duration_sec(self) -> float:
+        """Since the run started"""
+
+        return round(time.monotonic() - self._start, 3)
+
+    def totals(self) -> Dict[str, int]:
+        totals = {"profiles": len(self.profiles), "add": 0, "change": 0, "remove": 0}
+        for status in (STATUS_SUCCESSFUL, STATUS_FAILED, STATUS_SKIPPED, STATUS_INVALID):
+            totals[status] = sum(1 for p in self.profiles if p.status == status)
+        for profile in self.profiles:
+            # the last phase reporting changes is the most accurate one, eg. apply after plan
+            changed = [p for p in profile.phases if p.add or p.change or p.remove]
+            if changed:
+                totals["add"] += changed[-1].add
+                totals["change"] += changed[-1].change
+                totals["remove"] += changed[-1].remove
+        return totals
+
+    def save_json(self, file_path: str) -> bool:
+        data = {
+            "version": REPORT_VERSION,
+            "action": self.action,
+            "started": self.started.isoformat(),
+            "duration_sec": self.duration_sec(),
+            "totals": self.totals(),
+            "phases": [asdict(p) for p in self.phases],
+            "profiles": [asdict(p) for p in self.profiles],
+        }
+        try:
+            with open(file_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+        except OSError:
+            log.exception("Failed to save run report '%s'", file_path)
+            return False
+        return True
+
+    def save_junit(self, file_path: str) -> bool:
+        """Profile is a test case; failed and invalid profiles are failures, skipped ones are skipped"""
+
+        totals = self.totals()
+        suite = ET.Element(
+            "testsuite",
+            name=f"onboarder {self.action}",
+            tests=str(totals["profiles"]),
+            failures=str(totals[STATUS_FAILED] + totals[STATUS_INVALID]),
+            skipped=str(totals[STATUS_SKIPPED]),
+            timestamp=self.started.isoformat(timespec="seconds"),
+            time=f"{self.duration_sec():.3f}",
+        )
+        for profile in self.profiles:
+            case = ET.SubElement(
+                suite, "testcase", classname=self.action, name=profile.name, time=f"{profile.duration_sec:.3f}"
+            )
+            if profile.status == STATUS_SKIPPED:
+                ET.SubElement(case, "skipped", message="unchanged since last successful apply")
+            elif profile.status == STATUS_INVALID:
+                ET.SubElement(case, "failure", message=profile.message or "invalid profile")
+            elif profile.status == STATUS_FAILED:
+                failed = [p.name for p in profile.phases if not p.successful]
+                ET.SubElement(case, "failure", message=f"failed phase: {', '.join(failed) or 'unknown'}")
+            ET.SubElement(case, "system-out").text = "\n".join(_describe_phase(p) for p in profile.phases)
+        try:
+            ET.ElementTree(suite).write(file_path, encoding="utf-8", xml_declaration=True)
+        except OSError:
+            log.exception("Failed to save JUnit report '%s'", file_path)
+            return False
+        return True
+
+
+@contextmanager
+def _timed_phase(name: str, phases: List[PhaseReport]) -> Iterator[PhaseReport]:
+    phase = PhaseReport(name, start_time=round(time.time(), 3))
+    start = time.monotonic()
+    try:
+        yield phase
+    finally:
+        phase.duration_sec = round(time.monotonic() - start, 3)
+        phases.append(phase)
+
+
+def _describe_phase(phase: PhaseReport) -> str:
+    text = f"{phase.name}: {'ok' if phase.successful else 'FAILED'} in {phase.duration_sec:.3f}s"
+    if phase.retries:
+        text += f", {phase.retries} retries"
+    if phase.exit_code is not None:
+        text += f", exit code {phase.exit_code}, +{phase.add} ~{phase.change} -{phase.remove}"
+    return text
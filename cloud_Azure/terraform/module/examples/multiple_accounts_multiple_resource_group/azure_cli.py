@@ -1,51 +1,85 @@
 import logging
-import time
 from typing import Any, Optional
 
 from az.cli import az
 
+from retry import PERMANENT, TRANSIENT, ErrorClass, RetryHandler, RetryPolicy, call_with_retry
+
 log = logging.getLogger(__name__)
 
 EX_OK: int = 0  # exit code for successful command
+DEFAULT_DEADLINE_SEC: float = 120.0  # time budget for a command, including retries
+
+# Azure CLI reports errors only as text; these fragments (lower case) identify errors worth retrying
+TRANSIENT_ERROR_MARKERS = (
+    "toomanyrequests",
+    "too many requests",
+    "throttl",
+    "timed out",
+    "timeout",
+    "temporarily unavailable",
+    "serviceunavailable",
+    "service unavailable",
+    "internalservererror",
+    "badgateway",
+    "connection aborted",
+    "connectionerror",
+    "aadsts700016",  # application not found in the directory - just created, not replicated yet
+)
+
+
+class AzureCliError(Exception):
+    def __init__(self, return_code: int, logs: str) -> None:
+        super().__init__(f"Azure CLI command failed with code {return_code}: {logs}")
+        self.return_code = return_code
+        self.logs = logs
 
 
-def az_cli(command: str, max_attempts: int = 1) -> Optional[Any]:
+def az_cli(
+    command: str,
+    max_attempts: int = 1,
+    deadline_sec: float = DEFAULT_DEADLINE_SEC,
+    on_retry: Optional[RetryHandler] = None,
+) -> Optional[Any]:
     """
     Azure CLI commands issued in a quick succession may fail,
-    eg. when trying to configure a resource that is still being created
-    So, allow optional retry with exponential backoff
+    eg. when trying to configure a resource that is still being created, or when throttled
+    So, allow optional retry of transient failures, with jittered exponential backoff and overall time budget
     """
 
-    wait_sec = 1
-    while max_attempts:
-        data = _az_cli(command)
-        if data is not None:
-            return data
-        max_attempts -= 1
-        if max_attempts == 0:
-            break
-        print(f"Retrying Azure CLI command in {wait_sec} second(s)... (remaining attempts: {max_attempts})")
-        time.sleep(wait_sec)
-        wait_sec = wait_sec * 2
+    policy = RetryPolicy(max_attempts=max_attempts, deadline_sec=deadline_sec)
+    try:
+        # note: command is not used in the description as it may contain secrets
+        return call_with_retry(lambda: _az_cli(command), classify_az_cli_error, policy, "Azure CLI command", on_retry)
+    except (AzureCliError, ValueError):
+        return None  # all attempts failed
+
+
+def classify_az_cli_error(err: Exception) -> ErrorClass:
+    if not isinstance(err, AzureCliError):
+        return PERMANENT
 
-    return None  # all attempts failed
+    logs = err.logs.lower()
+    if any(marker in logs for marker in TRANSIENT_ERROR_MARKERS):
+        return TRANSIENT
+    return PERMANENT
 
 
-def _az_cli(command: str) -> Optional[Any]:
+def _az_cli(command: str) -> Any:
     """
     Return type specific to the command on success
     Empty result is represented as empty dict (az wrapper feature)
-    Return None on Azure CLI command execution error
+    Raise AzureCliError on Azure CLI command execution error
     """
 
     try:
         return_code, data, logs = az(command)
     except ValueError:
         log.exception("Failed to execute Azure CLI command")
-        return None
+        raise
 
     if return_code != EX_OK:
         log.error("Failed to execute Azure CLI command. Error message: '%s'. Error code: %d", logs.strip(), return_code)
-        return None
+        raise AzureCliError(return_code, logs.strip())
 
     return data
@@ -1,24 +1,67 @@
+import hashlib
 import logging
+import os
+import threading
+import time
 import uuid
-from dataclasses import dataclass
-from typing import List, Type, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Type, TypeVar
 
-from azure.core.exceptions import AzureError
+from azure.core.exceptions import AzureError, HttpResponseError, ServiceRequestError, ServiceResponseError
 from azure.core.pipeline import PipelineContext, PipelineRequest
 from azure.core.pipeline.policies import BearerTokenCredentialPolicy
 from azure.core.pipeline.transport import HttpRequest
-from azure.identity import ClientSecretCredential, DefaultAzureCredential, InteractiveBrowserCredential
+from azure.identity import (
+    ClientSecretCredential,
+    DefaultAzureCredential,
+    InteractiveBrowserCredential,
+    TokenCachePersistenceOptions,
+)
 from azure.identity._internal.msal_credentials import MsalCredential
-from azure.mgmt.authorization import AuthorizationManagementClient
-from azure.mgmt.authorization.models import RoleAssignmentCreateParameters
-from azure.mgmt.resource import ResourceManagementClient, SubscriptionClient
-from msgraph.core import GraphClient
 from msrest.authentication import BasicTokenAuthentication
-from requests.exceptions import HTTPError
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import HTTPError, RequestException, Timeout
+
+from retry import (
+    PERMANENT,
+    TRANSIENT,
+    TRANSIENT_HTTP_STATUSES,
+    ErrorClass,
+    RetryPolicy,
+    call_with_retry,
+    classify_http_status,
+    parse_retry_after,
+)
+
+if TYPE_CHECKING:
+    # SDK clients are imported on first use only; most code paths need just one or two of them
+    from azure.mgmt.authorization import AuthorizationManagementClient
+    from azure.mgmt.resource import ResourceManagementClient, SubscriptionClient
+    from msgraph.core import GraphClient
+
+    from resource_graph import ResourceGraphClient
 
 AZURE_OWNER_ROLE = "8e3af657-a8ff-443c-a75c-2fe8c4bcb635"
 AZURE_READ_WRITE_ALL_PERMISSION = "1bfefb4e-e0b5-418b-a88f-73c46d2cc8e9"
 MICROSOFT_GRAPH_API = "00000003-0000-0000-c000-000000000000"
+ARM_SCOPE = "https://management.azure.com/.default"
+# endpoints can be overridden, eg. to point at local fake Azure AD and ARM servers; azure-identity reads the former too
+AUTHORITY_HOST: Optional[str] = os.environ.get("AZURE_AUTHORITY_HOST")
+ARM_ENDPOINT: str = os.environ.get("AZURE_RESOURCE_MANAGER_ENDPOINT", "https://management.azure.com")
+MS_GRAPH_API_PRINCIPAL_QUERY = f"/servicePrincipals?$filter=appId%20eq%20'{MICROSOFT_GRAPH_API}'&$select=id,appId"
+
+SDK_RETRY_POLICY = RetryPolicy(max_attempts=5, base_delay_sec=1.0, max_delay_sec=30.0, deadline_sec=120.0)
+
+RESOURCE_GROUP_INDEX_TTL_SEC: float = 300.0  # how long listed resource groups are considered up to date
+
+NETWORK_SECURITY_GROUP_TYPE = "Microsoft.Network/networkSecurityGroups"
+VIRTUAL_NETWORK_TYPE = "Microsoft.Network/virtualNetworks"
+
+# on-disk MSAL token cache shared by all credentials and all runs, encrypted with the platform user data protection API
+TOKEN_CACHE_NAME: str = "kentik_onboarder"
+UNENCRYPTED_TOKEN_CACHE_VARIABLE: str = "ONBOARDER_ALLOW_UNENCRYPTED_TOKEN_CACHE"  # "1": plaintext cache if need be
 
 log = logging.getLogger(__name__)
 
@@ -27,18 +70,29 @@ class AzureClientError(Exception):
     pass
 
 
-def wrap_sdk_api_exceptions(msg: str = ""):
+class GraphBatchRetryError(Exception):
+    """Some requests of MS Graph JSON batch failed with transient status and are to be sent again"""
+
+    def __init__(self, request_ids: List[str], retry_after_sec: Optional[float]) -> None:
+        super().__init__(f"Transient failure of batch requests: {', '.join(request_ids)}")
+        self.retry_after_sec = retry_after_sec
+
+
+def wrap_sdk_api_exceptions(msg: str = "", retry: bool = True):
     """
     This is to handle the two separate Azure error hierarchies under AzureClientError:
     AzureSDK may raise AzureError
-    MS Graph API may raise HTTPError
+    MS Graph API may raise HTTPError (or other RequestException)
+    Transient errors are retried according to SDK_RETRY_POLICY; use retry=False for non-idempotent operations
     """
 
     def outer(func):
         def inner(*args, **kwargs):
             try:
-                return func(*args, **kwargs)
-            except (AzureError, HTTPError) as err:
+                if not retry:
+                    return func(*args, **kwargs)
+                return call_with_retry(lambda: func(*args, **kwargs), classify_sdk_api_error, SDK_RETRY_POLICY, msg)
+            except (AzureError, RequestException) as err:
                 raise AzureClientError(msg) from err
 
         return inner
@@ -46,6 +100,25 @@ def wrap_sdk_api_exceptions(msg: str = ""):
     return outer
 
 
+def classify_sdk_api_error(err: Exception) -> ErrorClass:
+    """Tell transient errors (throttling, server trouble, network) from permanent ones, for both error hierarchies"""
+
+    if isinstance(err, (ServiceRequestError, ServiceResponseError, RequestsConnectionError, Timeout)):
+        return TRANSIENT
+    if isinstance(err, (HttpResponseError, HTTPError)) and err.response is not None:
+        status = err.response.status_code
+        return classify_http_status(status, err.response.headers)
+    return PERMANENT
+
+
+def classify_role_assignment_error(err: Exception) -> ErrorClass:
+    """Like classify_sdk_api_error; ServicePrincipal just created may not have replicated yet, which is transient too"""
+
+    if isinstance(err, HttpResponseError) and getattr(err.error, "code", None) == "PrincipalNotFound":
+        return TRANSIENT
+    return classify_sdk_api_error(err)
+
+
 @dataclass
 class ServicePrincipal:
     app_id: str = ""
@@ -56,6 +129,7 @@ class ServicePrincipal:
 class AppRegistration:
     obj_id: str
     principal: ServicePrincipal
+    principal_obj_id: str = ""  # object ID of the ServicePrincipal, as opposed to its app_id
 
 
 @dataclass
@@ -68,7 +142,70 @@ class LoginCredentials:
 
     tenant_id: str
     subscription_id: str = ""
-    principal: ServicePrincipal = ServicePrincipal()
+    principal: ServicePrincipal = field(default_factory=ServicePrincipal)
+
+
+class Registry:
+    """
+    Thread-safe map of objects created on demand; an object is created at most once per key
+    Creation of objects under different keys can run concurrently
+    """
+
+    def __init__(self) -> None:
+        self._items: Dict[Hashable, Any] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            if key not in self._items:
+                self._items[key] = factory()  # nothing is stored if factory raises
+            return self._items[key]
+
+
+def secret_digest(secret: str) -> str:
+    """Registry keys must tell different secrets apart, but mustn't keep the secrets themselves"""
+
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+_credentials = Registry()  # azure-identity credentials, reused so that their in-memory token caches are reused too
+_clients = Registry()  # AzureClients by login data
+_ms_graph_object_ids: Dict[str, str] = {}  # object ID of MS Graph API ServicePrincipal by TenantID; never changes
+
+
+class ResourceGroupIndex:
+    """Resource group names of a subscription, grouped by location, as listed at a point in time"""
+
+    def __init__(self, groups: Iterable[Tuple[str, str]]) -> None:
+        """groups: (name, location) pairs"""
+
+        self._by_location: Dict[str, List[str]] = {}
+        for name, location in groups:
+            self._by_location.setdefault(location.lower(), []).append(name)
+        for names in self._by_location.values():
+            names.sort()
+        # resource group names are case-insensitive in Azure
+        self._folded_by_location = {l: {n.casefold() for n in names} for l, names in self._by_location.items()}
+        self._created = time.monotonic()
+
+    def expired(self, ttl_sec: float) -> bool:
+        return time.monotonic() - self._created > ttl_sec
+
+    def names(self, location: str) -> List[str]:
+        return list(self._by_location.get(location.lower(), []))
+
+    def by_location(self) -> Dict[str, List[str]]:
+        return {location: list(names) for location, names in self._by_location.items()}
+
+    def missing(self, location: str, names: Iterable[str]) -> List[str]:
+        """Names as given, compared case-insensitively"""
+
+        available = self._folded_by_location.get(location.lower(), set())
+        return sorted({n for n in names if n.casefold() not in available})
 
 
 AzureClientType = TypeVar("AzureClientType", bound="AzureClient")
@@ -76,46 +213,178 @@ AzureClientType = TypeVar("AzureClientType", bound="AzureClient")
 
 class AzureClient:
     @classmethod
-    def login_user(cls: Type[AzureClientType], tenant_id: str, subscription_id: str = "") -> AzureClientType:
-        """Interactive (browser-based) login"""
+    def login_user(
+        cls: Type[AzureClientType],
+        tenant_id: str,
+        subscription_id: str = "",
+        verify_credentials: bool = True,
+        use_resource_graph: bool = False,
+    ) -> AzureClientType:
+        """
+        Interactive (browser-based) login
+        Client and credential are reused for repeated logins with the same tenant_id and subscription_id
+        """
 
         if tenant_id == "":
             raise AzureClientError("Failed to initialize client - tenant_id is required")
 
-        cred = InteractiveBrowserCredential(tenant_id=tenant_id)
-        return cls(cred, tenant_id, subscription_id)
+        def create_credential() -> InteractiveBrowserCredential:
+            return InteractiveBrowserCredential(tenant_id=tenant_id, **token_cache_options(), **credential_options())
+
+        def create_client() -> AzureClientType:
+            cred = _credentials.get_or_create(("user", tenant_id), create_credential)
+            return cls(cred, tenant_id, subscription_id, verify_credentials, use_resource_graph)
+
+        client = _clients.get_or_create((cls, "user", tenant_id, subscription_id, use_resource_graph), create_client)
+        if verify_credentials:
+            client._check_credentials_working()  # reused client may have been created unverified
+        return client
 
     @classmethod
-    def login_application(cls: Type[AzureClientType], lc: LoginCredentials) -> AzureClientType:
-        """Programmatic login"""
+    def login_application(
+        cls: Type[AzureClientType],
+        lc: LoginCredentials,
+        verify_credentials: bool = True,
+        use_resource_graph: bool = False,
+    ) -> AzureClientType:
+        """
+        Programmatic login
+        Client and credential are reused for repeated logins with the same tenant, principal and subscription_id
+        """
 
         if lc.tenant_id == "" or lc.principal.app_id == "" or lc.principal.secret == "":
             raise AzureClientError("Failed to initialize client - tenant_id and principal are required")
 
-        cred = ClientSecretCredential(
-            tenant_id=lc.tenant_id,
-            client_id=lc.principal.app_id,
-            client_secret=lc.principal.secret,
-        )
-        return cls(cred, lc.tenant_id, lc.subscription_id)
-
-    def __init__(self, credentials: MsalCredential, tenant_id: str, subscription_id: str = "") -> None:
+        principal_key = ("application", lc.tenant_id, lc.principal.app_id, secret_digest(lc.principal.secret))
+
+        def create_credential() -> ClientSecretCredential:
+            return ClientSecretCredential(
+                tenant_id=lc.tenant_id,
+                client_id=lc.principal.app_id,
+                client_secret=lc.principal.secret,
+                **token_cache_options(),
+                **credential_options(),
+            )
+
+        def create_client() -> AzureClientType:
+            cred = _credentials.get_or_create(principal_key, create_credential)
+            return cls(cred, lc.tenant_id, lc.subscription_id, verify_credentials, use_resource_graph)
+
+        client_key = (cls,) + principal_key + (lc.subscription_id, use_resource_graph)
+        client = _clients.get_or_create(client_key, create_client)
+        if verify_credentials:
+            client._check_credentials_working()  # reused client may have been created unverified
+        return client
+
+    def __init__(
+        self,
+        credentials: MsalCredential,
+        tenant_id: str,
+        subscription_id: str = "",
+        verify_credentials: bool = True,
+        use_resource_graph: bool = False,
+    ) -> None:
         """
-        If no subscription_id is provided, then auto-select is attempted
+        If no subscription_id is provided, then auto-select is attempted, which also verifies the credentials.
+        Otherwise, credentials are verified by acquiring a token (served from the token cache if possible),
+        unless verify_credentials is False - then invalid credentials surface on the first API call.
+        With use_resource_graph, resource (group) listings are answered with Azure Resource Graph queries
+        instead of ARM list calls. SDK clients are created on first use
         """
 
-        self._graph_client = GraphClient(credential=credentials)
-        self._subscription_client = SubscriptionClient(credentials)
+        self.use_resource_graph = use_resource_graph
+        self._credentials = credentials
         self._tenant_id = tenant_id
-        self._subscription_id = subscription_id or AzureClient._select_subscription_id(self._subscription_client)
-        self._resource_client = ResourceManagementClient(credentials, self._subscription_id)
-        self._auth_client = AuthorizationManagementClient(CredentialWrapper(credentials), self._subscription_id)
-        self._check_credentials_working()
+        self._lock = threading.Lock()  # guards lazy creation of SDK clients
+        self._graph_client_instance: Optional["GraphClient"] = None
+        self._subscription_client_instance: Optional["SubscriptionClient"] = None
+        self._resource_client_instance: Optional["ResourceManagementClient"] = None
+        self._auth_client_instance: Optional["AuthorizationManagementClient"] = None
+        self._resource_graph_instance: Optional["ResourceGraphClient"] = None
+        self._credentials_verified = False
+        # resource groups visible to the credentials in the subscription; the client is reused per login, so is this
+        self._resource_groups: Optional[ResourceGroupIndex] = None
+        self._resource_groups_lock = threading.Lock()
+        self._locations: Optional[List[str]] = None  # locations available in the subscription; they hardly ever change
+        self._locations_lock = threading.Lock()
+        if subscription_id:
+            self._subscription_id = subscription_id
+            if verify_credentials:
+                self._check_credentials_working()
+        else:
+            self._subscription_id = AzureClient._select_subscription_id(self._subscription_client)
+            self._credentials_verified = True
         log.debug("Initialized client with SubscriptionID '%s', TenantID '%s'", self._subscription_id, self._tenant_id)
 
+    @property
+    def _graph_client(self) -> "GraphClient":
+        with self._lock:
+            if self._graph_client_instance is None:
+                from msgraph.core import GraphClient
+
+                self._graph_client_instance = GraphClient(credential=self._credentials)
+            return self._graph_client_instance
+
+    # built-in SDK retries are disabled for clients used by retried operations; retry is done by call_with_retry
+
+    @property
+    def _subscription_client(self) -> "SubscriptionClient":
+        with self._lock:
+            if self._subscription_client_instance is None:
+                from azure.mgmt.resource import SubscriptionClient
+
+                self._subscription_client_instance = SubscriptionClient(
+                    self._credentials, base_url=ARM_ENDPOINT, retry_total=0
+                )
+            return self._subscription_client_instance
+
+    @property
+    def _resource_client(self) -> "ResourceManagementClient":
+        with self._lock:
+            if self._resource_client_instance is None:
+                from azure.mgmt.resource import ResourceManagementClient
+
+                self._resource_client_instance = ResourceManagementClient(
+                    self._credentials, self._subscription_id, base_url=ARM_ENDPOINT, retry_total=0
+                )
+            return self._resource_client_instance
+
+    @property
+    def _auth_client(self) -> "AuthorizationManagementClient":
+        with self._lock:
+            if self._auth_client_instance is None:
+                from azure.mgmt.authorization import AuthorizationManagementClient
+
+                self._auth_client_instance = AuthorizationManagementClient(
+                    CredentialWrapper(self._credentials), self._subscription_id, base_url=ARM_ENDPOINT, retry_total=0
+                )
+            return self._auth_client_instance
+
+    @property
+    def resource_graph(self) -> "ResourceGraphClient":
+        """Resource Graph client with the credentials of this client; queries may span many subscriptions"""
+
+        with self._lock:
+            if self._resource_graph_instance is None:
+                from resource_graph import ResourceGraphClient
+
+                self._resource_graph_instance = ResourceGraphClient(self._credentials)
+            return self._resource_graph_instance
+
     @staticmethod
-    def _select_subscription_id(client: SubscriptionClient) -> str:
-        subscription = next(client.subscriptions.list(), None)
+    def _select_subscription_id(client: "SubscriptionClient") -> str:
+        try:
+            subscription = call_with_retry(
+                lambda: next(client.subscriptions.list(), None),
+                classify_sdk_api_error,
+                SDK_RETRY_POLICY,
+                "List subscriptions",
+            )
+        except AzureError as err:
+            if classify_sdk_api_error(err).transient:
+                raise AzureClientError("Failed to select SubscriptionID - listing subscriptions failed") from err
+            raise AzureClientError("Provided credentials are invalid") from err
+
         if subscription is None:
             raise AzureClientError("Failed to select SubscriptionID - no subscriptions available")
 
@@ -124,11 +393,31 @@ class AzureClient:
         return subscription_id
 
     def _check_credentials_working(self) -> None:
+        """
+        Acquiring ARM token proves the credentials valid (no round-trip on token cache hit);
+        a single subscription lookup proves the principal can access the subscription
+        """
+
+        if self._credentials_verified:
+            return
+
         try:
-            next(self._subscription_client.subscriptions.list_locations(self.subscription_id), None)
+            self._credentials.get_token(ARM_SCOPE)
         except AzureError as err:
             raise AzureClientError("Provided credentials are invalid") from err
 
+        try:
+            call_with_retry(
+                lambda: self._subscription_client.subscriptions.get(self._subscription_id),
+                classify_sdk_api_error,
+                SDK_RETRY_POLICY,
+                "Get subscription",
+            )
+        except AzureError as err:
+            msg = f"SubscriptionID '{self._subscription_id}' is not accessible with provided credentials"
+            raise AzureClientError(msg) from err
+        self._credentials_verified = True
+
     @property
     def tenant_id(self) -> str:
         return self._tenant_id
@@ -137,8 +426,23 @@ class AzureClient:
     def subscription_id(self) -> str:
         return self._subscription_id
 
-    @wrap_sdk_api_exceptions("Failed to list locations")
+    @wrap_sdk_api_exceptions("Failed to list subscriptions")
+    def list_subscription_ids(self) -> List[str]:
+        """IDs of all subscriptions accessible with the client's credentials"""
+
+        subscriptions = self._subscription_client.subscriptions.list()
+        return sorted(s.subscription_id for s in subscriptions)
+
     def list_locations(self) -> List[str]:
+        """Locations are listed once per client; concurrent callers wait for the same listing"""
+
+        with self._locations_lock:
+            if self._locations is None:
+                self._locations = self._fetch_locations()
+            return list(self._locations)
+
+    @wrap_sdk_api_exceptions("Failed to list locations")
+    def _fetch_locations(self) -> List[str]:
         locations = self._subscription_client.subscriptions.list_locations(self.subscription_id)
         if not locations:
             log.warning("No locations are available for SubscriptionID '%s'", self.subscription_id)
@@ -147,20 +451,112 @@ class AzureClient:
         names = [l.name for l in locations]
         return sorted(names)
 
-    @wrap_sdk_api_exceptions("Failed to list resource groups")
     def list_resource_groups(self, location: str) -> List[str]:
-        groups = self._resource_client.resource_groups.list()
-        names = [g.name for g in groups if g.location == location]
-        return sorted(names)
+        return self._resource_group_index().names(location)
+
+    def resource_groups_by_location(self) -> Dict[str, List[str]]:
+        """Names of all resource groups in the subscription, by location (lower case)"""
+
+        return self._resource_group_index().by_location()
+
+    @wrap_sdk_api_exceptions("Failed to list resource groups")
+    def resource_groups_with_tag(self, tag_name: str, tag_value: Optional[str] = None) -> Dict[str, List[str]]:
+        """
+        Names of resource groups having the tag (with the value, if given), by location (lower case)
+        Unlike location, tag filter is applied server-side; the result is not cached
+        """
+
+        if self.use_resource_graph:
+            groups = self.resource_graph.resource_groups([self.subscription_id], tag_name, tag_value)
+            return ResourceGroupIndex(groups[self.subscription_id]).by_location()
+
+        tag_filter = f"tagName eq '{odata_escape(tag_name)}'"
+        if tag_value is not None:
+            tag_filter += f" and tagValue eq '{odata_escape(tag_value)}'"
+        groups = self._resource_client.resource_groups.list(filter=tag_filter)
+        return ResourceGroupIndex((g.name, g.location) for g in groups).by_location()
+
+    def find_missing_resource_groups(self, location: str, names: Iterable[str]) -> List[str]:
+        """Return names of resource groups that don't exist in the location (compared case-insensitively), sorted"""
+
+        return self._resource_group_index().missing(location, names)
+
+    def invalidate_resource_groups(self) -> None:
+        """Force listing resource groups again on next lookup, eg. after creating some"""
+
+        with self._resource_groups_lock:
+            self._resource_groups = None
+
+    def _resource_group_index(self) -> ResourceGroupIndex:
+        """
+        Resource groups of the subscription are listed in a single paged pass and then served from the index
+        until it expires. ARM doesn't support filtering resource groups by location (only by tags),
+        so the listing can't be narrowed server-side; instead, it's done once for all locations
+        """
+
+        with self._resource_groups_lock:
+            if self._resource_groups is None or self._resource_groups.expired(RESOURCE_GROUP_INDEX_TTL_SEC):
+                self._resource_groups = self._build_resource_group_index()
+            return self._resource_groups
+
+    @wrap_sdk_api_exceptions("Failed to list resource groups")
+    def _build_resource_group_index(self) -> ResourceGroupIndex:
+        if self.use_resource_graph:
+            groups = self.resource_graph.resource_groups([self.subscription_id])[self.subscription_id]
+            index = ResourceGroupIndex(groups)
+        else:
+            index = ResourceGroupIndex((g.name, g.location) for g in self._resource_client.resource_groups.list())
+        log.debug("Indexed resource groups of SubscriptionID '%s'", self.subscription_id)
+        return index
 
     @wrap_sdk_api_exceptions("Failed to list network security groups")
     def list_network_security_groups(self, resource_group: str) -> List[str]:
-        FILTER = "resourceType eq 'Microsoft.Network/networkSecurityGroups'"
+        return self._list_resources(NETWORK_SECURITY_GROUP_TYPE, resource_group)
+
+    @wrap_sdk_api_exceptions("Failed to list network security groups")
+    def network_security_groups_by_resource_group(self) -> Dict[str, List[str]]:
+        """
+        Names of all network security groups in the subscription, by resource group name (lower case, as resource
+        group names are case-insensitive). Single paged listing for the whole subscription
+        """
+
+        return self._resources_by_resource_group(NETWORK_SECURITY_GROUP_TYPE)
+
+    @wrap_sdk_api_exceptions("Failed to list virtual networks")
+    def list_virtual_networks(self, resource_group: str) -> List[str]:
+        return self._list_resources(VIRTUAL_NETWORK_TYPE, resource_group)
+
+    @wrap_sdk_api_exceptions("Failed to list virtual networks")
+    def virtual_networks_by_resource_group(self) -> Dict[str, List[str]]:
+        """Like network_security_groups_by_resource_group, for virtual networks"""
+
+        return self._resources_by_resource_group(VIRTUAL_NETWORK_TYPE)
+
+    def _list_resources(self, resource_type: str, resource_group: str) -> List[str]:
+        if self.use_resource_graph:
+            by_group = self.resource_graph.resources_by_resource_group(
+                resource_type, [self.subscription_id], resource_group
+            )[self.subscription_id]
+            return by_group.get(resource_group.lower(), [])
 
-        groups = self._resource_client.resources.list_by_resource_group(resource_group, FILTER)
-        names = [nsg.name for nsg in groups]
+        resource_filter = f"resourceType eq '{resource_type}'"
+        resources = self._resource_client.resources.list_by_resource_group(resource_group, resource_filter)
+        names = [r.name for r in resources]
         return sorted(names)
 
+    def _resources_by_resource_group(self, resource_type: str) -> Dict[str, List[str]]:
+        if self.use_resource_graph:
+            return self.resource_graph.resources_by_resource_group(resource_type, [self.subscription_id])[
+                self.subscription_id
+            ]
+
+        result: Dict[str, List[str]] = {}
+        for r in self._resource_client.resources.list(filter=f"resourceType eq '{resource_type}'"):
+            result.setdefault(resource_group_of(r.id), []).append(r.name)
+        for names in result.values():
+            names.sort()
+        return result
+
     @wrap_sdk_api_exceptions("Failed to find app registrations")
     def find_app_registrations(self, name: str) -> List[str]:
         HEADERS = {"ConsistencyLevel": "Eventual", "Accept": "application/json"}
@@ -171,13 +567,42 @@ class AzureClient:
         value = result.json()["value"]
         return [v["appId"] for v in value]
 
-    @wrap_sdk_api_exceptions("Failed to create app registration")
-    def create_app_registration(self, name: str) -> AppRegistration:
+    @wrap_sdk_api_exceptions("Failed to find service principal")
+    def find_service_principal_id(self, app_id: str) -> str:
+        """Object ID of the ServicePrincipal of the app"""
+
+        result = self._graph_client.get(f"/servicePrincipals?$filter=appId%20eq%20'{app_id}'&$select=id")
+        result.raise_for_status()
+        value = result.json()["value"]
+        if not value:
+            raise AzureClientError(f"ServicePrincipal of AppRegistration ID '{app_id}' not found")
+        return value[0]["id"]
+
+    @wrap_sdk_api_exceptions("Failed to add service principal secret", retry=False)
+    def add_service_principal_secret(self, principal_id: str) -> str:
+        """Create new secret for ServicePrincipal of given object ID; existing secrets remain valid"""
+
         HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
 
-        ms_graph_id = self._ms_graph_object_id()
+        result = self._graph_client.post(f"/servicePrincipals/{principal_id}/addPassword", json={}, headers=HEADERS)
+        result.raise_for_status()
+        return result.json()["secretText"]
+
+    @wrap_sdk_api_exceptions("Failed to assign Owner role", retry=False)  # retried by _assign_owner_role
+    def ensure_owner_role(self, principal_id: str) -> None:
+        """Assign Owner role in the subscription to ServicePrincipal of given object ID, unless already assigned"""
+
+        self._assign_owner_role(principal_id)
 
-        # create AppRegistration
+    @wrap_sdk_api_exceptions("Failed to create app registration", retry=False)
+    def create_app_registration(self, name: str) -> AppRegistration:
+        """
+        Graph requests are sent in JSON batches: requests within a batch are executed without extra round-trips.
+        Batch requests can't use values returned by each other, so steps that need a server-assigned ID
+        go to the next batch. ARM role assignment runs in the background alongside the last Graph batch
+        """
+
+        # create AppRegistration, and find MS Graph API ServicePrincipal meanwhile unless already known for the tenant
         required_access = [
             {
                 "resourceAppId": MICROSOFT_GRAPH_API,
@@ -188,32 +613,74 @@ class AzureClient:
             "displayName": name,
             "requiredResourceAccess": required_access,
         }
-        result = self._graph_client.post("/applications", json=body, headers=HEADERS)
-        result.raise_for_status()
-        result_dict = result.json()
+        ms_graph_id = _ms_graph_object_ids.get(self.tenant_id)
+        requests = [graph_batch_request("application", "POST", "/applications", body)]
+        if ms_graph_id is None:
+            requests.append(graph_batch_request("ms_graph", "GET", MS_GRAPH_API_PRINCIPAL_QUERY))
+        responses = self._graph_batch(requests)
+        result_dict = graph_batch_response_body(responses, "application", "Failed to create application")
         app_id = result_dict["appId"]
         app_object_id = result_dict["id"]
+        if ms_graph_id is None:
+            try:
+                ms_graph_id = self._find_ms_graph_object_id(
+                    graph_batch_response_body(responses, "ms_graph", "Failed to find service principal")
+                )
+            except (AzureClientError, RequestException):
+                # don't leave behind application that was created in the same batch
+                self._graph_client.delete(f"/applications/{app_object_id}")
+                raise
 
         # create ServicePrincipal
-        body = {"appId": app_id}
-        result = self._graph_client.post("/servicePrincipals", json=body, headers=HEADERS)
-        result.raise_for_status()
-        principal_id = result.json()["id"]
+        responses = self._graph_batch(
+            [graph_batch_request("principal", "POST", "/servicePrincipals", {"appId": app_id})]
+        )
+        principal_id = graph_batch_response_body(responses, "principal", "Failed to create service principal")["id"]
 
-        # create ServicePrincipal secret
-        result = self._graph_client.post(f"/servicePrincipals/{principal_id}/addPassword", headers=HEADERS)
-        result.raise_for_status()
-        principal_secret = result.json()["secretText"]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # create Owner RoleAssignment in the background
+            role_assignment = executor.submit(self._assign_owner_role, principal_id)
 
-        # grant ReadWriteAll permission to ServicePrincipal
-        body = {
-            "principalId": principal_id,
-            "resourceId": ms_graph_id,
-            "appRoleId": AZURE_READ_WRITE_ALL_PERMISSION,
-        }
-        self._graph_client.post(f"/servicePrincipals/{ms_graph_id}/appRoleAssignedTo", json=body, headers=HEADERS)
+            # create ServicePrincipal secret and then grant ReadWriteAll permission to ServicePrincipal
+            body = {
+                "principalId": principal_id,
+                "resourceId": ms_graph_id,
+                "appRoleId": AZURE_READ_WRITE_ALL_PERMISSION,
+            }
+            responses = self._graph_batch(
+                [
+                    graph_batch_request("secret", "POST", f"/servicePrincipals/{principal_id}/addPassword", {}),
+                    graph_batch_request(
+                        "permission",
+                        "POST",
+                        f"/servicePrincipals/{ms_graph_id}/appRoleAssignedTo",
+                        body,
+                        depends_on=["secret"],  # don't grant permissions to principal that can't be used
+                    ),
+                ]
+            )
+            principal_secret = graph_batch_response_body(
+                responses, "secret", "Failed to create service principal secret"
+            )["secretText"]
+            if responses["permission"]["status"] >= 400:
+                log.warning("Failed to grant ReadWriteAll permission to ServicePrincipal '%s'", principal_id)
+
+            role_assignment.result()  # re-raises error of the role assignment, if any
+
+        return AppRegistration(
+            obj_id=app_object_id,
+            principal=ServicePrincipal(app_id=app_id, secret=principal_secret),
+            principal_obj_id=principal_id,
+        )
+
+    def _assign_owner_role(self, principal_id: str) -> None:
+        """
+        Transient errors are retried according to SDK_RETRY_POLICY. The assignment name is generated once, so a retry
+        of a create that went through repeats the same assignment; an existing one (RoleAssignmentExists) is fine
+        """
+
+        from azure.mgmt.authorization.models import RoleAssignmentCreateParameters
 
-        # create Owner RoleAssignment
         scope = f"/subscriptions/{self.subscription_id}/"
         role_id = f"/subscriptions/{self.subscription_id}/providers/Microsoft.Authorization/roleDefinitions/{AZURE_OWNER_ROLE}"
         parameters = RoleAssignmentCreateParameters(
@@ -221,28 +688,218 @@ class AzureClient:
             principal_id=principal_id,
             principal_type="ServicePrincipal",  # no retries needed in following requests thanks to this param
         )
-        self._auth_client.role_assignments.create(
-            scope=scope, role_assignment_name=str(uuid.uuid4()), parameters=parameters, properties=None
-        )
+        role_assignment_name = str(uuid.uuid4())
+        try:
+            call_with_retry(
+                lambda: self._auth_client.role_assignments.create(
+                    scope=scope, role_assignment_name=role_assignment_name, parameters=parameters, properties=None
+                ),
+                classify_role_assignment_error,
+                SDK_RETRY_POLICY,
+                "Assign Owner role",
+            )
+        except HttpResponseError as err:
+            if err.status_code != 409:  # RoleAssignmentExists
+                raise
+            log.debug("ServicePrincipal '%s' already has Owner role in '%s'", principal_id, self.subscription_id)
+
+    def _graph_batch(self, requests: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Send requests as a single MS Graph JSON batch, return responses by request id
+        The batch succeeds as a whole even if some of its requests don't: requests failed with transient status,
+        and those failed because they depend on them, are sent again in a new batch according to SDK_RETRY_POLICY,
+        honoring their Retry-After. Once retries are exhausted, the last responses are returned as they are
+        """
+
+        HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
 
-        return AppRegistration(obj_id=app_object_id, principal=ServicePrincipal(app_id=app_id, secret=principal_secret))
+        responses: Dict[str, Dict[str, Any]] = {}
+        pending = requests
+
+        def send() -> None:
+            nonlocal pending
+            result = self._graph_client.post("/$batch", json={"requests": pending}, headers=HEADERS)
+            result.raise_for_status()
+            responses.update((r["id"], r) for r in result.json()["responses"])
+            pending = graph_batch_retries(pending, responses)
+            if pending:
+                retry_after = [parse_retry_after(responses[r["id"]].get("headers")) for r in pending]
+                raise GraphBatchRetryError(
+                    [r["id"] for r in pending], max((d for d in retry_after if d is not None), default=None)
+                )
 
-    @wrap_sdk_api_exceptions("Failed to delete app registration")
+        try:
+            call_with_retry(send, classify_graph_batch_error, SDK_RETRY_POLICY, "MS Graph batch")
+        except GraphBatchRetryError:
+            pass  # failed responses are reported by the caller
+        return responses
+
+    @wrap_sdk_api_exceptions("Failed to delete app registration", retry=False)
     def delete_app_registration(self, app: AppRegistration) -> None:
         result = self._graph_client.delete(f"/applications/{app.obj_id}")
         result.raise_for_status()
 
-    def _ms_graph_object_id(self) -> str:
-        result = self._graph_client.get("/servicePrincipals")
-        for sp in result.json()["value"]:
-            if sp["appId"] == MICROSOFT_GRAPH_API:
-                return sp["id"]
-        raise AzureClientError("MS Graph API ServicePrincipal not found")
+    def _find_ms_graph_object_id(self, page: Dict[str, Any]) -> str:
+        """
+        Find MS Graph API ServicePrincipal in the result of MS_GRAPH_API_PRINCIPAL_QUERY, starting with its first page
+        The ID is remembered for the tenant
+        """
+
+        while True:
+            for sp in page["value"]:
+                if sp["appId"] == MICROSOFT_GRAPH_API:
+                    _ms_graph_object_ids[self.tenant_id] = sp["id"]
+                    return sp["id"]
+
+            next_link = page.get("@odata.nextLink")
+            if next_link is None:
+                raise AzureClientError("MS Graph API ServicePrincipal not found")
+            result = self._graph_client.get(next_link)
+            result.raise_for_status()
+            page = result.json()
+
+
+@dataclass(frozen=True)
+class AzureLogin:
+    """Provides AzureClients like AzureClient.login_user/login_application do, created with given options"""
+
+    use_resource_graph: bool = False
+
+    def login_user(self, tenant_id: str, subscription_id: str = "", verify_credentials: bool = True) -> AzureClient:
+        return AzureClient.login_user(tenant_id, subscription_id, verify_credentials, self.use_resource_graph)
+
+    def login_application(self, lc: LoginCredentials, verify_credentials: bool = True) -> AzureClient:
+        return AzureClient.login_application(lc, verify_credentials, self.use_resource_graph)
+
+
+def credential_options() -> Dict[str, Any]:
+    """
+    Extra azure-identity credential options
+    Instance discovery validates the authority against Azure AD hosts known to Microsoft; skip it for overridden one
+    """
+
+    return {"disable_instance_discovery": True} if AUTHORITY_HOST else {}
+
+
+@lru_cache(maxsize=None)
+def token_cache_options() -> Dict[str, Any]:
+    """
+    Persistent token cache options of azure-identity credentials
+    The cache is never stored in plaintext unless allowed with UNENCRYPTED_TOKEN_CACHE_VARIABLE; when encryption is not
+    available (eg. no libsecret on Linux), tokens are cached in memory only, for the duration of the run
+    """
+
+    if os.environ.get(UNENCRYPTED_TOKEN_CACHE_VARIABLE, "") not in ("", "0"):
+        log.warning(
+            "%s is set: Azure tokens are cached in a plaintext file if encryption is not available",
+            UNENCRYPTED_TOKEN_CACHE_VARIABLE,
+        )
+        return {
+            "cache_persistence_options": TokenCachePersistenceOptions(
+                name=TOKEN_CACHE_NAME, allow_unencrypted_storage=True
+            )
+        }
+
+    try:
+        # private to azure-identity, hence imported here: if it's gone, the credentials still work, without the cache
+        from azure.identity._persistent_cache import _load_persistent_cache
+    except ImportError as err:
+        log.debug("Token cache probe not available: %s", err)
+        log.warning("Token cache encryption can't be verified, Azure tokens are not cached between runs")
+        return {}
+
+    options = TokenCachePersistenceOptions(name=TOKEN_CACHE_NAME)
+    try:
+        _load_persistent_cache(options)  # fails the same way credentials would on first token request
+    except (ValueError, NotImplementedError, ImportError) as err:
+        log.debug("Token cache encryption failed: %s", err)
+        log.warning(
+            "Token cache encryption is not available, Azure tokens are not cached between runs. "
+            "Set %s=1 to cache them in a plaintext file",
+            UNENCRYPTED_TOKEN_CACHE_VARIABLE,
+        )
+        return {}
+    return {"cache_persistence_options": options}
+
+
+def odata_escape(value: str) -> str:
+    """Escape value for use in single-quoted OData string literal"""
+
+    return value.replace("'", "''")
+
+
+def resource_group_of(resource_id: str) -> str:
+    """Resource group name (lower case) from resource ID: /subscriptions/<id>/resourceGroups/<name>/providers/..."""
+
+    parts = resource_id.split("/")
+    lower_parts = [p.lower() for p in parts]
+    return parts[lower_parts.index("resourcegroups") + 1].lower()
+
+
+def graph_batch_request(
+    request_id: str,
+    method: str,
+    url: str,
+    body: Optional[Dict[str, Any]] = None,
+    depends_on: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Single request of MS Graph JSON batch; depends_on lists ids of requests that must succeed first"""
+
+    request: Dict[str, Any] = {"id": request_id, "method": method, "url": url}
+    if body is not None:
+        request["body"] = body
+        request["headers"] = {"Content-Type": "application/json"}
+    if depends_on:
+        request["dependsOn"] = depends_on
+    return request
+
+
+def graph_batch_retries(requests: List[Dict[str, Any]], responses: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Requests of a batch to send again: failed with transient status, or failed dependency (424) on such request
+    A batch can refer only to its own requests, so dependencies on requests not sent again are dropped
+    """
+
+    retried = set()
+    for request in requests:  # dependencies precede requests depending on them
+        status = responses.get(request["id"], {}).get("status")
+        if status in TRANSIENT_HTTP_STATUSES or (status == 424 and retried.intersection(request.get("dependsOn", []))):
+            retried.add(request["id"])
+
+    result = []
+    for request in requests:
+        if request["id"] in retried:
+            depends_on = [d for d in request.get("dependsOn", []) if d in retried]
+            request = {k: v for k, v in request.items() if k != "dependsOn"}
+            if depends_on:
+                request["dependsOn"] = depends_on
+            result.append(request)
+    return result
+
+
+def classify_graph_batch_error(err: Exception) -> ErrorClass:
+    """Requests failed within a batch are retried; failure of the batch request itself is not, as it's not idempotent"""
+
+    if isinstance(err, GraphBatchRetryError):
+        return ErrorClass(transient=True, retry_after_sec=err.retry_after_sec)
+    return PERMANENT
+
+
+def graph_batch_response_body(responses: Dict[str, Dict[str, Any]], request_id: str, msg: str) -> Dict[str, Any]:
+    """Return body of successful batch response; raise AzureClientError for failed one"""
+
+    response = responses.get(request_id)
+    if response is None:
+        raise AzureClientError(f"{msg} - no response in batch")
+    if response["status"] >= 400:
+        error = response.get("body", {}).get("error", {})
+        raise AzureClientError(f"{msg} - {response['status']} {error.get('code', '')}: {error.get('message', '')}")
+    return response.get("body", {})
 
 
 # Note: below helper class is copied from https://gist.github.com/lmazuel/cc683d82ea1d7b40208de7c9fc8de59d
 class CredentialWrapper(BasicTokenAuthentication):
-    def __init__(self, credential=None, resource_id="https://management.azure.com/.default", **kwargs):
+    def __init__(self, credential=None, resource_id=ARM_SCOPE, **kwargs):
         """
         Wrap any azure-identity credential to work with SDK that needs azure.common.credentials/msrestazure.
         Default resource is ARM (syntax of endpoint v2)
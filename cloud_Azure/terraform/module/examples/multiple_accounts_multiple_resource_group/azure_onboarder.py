@@ -1,13 +1,32 @@
 import argparse
 import logging
+import multiprocessing
 import os
+import shutil
 import sys
-from typing import Any, Callable, Dict, List, Tuple
-
-from python_terraform import IsFlagged, IsNotFlagged, Terraform
-
-from azure_cli import az_cli
-from profiles import AzureProfile, ProfilesIncompleteError, ProfilesInvalidError, load_complete_profiles
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from azure.core.exceptions import AzureError
+from azure.identity import ClientSecretCredential
+from python_terraform import IsFlagged, Terraform
+
+from fingerprints import FingerprintCache, configuration_hash
+from metrics import save_prometheus, save_trace
+from profile_terraform import PrefixedOutput, PrefixedStream, ProfileTerraform
+from profiles import (
+    SQLITE_SUFFIXES,
+    AzureProfile,
+    ProfileConfigurationError,
+    ProfileSelection,
+    select_complete_profiles,
+)
+from retry import RetryHandler
+from run_report import STATUS_INVALID, STATUS_SKIPPED, ProfileReport, RunReport
 
 log = logging.getLogger(__name__)
 logging.basicConfig(
@@ -16,46 +35,310 @@ logging.basicConfig(
 
 EX_OK: int = 0  # exit code for successful command
 EX_FAILED: int = 1  # exit  code for failed command
+EX_CHANGES_PRESENT: int = 2  # exit code for successful "terraform plan -detailed-exitcode" with changes to apply
 
 DEFAULT_PROFILES_FILE_NAME: str = "profiles.ini"
+MODULE_DIRECTORY: str = "../.."  # source of "kentik_azure_integration" module, see main.tf
+LOGIN_AZURE_CLI: str = "cli"  # login to Azure CLI with profile credentials before running Terraform
+LOGIN_ENVIRONMENT: str = "env"  # verify profile credentials in-process, pass them to Terraform as ARM_* variables
+ARM_SCOPE: str = "https://management.azure.com/.default"
+LOGIN_MAX_ATTEMPTS: int = 3  # az login is retried on transient errors, eg. throttling in bulk onboarding
+DEFAULT_JOBS: int = 1  # number of profiles processed concurrently
+WORKERS_DIRECTORY: str = ".onboarder_workers"  # per-worker Azure CLI config and Terraform data directories
+DEFAULT_PLUGIN_CACHE_DIRECTORY: str = os.environ.get(
+    "TF_PLUGIN_CACHE_DIR", str(Path.home().joinpath(".terraform.d", "plugin-cache"))
+)
+DEFAULT_PROVIDERS_MIRROR_DIRECTORY: str = "terraform_providers_mirror"  # local provider mirror for offline mode
+PLANS_DIRECTORY: str = "plans"  # saved Terraform plans, one per workspace
+PROFILE_LOGS_DIRECTORY: str = "profile_logs"  # Terraform output of the last run, one log file per profile
 
 
 TerraformVars = Dict[str, Any]  # variables passed in terraform plan/apply/destroy call
-TerraformAction = Callable[[Terraform, TerraformVars], bool]  # terraform plan/apply/destroy
+TerraformAction = Callable[[Terraform, str, TerraformVars], bool]  # terraform plan/apply/destroy in given workspace
+TerraformInitOptions = Dict[str, Any]  # options passed in terraform init call
+ProfileResults = List[Tuple[AzureProfile, bool]]  # profiles processed, with the result of the action
 
+_worker_initialized: bool = False  # Terraform data dir of the current worker process is initialized
+_worker_init_options: TerraformInitOptions = {}  # options for initializing Terraform data dir of the worker process
 
-def execute_action(action: TerraformAction, profiles: List[AzureProfile]) -> bool:
-    """Execute an action for every profile"""
+
+def init_terraform(plugin_cache_dir: str, mirror_dir: str, offline: bool) -> Optional[TerraformInitOptions]:
+    """
+    Initialize Terraform working directory once, before any profile is processed
+    Providers are installed through the plugin cache shared by all workers and runs, or - in offline mode - from local
+    providers mirror, which is populated from the registry only when it doesn't exist yet (warm-up)
+    Return the options for "terraform init", so that workers can reuse them; None on failure
+    """
 
     t = Terraform()
-    successful_count = 0
+    Path(plugin_cache_dir).mkdir(parents=True, exist_ok=True)
+    os.environ["TF_PLUGIN_CACHE_DIR"] = str(Path(plugin_cache_dir).resolve())  # inherited by workers
+
+    init_options: TerraformInitOptions = {}
+    if offline:
+        mirror_path = Path(mirror_dir).resolve()
+        if not mirror_path.is_dir() or not any(mirror_path.iterdir()):
+            print_log(f'Populating Terraform providers mirror "{mirror_path}"...')
+            return_code, stdout, stderr = t.cmd("providers mirror", str(mirror_path))
+            if return_code != EX_OK:
+                report_tf_output(return_code, stdout, stderr)
+                return None
+        init_options["plugin_dir"] = str(mirror_path)  # -plugin-dir disables provider installation from registry
+
+    print_log("Terraform init...")
+    return_code, stdout, stderr = t.init(**init_options)
+    if return_code != EX_OK:
+        report_tf_output(return_code, stdout, stderr)
+        return None
+
+    log.info("Terraform initialized")
+    return init_options
+
+
+def execute_action(
+    action: TerraformAction,
+    profiles: Iterable[AzureProfile],
+    jobs: int = DEFAULT_JOBS,
+    init_options: Optional[TerraformInitOptions] = None,
+    fingerprints: Optional[FingerprintCache] = None,
+    force: bool = False,
+    login: str = LOGIN_AZURE_CLI,
+    report: Optional[RunReport] = None,
+) -> bool:
+    """
+    Execute an action for every profile, processing up to "jobs" profiles concurrently
+    Profiles may be a lazy stream; work on early profiles starts while later ones are still being read
+    init_options are used for initializing Terraform data dirs of workers
+    With fingerprints cache, plan and apply skip profiles unchanged since their last successful apply, unless forced
+    login is one of LOGIN_AZURE_CLI, LOGIN_ENVIRONMENT
+    With report, outcome, duration and resource changes of every phase of every profile are added to it
+    """
+
+    skipped: List[AzureProfile] = []
+    pending = iter(profiles)
+    if fingerprints is not None and action is not action_destroy and not force:
+        pending = skip_unchanged(profiles, fingerprints, skipped)
+
+    profile_reports: List[ProfileReport] = []
+    if jobs > 1:
+        results = execute_parallel(action, pending, jobs, init_options or {}, login, profile_reports)
+    else:
+        results = execute_sequential(action, pending, login, profile_reports)
+
+    if fingerprints is not None:
+        update_fingerprints(fingerprints, action, results)
+
+    if report is not None:
+        for profile_report in profile_reports:
+            report.add(profile_report)
+        for profile in skipped:
+            report.add(ProfileReport(profile.name, profile.name, status=STATUS_SKIPPED))
+
+    total_count = len(skipped) + len(results)
+    successful_count = len(skipped) + sum(1 for _, successful in results if successful)
+    print_log(f"Terraform action successfully executed for {successful_count}/{total_count} Azure profile(s).")
+    return successful_count == total_count
+
+
+def skip_unchanged(
+    profiles: Iterable[AzureProfile], fingerprints: FingerprintCache, skipped: List[AzureProfile]
+) -> Iterator[AzureProfile]:
+    """Yield profiles changed since their last successful apply; collect the others in skipped"""
+
     for profile in profiles:
-        print_log(f'Profile: "{profile.name}" ({profile.location})')
+        if fingerprints.is_unchanged(profile.name, profile_tf_vars(profile)):
+            print_log(f'Profile: "{profile.name}" unchanged since last successful apply. Skipped')
+            skipped.append(profile)
+        else:
+            yield profile
+
+
+def update_fingerprints(fingerprints: FingerprintCache, action: TerraformAction, results: ProfileResults) -> None:
+    """Remember profiles successfully applied; forget profiles destroyed or failed to apply"""
+
+    for profile, successful in results:
+        if action is action_apply and successful:
+            fingerprints.record_applied(profile.name, profile_tf_vars(profile))
+        elif action is not action_plan:
+            fingerprints.forget(profile.name)
 
-        tf_vars = {
-            "subscription_id": profile.subscription_id,
-            "tenant_id": profile.tenant_id,
-            "principal_id": profile.principal_id,
-            "principal_secret": profile.principal_secret,
-            "location": profile.location,
-            "resource_group_names": profile.resource_group_names,
-            "storage_account_names": profile.storage_account_names,
-        }
+    if not fingerprints.save():
+        log.warning("Failed to save profile fingerprints")
+
+
+def execute_sequential(
+    action: TerraformAction, profiles: Iterable[AzureProfile], login: str, reports: List[ProfileReport]
+) -> ProfileResults:
+    """Execute an action for every profile, one by one. Return result for every profile, collect their reports"""
+
+    results: ProfileResults = []
+    for profile in profiles:
+        reports.append(ProfileReport(profile.name, profile.name))
+        results.append((profile, execute_profile(action, profile, login, reports[-1])))
+    if login == LOGIN_AZURE_CLI:
+        azure_logout()
+    return results
+
+
+def execute_parallel(
+    action: TerraformAction,
+    profiles: Iterable[AzureProfile],
+    jobs: int,
+    init_options: TerraformInitOptions,
+    login: str,
+    reports: List[ProfileReport],
+) -> ProfileResults:
+    """
+    Execute an action for every profile in a pool of worker processes. Return result for every profile,
+    collect their reports
+    Every worker has its own Azure CLI config dir and Terraform data dir, so logins and workspace switches are isolated
+    Profiles are submitted as they are read. Everything workers print shows up live, prefixed with the profile name
+    """
 
-        if azure_login(profile) and prepare_workspace(t, profile.name) and action(t, tf_vars):
-            successful_count += 1
+    slots: "multiprocessing.Queue[int]" = multiprocessing.Queue()
+    for slot in range(jobs):
+        slots.put(slot)
 
-    azure_logout()
+    results: ProfileResults = []
+    futures: Deque[Tuple[AzureProfile, "Future[Tuple[bool, ProfileReport]]"]] = deque()
 
-    print_log(f"Terraform action successfully executed for {successful_count}/{len(profiles)} Azure profile(s).")
-    return successful_count == len(profiles)
+    def report(wait: bool) -> None:
+        while futures and (wait or futures[0][1].done()):
+            profile, future = futures.popleft()
+            successful, profile_report = future.result()
+            results.append((profile, successful))
+            reports.append(profile_report)
 
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(slots, init_options)) as executor:
+            for profile in profiles:
+                futures.append((profile, executor.submit(execute_profile_in_worker, action, profile, login)))
+                report(wait=False)
+            report(wait=True)
+    finally:
+        remove_azure_config_dirs(jobs)
+
+    return results
+
+
+def execute_profile(action: TerraformAction, profile: AzureProfile, login: str, report: ProfileReport) -> bool:
+    """
+    Execute an action for single profile; login and every Terraform command are recorded in report as phases
+    Terraform output is streamed live to the console, prefixed with the profile name, and to the profile's log file
+    """
+
+    print_log(f'Profile: "{profile.name}" ({profile.location})')
+
+    start = time.monotonic()
+    log_path = Path(PROFILE_LOGS_DIRECTORY, f"{profile.name}.log")
+    log_path.parent.mkdir(exist_ok=True)
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        output = PrefixedOutput(profile.name, log_file)
+        with report.phase("login") as phase:
+            if login == LOGIN_ENVIRONMENT:
+                t = ProfileTerraform(arm_environment(profile), output, report)
+                phase.successful = verify_credentials(profile)
+            else:
+                t = ProfileTerraform(os.environ.copy(), output, report)
+                phase.successful = azure_login(profile, phase.count_retry)
+
+        successful = phase.successful
+        if successful:
+            workspace = profile.name
+            with report.phase("prepare_workspace") as phase:
+                phase.successful = prepare_workspace(t, workspace)
+            successful = phase.successful and action(t, workspace, profile_tf_vars(profile))
+
+    report.finish(successful, time.monotonic() - start)
+    return successful
+
+
+def profile_tf_vars(profile: AzureProfile) -> TerraformVars:
+    return {
+        "subscription_id": profile.subscription_id,
+        "tenant_id": profile.tenant_id,
+        "principal_id": profile.principal_id,
+        "principal_secret": profile.principal_secret,
+        "location": profile.location,
+        "resource_group_names": profile.resource_group_names,
+        "storage_account_names": profile.storage_account_names,
+    }
+
+
+def worker_directory(slot: int) -> Path:
+    return Path(WORKERS_DIRECTORY, f"worker-{slot}").resolve()
+
+
+def init_worker(slots: "multiprocessing.Queue[int]", init_options: TerraformInitOptions) -> None:
+    """
+    Worker process initializer
+    Point Azure CLI and Terraform at the worker's own directories; environment changes are local to the process
+    """
+
+    global _worker_init_options  # pylint: disable=global-statement
+
+    _worker_init_options = init_options
+    directory = worker_directory(slots.get())
+    os.environ["AZURE_CONFIG_DIR"] = str(directory.joinpath("azure"))
+    os.environ["TF_DATA_DIR"] = str(directory.joinpath("terraform"))
+
+
+def execute_profile_in_worker(action: TerraformAction, profile: AzureProfile, login: str) -> Tuple[bool, ProfileReport]:
+    """
+    Execute an action for single profile in worker process
+    Everything printed on the way goes to the console live, prefixed with the profile name like Terraform output,
+    so that status lines of the profile are in line with its Terraform output
+    """
+
+    output = PrefixedOutput(profile.name)
+    stdout, stderr = PrefixedStream(output, is_stderr=False), PrefixedStream(output, is_stderr=True)
+    report = ProfileReport(profile.name, profile.name)
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            successful = init_worker_terraform() and execute_profile(action, profile, login, report)
+    finally:
+        stdout.flush()
+        stderr.flush()
+
+    return successful, report
+
+
+def init_worker_terraform() -> bool:
+    """
+    Initialize worker's Terraform data dir on first use
+    Providers are linked from the shared plugin cache or providers mirror, so no downloads are needed
+    """
+
+    global _worker_initialized  # pylint: disable=global-statement
+
+    if not _worker_initialized:
+        log.info('Initializing Terraform data dir "%s"', os.environ.get("TF_DATA_DIR"))
+        return_code, stdout, stderr = Terraform().init(**_worker_init_options)
+        if return_code != EX_OK:
+            report_tf_output(return_code, stdout, stderr)
+            return False
+        _worker_initialized = True
+
+    return True
 
-def azure_login(profile: AzureProfile) -> bool:
-    """az login is required prior to calling terraform: "get_nsg.py" uses Azure CLI to gather Network Security Group names"""
+
+def remove_azure_config_dirs(jobs: int) -> None:
+    """Azure CLI config dirs of workers hold login tokens - don't leave them behind"""
+
+    for slot in range(jobs):
+        shutil.rmtree(worker_directory(slot).joinpath("azure"), ignore_errors=True)
+
+
+def azure_login(profile: AzureProfile, on_retry: Optional[RetryHandler] = None) -> bool:
+    """
+    az login is required prior to calling terraform: "get_nsg.py" uses Azure CLI to gather Network Security Group names
+    on_retry is notified of every retried login attempt
+    """
+
+    from azure_cli import az_cli  # pylint: disable=import-outside-toplevel # loading Azure CLI is slow, load on demand
 
     command = f"login --service-principal -u {profile.principal_id} -p {profile.principal_secret} --tenant {profile.tenant_id}"  # returns a list
-    output_list = az_cli(command)
+    output_list = az_cli(command, max_attempts=LOGIN_MAX_ATTEMPTS, on_retry=on_retry)
     if not isinstance(output_list, list):
         print_log(
             f"Failed to login to Azure account using profile '{profile.name}' credentials",
@@ -69,16 +352,58 @@ def azure_login(profile: AzureProfile) -> bool:
 
 
 def azure_logout() -> None:
+    from azure_cli import az_cli  # pylint: disable=import-outside-toplevel
+
     az_cli("logout")
 
 
+def verify_credentials(profile: AzureProfile) -> bool:
+    """
+    In-process alternative to azure_login: acquire ARM token for profile's service principal using azure-identity,
+    without loading Azure CLI and without touching Azure CLI login state
+    """
+
+    from azure_client import credential_options  # pylint: disable=import-outside-toplevel # loads SDK, load on demand
+
+    credential = ClientSecretCredential(
+        tenant_id=profile.tenant_id,
+        client_id=profile.principal_id,
+        client_secret=profile.principal_secret,
+        **credential_options(),
+    )
+    try:
+        credential.get_token(ARM_SCOPE)
+    except AzureError:
+        log.exception("Failed to acquire token for profile '%s'", profile.name)
+        print_log(
+            f"Failed to verify Azure credentials of profile '{profile.name}'",
+            file=sys.stderr,
+            level=logging.ERROR,
+        )
+        return False
+
+    log.info("Verified Azure credentials of profile '%s'", profile.name)
+    return True
+
+
+def arm_environment(profile: AzureProfile) -> Dict[str, str]:
+    """Environment for Terraform processes of the profile; azurerm and azuread providers read ARM_* variables"""
+
+    env = os.environ.copy()
+    env["ARM_TENANT_ID"] = profile.tenant_id
+    env["ARM_SUBSCRIPTION_ID"] = profile.subscription_id
+    env["ARM_CLIENT_ID"] = profile.principal_id
+    env["ARM_CLIENT_SECRET"] = profile.principal_secret
+    return env
+
+
 def prepare_workspace(t: Terraform, workspace: str) -> bool:
     """Create or just switch workspace"""
 
     log.info('Preparing Terraform workspace "%s"', workspace)
 
-    # try switch to workspace
-    return_code, _, _ = t.set_workspace(workspace)
+    # try switch to workspace; output captured, failure is expected for new workspace
+    return_code, _, _ = t.cmd("workspace", "select", workspace, capture_output=True)
     if return_code == EX_OK:
         log.info("Workspace activated")
         return True
@@ -94,29 +419,71 @@ def prepare_workspace(t: Terraform, workspace: str) -> bool:
     return False
 
 
-def action_plan(t: Terraform, tf_vars: TerraformVars) -> bool:
+def action_plan(t: Terraform, workspace: str, tf_vars: TerraformVars) -> bool:
     """TerraformAction"""
 
+    try:
+        return save_plan(t, workspace, tf_vars) != EX_FAILED
+    finally:
+        remove_plan(workspace)
+
+
+def action_apply(t: Terraform, workspace: str, tf_vars: TerraformVars) -> bool:
+    """
+    TerraformAction
+    Apply the plan saved just before; apply is skipped entirely when the plan contains no changes
+    """
+
+    try:
+        code = save_plan(t, workspace, tf_vars)
+        if code == EX_FAILED:
+            return False
+
+        if code == EX_OK:
+            print_log("No changes. Terraform apply skipped")
+            print_log()
+            return True
+
+        print_log("Terraform apply...")
+        # variables are already in the plan - Terraform refuses any -var/-var-file when applying saved plan
+        code, stdout, stderr = t.apply(str(plan_file_path(workspace)), skip_plan=True, var=None, json=IsFlagged)
+        report_tf_output(code, stdout, stderr)
+        return code != EX_FAILED
+    finally:
+        remove_plan(workspace)
+
+
+def save_plan(t: Terraform, workspace: str, tf_vars: TerraformVars) -> int:
+    """
+    Run terraform plan and save the plan to workspace plan file
+    Return detailed exit code: EX_OK - no changes, EX_CHANGES_PRESENT - plan has changes, EX_FAILED - failure
+    """
+
     print_log("Terraform plan...")
-    code, stdout, stderr = t.plan(detailed_exitcode=IsNotFlagged, var=tf_vars)
+    plan_path = plan_file_path(workspace)
+    plan_path.parent.mkdir(mode=0o700, exist_ok=True)
+    code, stdout, stderr = t.plan(detailed_exitcode=IsFlagged, out=str(plan_path), var=tf_vars, json=IsFlagged)
     report_tf_output(code, stdout, stderr)
-    return code != EX_FAILED
+    return code
 
 
-def action_apply(t: Terraform, tf_vars: TerraformVars) -> bool:
-    """TerraformAction"""
+def plan_file_path(workspace: str) -> Path:
+    return Path(PLANS_DIRECTORY, f"{workspace}.tfplan")
 
-    print_log("Terraform apply...")
-    code, stdout, stderr = t.apply(skip_plan=True, var=tf_vars)  # skip_plan means auto-approve
-    report_tf_output(code, stdout, stderr)
-    return code != EX_FAILED
 
+def remove_plan(workspace: str) -> None:
+    """The plan contains secrets passed in variables, eg. principal_secret; it must not outlive the action"""
 
-def action_destroy(t: Terraform, tf_vars: TerraformVars) -> bool:
+    plan_path = plan_file_path(workspace)
+    if plan_path.exists():
+        plan_path.unlink()
+
+
+def action_destroy(t: Terraform, _workspace: str, tf_vars: TerraformVars) -> bool:
     """TerraformAction"""
 
     print_log("Terraform destroy...")
-    code, stdout, stderr = t.apply(destroy=IsFlagged, skip_plan=True, var=tf_vars)  # auto-approve
+    code, stdout, stderr = t.apply(destroy=IsFlagged, skip_plan=True, var=tf_vars, json=IsFlagged)  # auto-approve
     report_tf_output(code, stdout, stderr)
     return code != EX_FAILED
 
@@ -134,48 +501,173 @@ def report_tf_output(return_code: int, stdout: str, stderr: str) -> None:
         print_log("Terraform action successful")
     elif return_code == EX_FAILED:
         print_log("Terraform action FAILED", file=sys.stderr, level=logging.ERROR)
+    elif return_code == EX_CHANGES_PRESENT:
+        print_log("Terraform action successful, changes to apply are present")
     else:
         # Terraform uses codes > 1 for reporting detailed status, eg. for resource configuration diff to be applied
-        print_log("Terraform action successful, return code: ", return_code)
+        print_log(f"Terraform action successful, return code: {return_code}")
 
     print_log()
 
 
-def parse_cmd_line() -> Tuple[TerraformAction, str]:
+def parse_cmd_line() -> Tuple[TerraformAction, argparse.Namespace]:
     ACTIONS = {"plan": action_plan, "apply": action_apply, "destroy": action_destroy}
     parser = argparse.ArgumentParser()
     parser.add_argument("action", choices=["plan", "apply", "destroy"], help="Terraform step to execute")
-    parser.add_argument("--filename", default=DEFAULT_PROFILES_FILE_NAME, help="Profiles file name")
+    parser.add_argument(
+        "--filename",
+        default=DEFAULT_PROFILES_FILE_NAME,
+        help=f"Profiles file name; SQLite database if it ends with {', '.join(SQLITE_SUFFIXES)}",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=DEFAULT_JOBS, help="Number of profiles to process concurrently (default: 1)"
+    )
+    parser.add_argument(
+        "--plugin-cache-dir",
+        default=DEFAULT_PLUGIN_CACHE_DIRECTORY,
+        help="Terraform provider plugin cache shared by all workspaces and runs (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--providers-mirror-dir",
+        default=DEFAULT_PROVIDERS_MIRROR_DIRECTORY,
+        help="Local Terraform providers mirror used in offline mode (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--offline",
+        default=False,
+        action="store_true",
+        help="Install providers only from the local mirror; the mirror is populated once if it doesn't exist",
+    )
+    parser.add_argument(
+        "--force",
+        default=False,
+        action="store_true",
+        help="Process also profiles unchanged since their last successful apply",
+    )
+    parser.add_argument(
+        "--login",
+        choices=[LOGIN_AZURE_CLI, LOGIN_ENVIRONMENT],
+        default=LOGIN_AZURE_CLI,
+        help=f'How to authenticate profiles: "{LOGIN_AZURE_CLI}" - "az login" before running Terraform, '
+        f'"{LOGIN_ENVIRONMENT}" - verify credentials in-process and pass them to Terraform as ARM_* environment '
+        f"variables, without using Azure CLI (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        default=[],
+        help='Names of profiles to process; glob patterns, eg. "prod-*", are supported (default: all profiles)',
+    )
+    parser.add_argument("--location", nargs="+", default=[], help="Process only profiles in any of the Azure locations")
+    parser.add_argument(
+        "--tag",
+        nargs="+",
+        default=[],
+        help='Process only profiles having all the tags; "name" matches tag with any value, "name=value" exact tag',
+    )
+    parser.add_argument(
+        "--report",
+        default="",
+        help="Save JSON report with outcome, duration and resource changes of every phase of every profile",
+    )
+    parser.add_argument("--junit", default="", help="Save the report also as JUnit XML, a test case per profile")
+    parser.add_argument(
+        "--metrics",
+        default="",
+        help="Save phase durations, retries and Terraform exit codes in Prometheus text format (textfile collector)",
+    )
+    parser.add_argument("--trace", default="", help="Save the run, every profile and every phase as JSON lines")
     args = parser.parse_args()
-    return (ACTIONS[args.action], args.filename)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return (ACTIONS[args.action], args)
 
 
-def load_profiles_or_exit(file_path: str) -> List[AzureProfile]:
+def load_profiles_or_exit(file_path: str, selection: ProfileSelection, invalid: List[str]) -> Iterator[AzureProfile]:
     """
-    Return profile list on success
-    Exit with code FAILED when file not found or file reading error
+    Return lazy stream of selected profiles, read as they are consumed
+    Invalid profiles are reported and collected in invalid, instead of aborting the run
+    Exit with code FAILED when file not found
     """
 
     if not os.path.exists(file_path):
         print_log(f"File '{file_path}' doesn't exist", file=sys.stderr, level=logging.FATAL)
         sys.exit(EX_FAILED)
 
-    try:
-        return load_complete_profiles(file_path)
-    except (ProfilesInvalidError, ProfilesIncompleteError) as err:
-        log.exception("Failed to read profiles file '%d'", file_path)
-        print(err, file=sys.stderr)
-        sys.exit(EX_FAILED)
+    return stream_profiles(file_path, selection, invalid)
+
 
+def stream_profiles(file_path: str, selection: ProfileSelection, invalid: List[str]) -> Iterator[AzureProfile]:
+    """Yield valid selected profiles; report invalid and missing ones, collecting their names in invalid"""
 
-def print_log(msg: str = "", level: int = logging.INFO, file=sys.stdout) -> None:
-    print(msg, file=file)
+    def on_invalid(name: str, err: ProfileConfigurationError) -> None:
+        log.error("Invalid profile '%s'", name, exc_info=err)
+        print(err, file=sys.stderr)
+        invalid.append(name)
+
+    found: List[str] = []
+    for profile in select_complete_profiles(file_path, selection, on_invalid):
+        found.append(profile.name)
+        yield profile
+
+    missing = selection.missing_names(found + invalid)
+    if missing:
+        print_log(f"Profiles not found in '{file_path}': {', '.join(missing)}", file=sys.stderr, level=logging.ERROR)
+        invalid.extend(missing)
+    if not found and not invalid:
+        print_log(f"No profiles selected from '{file_path}'", level=logging.WARNING)
+
+
+def save_reports(report: RunReport, args: argparse.Namespace) -> bool:
+    """Save the reports requested on command line; return False if any failed to save"""
+
+    successful = True
+    if args.report and not report.save_json(args.report):
+        successful = False
+    if args.junit and not report.save_junit(args.junit):
+        successful = False
+    if args.metrics and not save_prometheus(report, args.metrics, "azure"):
+        successful = False
+    if args.trace and not save_trace(report, args.trace):
+        successful = False
+    return successful
+
+
+def print_log(msg: str = "", level: int = logging.INFO, file: Optional[TextIO] = None) -> None:
+    print(msg, file=file)  # file=None means current sys.stdout, which may be redirected in worker process
     log.log(level=level, msg=msg)
 
 
 if __name__ == "__main__":
-    terraform_action, profiles_file_name = parse_cmd_line()
-    azure_profiles = load_profiles_or_exit(profiles_file_name)
-    execution_successful = execute_action(terraform_action, azure_profiles)
-    exit_code = EX_OK if execution_successful else EX_FAILED
+    terraform_action, cmd_line_args = parse_cmd_line()
+    invalid_profiles: List[str] = []
+    profile_selection = ProfileSelection(cmd_line_args.profiles, cmd_line_args.location, cmd_line_args.tag)
+    azure_profiles = load_profiles_or_exit(cmd_line_args.filename, profile_selection, invalid_profiles)
+    run_report = RunReport(cmd_line_args.action)
+    with run_report.phase("init") as init_phase:
+        terraform_init_options = init_terraform(
+            cmd_line_args.plugin_cache_dir, cmd_line_args.providers_mirror_dir, cmd_line_args.offline
+        )
+        init_phase.successful = terraform_init_options is not None
+    if terraform_init_options is None:
+        save_reports(run_report, cmd_line_args)
+        sys.exit(EX_FAILED)
+    profile_fingerprints = FingerprintCache(configuration_hash(MODULE_DIRECTORY))
+    execution_successful = execute_action(
+        terraform_action,
+        azure_profiles,
+        cmd_line_args.jobs,
+        terraform_init_options,
+        profile_fingerprints,
+        cmd_line_args.force,
+        cmd_line_args.login,
+        run_report,
+    )
+    if invalid_profiles:
+        print_log(f"{len(invalid_profiles)} invalid or missing profile(s) skipped", level=logging.ERROR)
+    for invalid_profile in invalid_profiles:
+        run_report.add(ProfileReport(invalid_profile, invalid_profile, status=STATUS_INVALID))
+    if not save_reports(run_report, cmd_line_args):
+        execution_successful = False
+    exit_code = EX_OK if execution_successful and not invalid_profiles else EX_FAILED
     sys.exit(exit_code)
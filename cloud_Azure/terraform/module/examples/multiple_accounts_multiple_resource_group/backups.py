@@ -0,0 +1,290 @@
+import difflib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Union
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BACKUP_DIRECTORY: str = "backup_profiles"
+INDEX_FILE_NAME: str = "index.json"
+OBJECTS_DIRECTORY_NAME: str = "objects"
+DEFAULT_KEEP_LAST: int = 50  # backups kept per file
+MAX_DELTA_CHAIN: int = 20  # deltas in a row; then full content is stored again, to keep restore fast
+LEGACY_COPY_PATTERN = re.compile(r"^(?P<file>.+)\.(?P<time>\d{4}-\d{2}-\d{2}_\d{6})$")  # <file>.<timestamp> copies
+LEGACY_TIME_FORMAT: str = "%Y-%m-%d_%H%M%S"
+
+Delta = List[Union[List[int], str]]  # [first, last) line ranges copied from base content, or inserted text
+
+
+class BackupError(Exception):
+    pass
+
+
+@dataclass
+class RetentionPolicy:
+    """The newest backup of every file is always kept"""
+
+    keep_last: int = DEFAULT_KEEP_LAST  # backups kept per file, 0 means unlimited
+    max_age_days: float = 0.0  # backups older than that are removed, 0 means unlimited
+
+
+@dataclass
+class BackupEntry:
+    file: str  # path of the backed up file, as given
+    created: str  # ISO format
+    sha256: str  # content hash; also identifies the object holding the content
+    size: int
+
+
+@dataclass(frozen=True)
+class BackupOptions:
+    """
+    How backups are stored; BackupStore is opened with them for every backup rather than kept open,
+    so that its index includes backups made meanwhile by other tools
+    """
+
+    directory: str = DEFAULT_BACKUP_DIRECTORY
+    use_deltas: bool = False
+    retention: RetentionPolicy = field(default_factory=RetentionPolicy)
+
+    def open(self) -> "BackupStore":
+        return BackupStore(self.directory, self.use_deltas, self.retention)
+
+
+class BackupStore:
+    """
+    Content-addressed backups: every distinct content is stored once, gzip compressed, as objects/<sha256>.gz
+    Optionally, content is stored as a line delta against the previous backup of the same file.
+    index.json lists the backups in creation order, and the base object of every delta object
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_BACKUP_DIRECTORY,
+        use_deltas: bool = False,
+        retention: Optional[RetentionPolicy] = None,
+    ) -> None:
+        self._directory = Path(directory)
+        self._use_deltas = use_deltas
+        self._retention = retention or RetentionPolicy()
+        self._objects_directory = self._directory / OBJECTS_DIRECTORY_NAME
+        self._index_path = self._directory / INDEX_FILE_NAME
+        self._entries: List[BackupEntry] = []
+        self._bases: Dict[str, Optional[str]] = {}  # base object by object; None for full content objects
+        self._load_index()
+
+    def backup(self, file_path: str) -> Optional[BackupEntry]:
+        """
+        Back up the file unless it is unchanged since its last backup, and apply retention policy
+        Return the new entry, None if there was nothing to back up
+        """
+
+        if not os.path.exists(file_path):
+            log.info("Source file '%s' doesn't exist. Skipping backup", file_path)
+            return None
+
+        try:
+            self._directory.mkdir(exist_ok=True)
+            if not self._index_path.exists():
+                self._import_legacy_copies()
+            entry = self._add(file_path, Path(file_path).read_bytes(), datetime.now())
+            self._apply_retention()
+            self._save_index()
+        except OSError as err:
+            raise BackupError(f"Failed to back up '{file_path}'") from err
+
+        return entry
+
+    def entries(self, file_path: Optional[str] = None) -> List[BackupEntry]:
+        """Backups in creation order, optionally only these of given file"""
+
+        return [e for e in self._entries if file_path is None or e.file == os.path.normpath(file_path)]
+
+    def find(self, sha256_prefix: str) -> BackupEntry:
+        """Backup identified by (prefix of) its content hash"""
+
+        matching = {e.sha256: e for e in self._entries if e.sha256.startswith(sha256_prefix.lower())}
+        if len(matching) != 1:
+            raise BackupError(f"{len(matching)} backups match '{sha256_prefix}'. Exactly 1 is required")
+        return matching.popitem()[1]
+
+    def restore(self, entry: BackupEntry, file_path: str) -> None:
+        """Replace the file content with the backup; current content is backed up first"""
+
+        content = self.read(entry.sha256)
+        self.backup(file_path)
+        tmp_path = f"{file_path}.restore"
+        try:
+            Path(tmp_path).write_bytes(content)
+            os.replace(tmp_path, file_path)
+        except OSError as err:
+            raise BackupError(f"Failed to restore '{file_path}'") from err
+        log.info("Restored '%s' from backup %s", file_path, entry.sha256)
+
+    def read(self, sha256: str) -> bytes:
+        """Content of the object, with all deltas applied and verified"""
+
+        chain = [sha256]
+        while self._bases.get(chain[-1]) is not None:
+            chain.append(self._bases[chain[-1]])  # type: ignore
+
+        try:
+            content = self._read_object(chain.pop())
+            for object_id in reversed(chain):
+                content = _apply_delta(content, json.loads(self._read_object(object_id)))
+        except (OSError, ValueError, IndexError, TypeError) as err:
+            raise BackupError(f"Failed to read backup {sha256}") from err
+
+        if hashlib.sha256(content).hexdigest() != sha256:
+            raise BackupError(f"Backup {sha256} is corrupted")
+        return content
+
+    def _add(self, file_path: str, content: bytes, created: datetime) -> Optional[BackupEntry]:
+        file_name = os.path.normpath(file_path)
+        sha256 = hashlib.sha256(content).hexdigest()
+        previous = self.entries(file_name)[-1:]
+        if previous and previous[0].sha256 == sha256:
+            log.info("'%s' is unchanged since backup %s. Skipping backup", file_path, sha256)
+            return None
+
+        if sha256 not in self._bases:
+            base = previous[0].sha256 if previous and self._use_deltas else None
+            self._store_object(sha256, content, base)
+
+        entry = BackupEntry(file=file_name, created=created.isoformat(), sha256=sha256, size=len(content))
+        self._entries.append(entry)
+        log.info("Created backup %s of '%s'", sha256, file_path)
+        return entry
+
+    def _store_object(self, sha256: str, content: bytes, base: Optional[str]) -> None:
+        """Store delta against base if it is smaller than full content; only text content can be stored as delta"""
+
+        data = gzip.compress(content)
+        if base is not None and self._delta_chain_length(base) < MAX_DELTA_CHAIN:
+            try:
+                delta = _make_delta(self.read(base), content)
+                delta_data = gzip.compress(json.dumps(delta, separators=(",", ":")).encode("utf-8"))
+                if len(delta_data) < len(data):
+                    data = delta_data
+                else:
+                    base = None
+            except (UnicodeDecodeError, BackupError):
+                log.debug("Storing full content of backup %s", sha256, exc_info=True)
+                base = None
+        else:
+            base = None
+
+        self._objects_directory.mkdir(exist_ok=True)
+        self._object_path(sha256).write_bytes(data)
+        self._bases[sha256] = base
+
+    def _read_object(self, object_id: str) -> bytes:
+        return gzip.decompress(self._object_path(object_id).read_bytes())
+
+    def _object_path(self, object_id: str) -> Path:
+        return self._objects_directory / f"{object_id}.gz"
+
+    def _delta_chain_length(self, object_id: str) -> int:
+        length = 0
+        base = self._bases.get(object_id)
+        while base is not None:
+            length += 1
+            base = self._bases.get(base)
+        return length
+
+    def _apply_retention(self) -> None:
+        policy = self._retention
+        oldest = datetime.now() - timedelta(days=policy.max_age_days) if policy.max_age_days > 0 else None
+        kept: List[BackupEntry] = []
+        newer_count: Dict[str, int] = {}  # newer backups kept, by file
+        for entry in reversed(self._entries):
+            count = newer_count.get(entry.file, 0)
+            expired = (policy.keep_last > 0 and count >= policy.keep_last) or (
+                oldest is not None and datetime.fromisoformat(entry.created) < oldest
+            )
+            if count == 0 or not expired:
+                kept.append(entry)
+                newer_count[entry.file] = count + 1
+        if len(kept) == len(self._entries):
+            return
+
+        log.info("Removing %d backups expired by retention policy", len(self._entries) - len(kept))
+        self._entries = list(reversed(kept))
+        self._remove_unreferenced_objects()
+
+    def _remove_unreferenced_objects(self) -> None:
+        referenced: Set[str] = set()
+        for entry in self._entries:
+            object_id: Optional[str] = entry.sha256
+            while object_id is not None and object_id not in referenced:
+                referenced.add(object_id)
+                object_id = self._bases.get(object_id)
+
+        for object_id in [o for o in self._bases if o not in referenced]:
+            del self._bases[object_id]
+            try:
+                self._object_path(object_id).unlink()
+            except OSError:
+                log.warning("Failed to remove backup object %s", object_id, exc_info=True)
+
+    def _import_legacy_copies(self) -> None:
+        """Move timestamped full copies made by previous versions of the tool into the store; identical ones dedupe"""
+
+        copies = []
+        for path in self._directory.iterdir():
+            match = LEGACY_COPY_PATTERN.match(path.name)
+            if path.is_file() and match:
+                copies.append((datetime.strptime(match["time"], LEGACY_TIME_FORMAT), match["file"], path))
+        if not copies:
+            return
+
+        log.info("Importing %d legacy backup copies from '%s'", len(copies), self._directory)
+        for created, file_name, path in sorted(copies):
+            self._add(file_name, path.read_bytes(), created)
+        self._save_index()  # before removing the copies, so that they are never lost
+        for _, _, path in copies:
+            path.unlink()
+
+    def _load_index(self) -> None:
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                index: Dict[str, Any] = json.load(f)
+            self._entries = [BackupEntry(**e) for e in index["backups"]]
+            self._bases = index["bases"]
+        except FileNotFoundError:
+            log.debug("Backup index '%s' doesn't exist yet", self._index_path)
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            raise BackupError(f"Failed to read backup index '{self._index_path}'") from err
+
+    def _save_index(self) -> None:
+        index = {"backups": [asdict(e) for e in self._entries], "bases": self._bases}
+        tmp_path = self._index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, self._index_path)  # never leave partially written index behind
+
+
+def _make_delta(base: bytes, content: bytes) -> Delta:
+    base_lines = base.decode("utf-8").splitlines(keepends=True)
+    lines = content.decode("utf-8").splitlines(keepends=True)
+    delta: Delta = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines)  # autojunk keeps it fast on repetitive INI lines
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            delta.append("".join(lines[j1:j2]))
+    return delta
+
+
+def _apply_delta(base: bytes, delta: Delta) -> bytes:
+    base_lines = base.decode("utf-8").splitlines(keepends=True)
+    parts = ["".join(base_lines[item[0] : item[1]]) if isinstance(item, list) else item for item in delta]
+    return "".join(parts).encode("utf-8")
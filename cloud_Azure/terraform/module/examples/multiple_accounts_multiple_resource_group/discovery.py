@@ -0,0 +1,154 @@
+import configparser
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from typing import List, Optional, Tuple
+
+from azure_client import AzureClient, AzureClientError, AzureLogin, ServicePrincipal
+from profiles import AzureProfile
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MANIFEST_FILE_NAME: str = "discovery.ini"
+
+
+class ManifestError(Exception):
+    pass
+
+
+@dataclass
+class DiscoveryRule:
+    """
+    Selection of resource groups to generate profiles for, in all subscriptions of a tenant accessible to the user
+    A profile is generated for every subscription and location with at least one matching resource group
+    """
+
+    name: str  # manifest section; prefix of generated profile names
+    tenant_id: str
+    subscriptions: List[str] = field(default_factory=lambda: ["*"])  # subscription ID globs
+    locations: List[str] = field(default_factory=list)  # empty means all locations
+    resource_groups: List[str] = field(default_factory=lambda: ["*"])  # name globs, case-insensitive
+    tag_name: str = ""
+    tag_value: Optional[str] = None  # None means any value of tag_name
+
+    def matches_subscription(self, subscription_id: str) -> bool:
+        return any(fnmatchcase(subscription_id.lower(), pattern.lower()) for pattern in self.subscriptions)
+
+    def matches_location(self, location: str) -> bool:
+        return not self.locations or location.lower() in (l.lower() for l in self.locations)
+
+    def matches_resource_group(self, name: str) -> bool:
+        return any(fnmatchcase(name.lower(), pattern.lower()) for pattern in self.resource_groups)
+
+    def profile_name(self, subscription_id: str, location: str) -> str:
+        return f"{self.name}-{subscription_id}-{location}"
+
+
+def load_manifest(file_path: str) -> List[DiscoveryRule]:
+    """
+    Manifest is INI file with a section per rule, eg.:
+    [production]
+    tenant_id = 934cbdb4-6e26-7e5e-8146-f598249437a0
+    subscriptions = *                         (optional; comma-separated subscription ID globs)
+    locations = eastus,westeurope             (optional; comma-separated, all locations if empty)
+    resource_groups = prod-*,shared-*         (optional; comma-separated name globs)
+    tag = environment=production              (optional; tag name, or name=value)
+    """
+
+    def split(value: str) -> List[str]:
+        return [item.strip() for item in value.split(",") if item.strip()]
+
+    config = configparser.ConfigParser()
+    try:
+        with open(file_path, encoding="utf-8") as f:
+            config.read_file(f)
+    except (OSError, configparser.Error) as err:
+        raise ManifestError(f"Failed to load manifest '{file_path}'") from err
+
+    rules = []
+    for name in config.sections():
+        section = config[name]
+        tenant_id = section.get("tenant_id", "").strip()
+        if not tenant_id:
+            raise ManifestError(f"Manifest rule '{name}' is missing tenant_id")
+
+        tag_name, _, tag_value = section.get("tag", "").partition("=")
+        rules.append(
+            DiscoveryRule(
+                name=name,
+                tenant_id=tenant_id,
+                subscriptions=split(section.get("subscriptions", "")) or ["*"],
+                locations=split(section.get("locations", "")),
+                resource_groups=split(section.get("resource_groups", "")) or ["*"],
+                tag_name=tag_name.strip(),
+                tag_value=tag_value.strip() if "=" in section.get("tag", "") else None,
+            )
+        )
+    return rules
+
+
+def discover_subscriptions(client: AzureClient, rule: DiscoveryRule) -> List[str]:
+    return [s for s in client.list_subscription_ids() if rule.matches_subscription(s)]
+
+
+def discover_profiles(
+    rule: DiscoveryRule,
+    subscription_ids: List[str],
+    principal: ServicePrincipal,
+    principal_object_id: str,
+    jobs: int = 1,
+    azure: AzureLogin = AzureLogin(),
+) -> Tuple[List[AzureProfile], bool]:
+    """
+    Resolve matching resource groups of all subscriptions concurrently, and make sure the principal is Owner
+    in every subscription that gets a profile. Return profiles, and False if any subscription failed
+    """
+
+    profiles: List[AzureProfile] = []
+    all_successful = True
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            s: executor.submit(_discover_subscription, rule, s, principal, principal_object_id, azure)
+            for s in subscription_ids
+        }
+        for subscription_id, future in futures.items():
+            try:
+                profiles.extend(future.result())
+            except AzureClientError:
+                log.exception("Failed to discover resource groups in subscription '%s'", subscription_id)
+                all_successful = False
+    return profiles, all_successful
+
+
+def _discover_subscription(
+    rule: DiscoveryRule, subscription_id: str, principal: ServicePrincipal, principal_object_id: str, azure: AzureLogin
+) -> List[AzureProfile]:
+    client = azure.login_user(rule.tenant_id, subscription_id, verify_credentials=False)
+    if rule.tag_name:
+        groups = client.resource_groups_with_tag(rule.tag_name, rule.tag_value)
+    else:
+        groups = client.resource_groups_by_location()
+
+    profiles = []
+    for location, names in sorted(groups.items()):
+        selected = [n for n in names if rule.matches_resource_group(n)]
+        if not selected or not rule.matches_location(location):
+            continue
+        profiles.append(
+            AzureProfile(
+                name=rule.profile_name(subscription_id, location),
+                subscription_id=subscription_id,
+                tenant_id=rule.tenant_id,
+                principal_id=principal.app_id,
+                principal_secret=principal.secret,
+                location=location,
+                resource_group_names=selected,
+                storage_account_names=[],
+            )
+        )
+
+    if profiles:
+        client.ensure_owner_role(principal_object_id)
+    log.debug("Discovered %d profiles in subscription '%s'", len(profiles), subscription_id)
+    return profiles
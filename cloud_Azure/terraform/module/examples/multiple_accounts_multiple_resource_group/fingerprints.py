@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FINGERPRINTS_FILE_NAME: str = ".onboarder_fingerprints.json"
+
+MODULE_FILE_SUFFIXES = (".tf", ".tfvars", ".tmpl", ".json")  # module files affecting Terraform configuration
+ROOT_FILE_SUFFIXES = (".tf", ".tfvars", ".hcl")  # root module files affecting Terraform configuration, incl. lock file
+MODULE_EXCLUDED_DIRECTORIES = ("examples", "tests")  # module subdirectories not being part of the module itself
+
+
+def configuration_hash(module_dir: str, root_dir: str = ".") -> str:
+    """
+    Hash Terraform configuration: module source tree and files of root module directory (top-level only),
+    including .terraform.lock.hcl, so that any change of the configuration or provider versions changes the hash
+    """
+
+    digest = hashlib.sha256()
+    for path in sorted(_module_files(Path(module_dir))) + sorted(_root_files(Path(root_dir))):
+        digest.update(str(path).encode("utf-8"))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _module_files(module_dir: Path) -> Iterable[Path]:
+    for directory, subdirectories, file_names in os.walk(module_dir):
+        # prune in place, so that os.walk doesn't descend into excluded directories
+        subdirectories[:] = [
+            d for d in subdirectories if not d.startswith(".") and d not in MODULE_EXCLUDED_DIRECTORIES
+        ]
+        for name in file_names:
+            if name.endswith(MODULE_FILE_SUFFIXES):
+                yield Path(directory, name)
+
+
+def _root_files(root_dir: Path) -> Iterable[Path]:
+    return (p for p in root_dir.iterdir() if p.is_file() and p.name.endswith(ROOT_FILE_SUFFIXES))
+
+
+class FingerprintCache:
+    """
+    Fingerprints of workspaces last successfully applied, stored in a local JSON file
+    Fingerprint covers workspace inputs (Terraform variables, credentials) and the Terraform configuration hash.
+    A workspace whose current fingerprint equals the stored one doesn't need to be planned or applied again
+    """
+
+    def __init__(self, config_hash: str, file_path: str = DEFAULT_FINGERPRINTS_FILE_NAME) -> None:
+        self._config_hash = config_hash
+        self._file_path = file_path
+        self._entries: Dict[str, Dict[str, str]] = {}
+        try:
+            with open(file_path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            log.debug("Fingerprints file '%s' doesn't exist yet", file_path)
+        except (OSError, ValueError):
+            log.exception("Failed to read fingerprints file '%s'. Starting with empty cache", file_path)
+
+    def fingerprint(self, inputs: Dict[str, Any]) -> str:
+        """Inputs may contain secrets - only their hash is ever stored"""
+
+        data = json.dumps({"inputs": inputs, "configuration": self._config_hash}, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def is_unchanged(self, workspace: str, inputs: Dict[str, Any]) -> bool:
+        entry = self._entries.get(workspace)
+        return entry is not None and entry["fingerprint"] == self.fingerprint(inputs)
+
+    def record_applied(self, workspace: str, inputs: Dict[str, Any]) -> None:
+        self._entries[workspace] = {"fingerprint": self.fingerprint(inputs), "applied": datetime.now().isoformat()}
+
+    def forget(self, workspace: str) -> None:
+        self._entries.pop(workspace, None)
+
+    def save(self) -> bool:
+        try:
+            with open(self._file_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, indent=2, sort_keys=True)
+        except OSError:
+            log.exception("Failed to save fingerprints file '%s'", self._file_path)
+            return False
+        return True
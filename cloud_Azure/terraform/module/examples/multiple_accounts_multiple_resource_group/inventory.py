@@ -0,0 +1,321 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from azure_client import (
+    NETWORK_SECURITY_GROUP_TYPE,
+    AppRegistration,
+    AzureClientError,
+    AzureLogin,
+    LoginCredentials,
+    ResourceGroupIndex,
+    secret_digest,
+)
+
+log = logging.getLogger(__name__)
+
+INVENTORY_VERSION: int = 1  # bumped on incompatible change of the snapshot format
+DEFAULT_INVENTORY_FILE_NAME: str = "inventory.json"
+DEFAULT_MAX_AGE_HOURS: float = 24.0  # older snapshot is considered stale
+
+
+@dataclass
+class SubscriptionInventory:
+    tenant_id: str
+    locations: List[str] = field(default_factory=list)
+    resource_groups: Dict[str, List[str]] = field(default_factory=dict)  # by location (lower case)
+    network_security_groups: Dict[str, List[str]] = field(default_factory=dict)  # by resource group (lower case)
+
+
+@dataclass
+class PrincipalInventory:
+    """Service principal that was able to login at inventory time; only hash of the secret is stored"""
+
+    tenant_id: str
+    app_id: str
+    secret_sha256: str
+    subscription_ids: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Inventory:
+    """
+    Snapshot of Azure information used by profiles_tool: subscriptions accessible to the principals of the profiles,
+    their locations, resource groups and network security groups, and existing app registrations.
+    Serves login_user/login_application like AzureClient does, but with SnapshotClients that make no network calls
+    """
+
+    created: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    version: int = INVENTORY_VERSION
+    subscriptions: Dict[str, SubscriptionInventory] = field(default_factory=dict)
+    principals: List[PrincipalInventory] = field(default_factory=list)
+    app_registrations: Dict[str, Dict[str, List[str]]] = field(default_factory=dict)  # by tenant, by name
+
+    def age_hours(self) -> float:
+        return (datetime.now(timezone.utc) - datetime.fromisoformat(self.created)).total_seconds() / 3600
+
+    def login_user(
+        self, tenant_id: str, subscription_id: str = "", verify_credentials: bool = True
+    ) -> "SnapshotClient":
+        """There are no user credentials to verify offline; subscription must be known for the tenant"""
+
+        if tenant_id == "":
+            raise AzureClientError("Failed to initialize client - tenant_id is required")
+
+        available = sorted(s for s, data in self.subscriptions.items() if data.tenant_id == tenant_id)
+        return self._client(tenant_id, subscription_id, available)
+
+    def login_application(self, lc: LoginCredentials, verify_credentials: bool = True) -> "SnapshotClient":
+        """Credentials are valid if they were valid at inventory time"""
+
+        if lc.tenant_id == "" or lc.principal.app_id == "" or lc.principal.secret == "":
+            raise AzureClientError("Failed to initialize client - tenant_id and principal are required")
+
+        digest = secret_digest(lc.principal.secret)
+        for p in self.principals:
+            if (p.tenant_id, p.app_id, p.secret_sha256) == (lc.tenant_id, lc.principal.app_id, digest):
+                return self._client(lc.tenant_id, lc.subscription_id, p.subscription_ids)
+        raise AzureClientError("Provided credentials are not in inventory snapshot")
+
+    def _client(self, tenant_id: str, subscription_id: str, available: List[str]) -> "SnapshotClient":
+        if not available:
+            raise AzureClientError("Failed to select SubscriptionID - no subscriptions in inventory snapshot")
+        if subscription_id == "":
+            subscription_id = available[0]
+            log.debug("Automatically selected Subscription ID: '%s'", subscription_id)
+        elif subscription_id not in available:
+            raise AzureClientError(f"SubscriptionID '{subscription_id}' not in inventory snapshot")
+        return SnapshotClient(self, tenant_id, subscription_id)
+
+
+class SnapshotClient:
+    """Read-only AzureClient counterpart answering from Inventory"""
+
+    def __init__(self, inventory: Inventory, tenant_id: str, subscription_id: str) -> None:
+        self._inventory = inventory
+        self._tenant_id = tenant_id
+        self._subscription_id = subscription_id
+        self._subscription = inventory.subscriptions[subscription_id]
+
+    @property
+    def tenant_id(self) -> str:
+        return self._tenant_id
+
+    @property
+    def subscription_id(self) -> str:
+        return self._subscription_id
+
+    def list_subscription_ids(self) -> List[str]:
+        return sorted(s for s, data in self._inventory.subscriptions.items() if data.tenant_id == self.tenant_id)
+
+    def list_locations(self) -> List[str]:
+        return list(self._subscription.locations)
+
+    def list_resource_groups(self, location: str) -> List[str]:
+        return list(self._subscription.resource_groups.get(location.lower(), []))
+
+    def resource_groups_by_location(self) -> Dict[str, List[str]]:
+        return {location: list(names) for location, names in self._subscription.resource_groups.items()}
+
+    def find_missing_resource_groups(self, location: str, names: Iterable[str]) -> List[str]:
+        available = {n.casefold() for n in self.list_resource_groups(location)}  # names are case-insensitive
+        return sorted({n for n in names if n.casefold() not in available})
+
+    def list_network_security_groups(self, resource_group: str) -> List[str]:
+        return list(self._subscription.network_security_groups.get(resource_group.lower(), []))
+
+    def network_security_groups_by_resource_group(self) -> Dict[str, List[str]]:
+        return {group: list(names) for group, names in self._subscription.network_security_groups.items()}
+
+    def find_app_registrations(self, name: str) -> List[str]:
+        return list(self._inventory.app_registrations.get(self.tenant_id, {}).get(name, []))
+
+    def create_app_registration(self, name: str) -> AppRegistration:
+        raise AzureClientError(f"Can't create app registration '{name}' from inventory snapshot")
+
+
+def take_inventory(
+    credentials: Iterable[LoginCredentials],
+    app_registration_names: List[str],
+    jobs: int = 1,
+    azure: AzureLogin = AzureLogin(),
+) -> Tuple[Inventory, bool]:
+    """
+    Inventory everything accessible with given credentials, up to "jobs" API clients working concurrently
+    With azure.use_resource_graph, resource groups and NSGs of all subscriptions of a principal
+    are fetched with a single Resource Graph query each
+    Return the inventory, and False if any part of it failed (the inventory is then incomplete)
+    """
+
+    # every principal is inventoried once, no matter how many profiles use it
+    unique: Dict[Tuple[str, str, str], LoginCredentials] = {}
+    for lc in credentials:
+        unique.setdefault((lc.tenant_id, lc.principal.app_id, secret_digest(lc.principal.secret)), lc)
+
+    inventory = Inventory()
+    all_successful = True
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # 1st pass: subscriptions accessible to every principal
+        subscriptions: Dict[str, LoginCredentials] = {}  # credentials to inventory subscription with
+        futures = {key: executor.submit(_subscription_ids, azure, lc) for key, lc in unique.items()}
+        for (tenant_id, app_id, digest), future in futures.items():
+            lc = unique[(tenant_id, app_id, digest)]
+            try:
+                subscription_ids = future.result()
+            except AzureClientError:
+                log.exception("Failed to inventory subscriptions of principal '%s' in tenant '%s'", app_id, tenant_id)
+                all_successful = False
+                continue
+            inventory.principals.append(PrincipalInventory(tenant_id, app_id, digest, subscription_ids))
+            for subscription_id in subscription_ids:
+                subscriptions.setdefault(subscription_id, LoginCredentials(tenant_id, subscription_id, lc.principal))
+
+        # 2nd pass: app registrations of every tenant and contents of every subscription
+        tenants = {lc.tenant_id: lc for lc in subscriptions.values()}
+        app_futures = {
+            t: executor.submit(_app_registrations, azure, lc, app_registration_names) for t, lc in tenants.items()
+        }
+        prefetched: Dict[str, SubscriptionInventory] = {}
+        if azure.use_resource_graph:
+            prefetched, successful = _prefetch_with_resource_graph(azure, executor, subscriptions)
+            all_successful = all_successful and successful
+        subscription_futures = {
+            s: executor.submit(_subscription, azure, lc, prefetched.get(s)) for s, lc in subscriptions.items()
+        }
+        for tenant_id, future in app_futures.items():
+            try:
+                inventory.app_registrations[tenant_id] = future.result()
+            except AzureClientError:
+                log.exception("Failed to inventory app registrations in tenant '%s'", tenant_id)
+                all_successful = False
+        for subscription_id, future in subscription_futures.items():
+            try:
+                inventory.subscriptions[subscription_id] = future.result()
+            except AzureClientError:
+                log.exception("Failed to inventory subscription '%s'", subscription_id)
+                all_successful = False
+
+    # principals may only refer to inventoried subscriptions
+    for p in inventory.principals:
+        p.subscription_ids = [s for s in p.subscription_ids if s in inventory.subscriptions]
+    return inventory, all_successful
+
+
+def _subscription_ids(azure: AzureLogin, lc: LoginCredentials) -> List[str]:
+    return azure.login_application(lc).list_subscription_ids()
+
+
+def _app_registrations(azure: AzureLogin, lc: LoginCredentials, names: List[str]) -> Dict[str, List[str]]:
+    client = azure.login_application(lc, verify_credentials=False)
+    return {name: client.find_app_registrations(name) for name in names}
+
+
+def _prefetch_with_resource_graph(
+    azure: AzureLogin, executor: ThreadPoolExecutor, subscriptions: Dict[str, LoginCredentials]
+) -> Tuple[Dict[str, SubscriptionInventory], bool]:
+    """Resource groups and NSGs of subscriptions, queried once for all subscriptions of every principal"""
+
+    by_principal: Dict[Tuple[str, str, str], List[str]] = {}
+    for subscription_id, lc in subscriptions.items():
+        by_principal.setdefault((lc.tenant_id, lc.principal.app_id, secret_digest(lc.principal.secret)), []).append(
+            subscription_id
+        )
+
+    futures = {
+        key: executor.submit(_query_resource_graph, azure, subscriptions[subscription_ids[0]], subscription_ids)
+        for key, subscription_ids in by_principal.items()
+    }
+    result: Dict[str, SubscriptionInventory] = {}
+    successful = True
+    for (tenant_id, app_id, _), future in futures.items():
+        try:
+            result.update(future.result())
+        except AzureClientError:
+            log.exception("Failed to query Resource Graph for principal '%s' in tenant '%s'", app_id, tenant_id)
+            successful = False
+    return result, successful
+
+
+def _query_resource_graph(
+    azure: AzureLogin, lc: LoginCredentials, subscription_ids: List[str]
+) -> Dict[str, SubscriptionInventory]:
+    graph = azure.login_application(lc, verify_credentials=False).resource_graph
+    groups = graph.resource_groups(subscription_ids)
+    nsgs = graph.resources_by_resource_group(NETWORK_SECURITY_GROUP_TYPE, subscription_ids)
+    return {
+        s: SubscriptionInventory(
+            tenant_id=lc.tenant_id,
+            resource_groups=ResourceGroupIndex(groups[s]).by_location(),
+            network_security_groups=nsgs[s],
+        )
+        for s in subscription_ids
+    }
+
+
+def _subscription(
+    azure: AzureLogin, lc: LoginCredentials, prefetched: Optional[SubscriptionInventory] = None
+) -> SubscriptionInventory:
+    client = azure.login_application(lc, verify_credentials=False)
+    if prefetched is not None:
+        prefetched.locations = client.list_locations()
+        return prefetched
+
+    return SubscriptionInventory(
+        tenant_id=lc.tenant_id,
+        locations=client.list_locations(),
+        resource_groups=client.resource_groups_by_location(),
+        network_security_groups=client.network_security_groups_by_resource_group(),
+    )
+
+
+def save_inventory(file_path: str, inventory: Inventory) -> bool:
+    """Snapshot is compact JSON, readable only by the owner as it holds hashes of secrets"""
+
+    try:
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(asdict(inventory), f, separators=(",", ":"), sort_keys=True)
+    except OSError:
+        log.exception("Failed to save inventory snapshot '%s'", file_path)
+        return False
+
+    log.info("Saved inventory snapshot '%s'", file_path)
+    return True
+
+
+def load_inventory(file_path: str, max_age_hours: float = DEFAULT_MAX_AGE_HOURS) -> Optional[Inventory]:
+    """Return None if the snapshot can't be loaded, is of unsupported version, or is older than max_age_hours"""
+
+    try:
+        with open(file_path, encoding="utf-8") as f:
+            data = json.load(f)
+        inventory = Inventory(
+            created=data["created"],
+            version=data["version"],
+            subscriptions={s: SubscriptionInventory(**v) for s, v in data["subscriptions"].items()},
+            principals=[PrincipalInventory(**p) for p in data["principals"]],
+            app_registrations=data["app_registrations"],
+        )
+        age_hours = inventory.age_hours()  # malformed or timezone-less "created" fails here
+    except (OSError, ValueError, KeyError, TypeError):
+        log.exception("Failed to load inventory snapshot '%s'", file_path)
+        return None
+
+    if inventory.version != INVENTORY_VERSION:
+        log.error("Unsupported inventory snapshot version %s in '%s'", inventory.version, file_path)
+        return None
+
+    if age_hours > max_age_hours:
+        log.error(
+            "Inventory snapshot '%s' is stale: %.1f hours old, %.1f allowed. Run inventory again",
+            file_path,
+            age_hours,
+            max_age_hours,
+        )
+        return None
+
+    return inventory
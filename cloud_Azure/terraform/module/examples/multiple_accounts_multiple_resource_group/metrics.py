@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from run_report import STATUS_FAILED, STATUS_INVALID, STATUS_SKIPPED, STATUS_SUCCESSFUL, PhaseReport, RunReport
+
+log = logging.getLogger(__name__)
+
+METRIC_PREFIX: str = "onboarder"
+TRACE_KIND_RUN: str = "run"
+TRACE_KIND_PROFILE: str = "profile"
+TRACE_KIND_PHASE: str = "phase"
+
+Labels = Dict[str, str]
+Sample = Tuple[Labels, float]
+
+
+def save_prometheus(report: RunReport, file_path: str, onboarder: str) -> bool:
+    """
+    Save run metrics in Prometheus text format, for node_exporter textfile collector: run-wide totals,
+    aggregate and per-profile phase durations, retries and Terraform exit codes
+    The file is replaced atomically, so that the collector never reads it partially written
+    """
+
+    run_labels = {"onboarder": onboarder, "action": report.action}
+    tmp_path = f"{file_path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for name, help_text, samples in _metric_families(report):
+                _write_family(f, name, help_text, [({**run_labels, **labels}, value) for labels, value in samples])
+        os.replace(tmp_path, file_path)
+    except OSError:
+        log.exception("Failed to save metrics '%s'", file_path)
+        return False
+    return True
+
+
+def save_trace(report: RunReport, file_path: str) -> bool:
+    """
+    Save the run, every profile and every phase as a JSON line each; the run first, then the others in the order
+    they started. Profiles never processed, ie. skipped and invalid ones, have no start time and come right after the run
+    """
+
+    run_id = report.started.isoformat()
+    run_span = {
+        "kind": TRACE_KIND_RUN,
+        "run": run_id,
+        "action": report.action,
+        "start_time": report.started.timestamp(),
+        "duration_sec": report.duration_sec(),
+    }
+    spans: List[Dict[str, Any]] = []
+    spans.extend(_phase_span(run_id, None, p) for p in report.phases)
+    for profile in report.profiles:
+        spans.append(
+            {
+                "kind": TRACE_KIND_PROFILE,
+                "run": run_id,
+                "profile": profile.name,
+                "status": profile.status,
+                "start_time": profile.start_time,
+                "duration_sec": profile.duration_sec,
+            }
+        )
+        spans.extend(_phase_span(run_id, profile.name, p) for p in profile.phases)
+
+    try:
+        with open(file_path, "w", encoding="utf-8") as f:
+            for span in [run_span] + sorted(spans, key=lambda s: s["start_time"]):
+                f.write(json.dumps(span) + "\n")
+    except OSError:
+        log.exception("Failed to save trace '%s'", file_path)
+        return False
+    return True
+
+
+def _phase_span(run_id: str, profile: Optional[str], phase: PhaseReport) -> Dict[str, Any]:
+    return {
+        "kind": TRACE_KIND_PHASE,
+        "run": run_id,
+        "profile": profile,
+        "phase": phase.name,
+        "successful": phase.successful,
+        "start_time": phase.start_time,
+        "duration_sec": phase.duration_sec,
+        "exit_code": phase.exit_code,
+        "retries": phase.retries,
+    }
+
+
+def _metric_families(report: RunReport) -> Iterator[Tuple[str, str, List[Sample]]]:
+    totals = report.totals()
+    yield "run_timestamp_seconds", "Start of the run", [({}, report.started.timestamp())]
+    yield "run_duration_seconds", "Duration of the run", [({}, report.duration_sec())]
+    yield "profiles", "Profiles by status", [
+        ({"status": s}, totals[s]) for s in (STATUS_SUCCESSFUL, STATUS_FAILED, STATUS_SKIPPED, STATUS_INVALID)
+    ]
+    yield "resource_changes", "Resources added, changed and removed", [
+        ({"change": c}, totals[c]) for c in ("add", "change", "remove")
+    ]
+
+    # aggregates over all profiles, by phase name; run-wide phases are aggregates of their own
+    by_name = _by_name(list(report.phases) + [p for profile in report.profiles for p in profile.phases])
+    yield "phase_duration_seconds_sum", "Total duration of the phase over all profiles", [
+        ({"phase": n}, sum(p.duration_sec for p in phases)) for n, phases in by_name.items()
+    ]
+    yield "phase_duration_seconds_max", "Longest duration of the phase", [
+        ({"phase": n}, max(p.duration_sec for p in phases)) for n, phases in by_name.items()
+    ]
+    yield "phase_count", "Number of times the phase ran", [({"phase": n}, len(phases)) for n, phases in by_name.items()]
+    yield "phase_failures", "Number of times the phase failed", [
+        ({"phase": n}, sum(1 for p in phases if not p.successful)) for n, phases in by_name.items()
+    ]
+    yield "phase_retries", "Transient failures retried in the phase", [
+        ({"phase": n}, sum(p.retries for p in phases)) for n, phases in by_name.items()
+    ]
+
+    # per profile; a phase may run more than once in a profile, eg. nested commands of the same name, so its runs
+    # are aggregated like above - every sample must have a unique label set
+    processed = [p for p in report.profiles if p.phases]
+    yield "profile_duration_seconds", "Duration of processing the profile", [
+        ({"profile": p.name, "status": p.status}, p.duration_sec) for p in processed
+    ]
+    profile_phases = [(p.name, n, phases) for p in processed for n, phases in _by_name(p.phases).items()]
+    yield "profile_phase_duration_seconds", "Total duration of the phase of the profile", [
+        ({"profile": p, "phase": n}, sum(phase.duration_sec for phase in phases)) for p, n, phases in profile_phases
+    ]
+    yield "profile_phase_count", "Number of times the phase of the profile ran", [
+        ({"profile": p, "phase": n}, len(phases)) for p, n, phases in profile_phases
+    ]
+    yield "profile_phase_retries", "Transient failures retried in the phase of the profile", [
+        ({"profile": p, "phase": n}, sum(phase.retries for phase in phases)) for p, n, phases in profile_phases
+    ]
+    yield "profile_terraform_exit_code", "Exit code of the last Terraform command of the phase of the profile", [
+        ({"profile": p, "phase": n}, [phase.exit_code for phase in phases if phase.exit_code is not None][-1])
+        for p, n, phases in profile_phases
+        if any(phase.exit_code is not None for phase in phases)
+    ]
+
+
+def _by_name(phases: List[PhaseReport]) -> Dict[str, List[PhaseReport]]:
+    by_name: Dict[str, List[PhaseReport]] = {}
+    for phase in phases:
+        by_name.setdefault(phase.name, []).append(phase)
+    return by_name
+
+
+def _write_family(f: TextIO, name: str, help_text: str, samples: List[Sample]) -> None:
+    if not samples:
+        return
+
+    metric = f"{METRIC_PREFIX}_{name}"
+    f.write(f"# HELP {metric} {help_text}\n")
+    f.write(f"# TYPE {metric} gauge\n")
+    for labels, value in samples:
+        label_text = ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in labels.items())
+        f.write(f"{metric}{{{label_text}}} {_format_value(value)}\n")
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
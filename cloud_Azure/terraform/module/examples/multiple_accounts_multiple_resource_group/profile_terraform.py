@@ -0,0 +1,153 @@
+import io
+import json
+import logging
+import subprocess
+import sys
+import threading
+from typing import IO, Any, Callable, Dict, Optional, TextIO, Tuple
+
+from python_terraform import Terraform
+
+from run_report import ProfileReport
+
+log = logging.getLogger(__name__)
+
+
+TerraformEvent = Dict[str, Any]  # single message of machine-readable (-json) UI output
+EventHandler = Callable[[TerraformEvent], None]
+
+
+class PrefixedOutput:
+    """
+    Sink of Terraform output lines: written to the console as soon as they arrive, prefixed with the profile name,
+    so that output of concurrently processed profiles can be told apart, and as is to the profile's log file
+    Lines of machine-readable (-json) UI output are passed to the event handler, and only their human-readable
+    message is written to the console
+    """
+
+    def __init__(self, prefix: str, log_file: Optional[TextIO] = None) -> None:
+        self._prefix = f"[{prefix}] "
+        self._log_file = log_file
+        self._lock = threading.Lock()  # stdout and stderr are read by separate threads
+
+    def pipe(self, stream: IO[bytes], is_stderr: bool, on_event: Optional[EventHandler] = None) -> None:
+        """Copy the stream line by line until it is closed"""
+
+        for line in io.TextIOWrapper(stream, encoding="utf-8", errors="replace"):
+            event = parse_event(line)
+            if event is None:
+                self.write_line(line, is_stderr)
+                continue
+            if on_event is not None:
+                on_event(event)
+            self.write_line(f"{format_event(event)}\n", is_stderr, line)
+
+    def write_line(self, line: str, is_stderr: bool, raw_line: Optional[str] = None) -> None:
+        """Write the line to the console with the prefix, and raw_line (the line itself by default) to the log file"""
+
+        # real console streams, also in worker processes whose sys.stdout/sys.stderr are redirected to this output
+        console = sys.__stderr__ if is_stderr else sys.__stdout__
+        with self._lock:
+            console.write(self._prefix + line)
+            console.flush()
+            if self._log_file is not None:
+                self._log_file.write(line if raw_line is None else raw_line)
+                self._log_file.flush()
+
+
+class PrefixedStream:
+    """
+    File-like object passing text written to it to PrefixedOutput line by line, eg. to redirect sys.stdout
+    of a worker process, so that whatever the worker prints is prefixed and shows up live, like Terraform output
+    Incomplete line is held until it is completed or the stream is flushed
+    """
+
+    def __init__(self, output: PrefixedOutput, is_stderr: bool) -> None:
+        self._output = output
+        self._is_stderr = is_stderr
+        self._partial_line = ""
+
+    def write(self, text: str) -> int:
+        *lines, self._partial_line = (self._partial_line + text).split("\n")
+        for line in lines:
+            self._output.write_line(line + "\n", self._is_stderr)
+        return len(text)
+
+    def flush(self) -> None:
+        if self._partial_line:
+            self._output.write_line(self._partial_line + "\n", self._is_stderr)
+            self._partial_line = ""
+
+
+class ProfileTerraform(Terraform):
+    """
+    Terraform wrapper running every command with given environment instead of a copy of os.environ,
+    so that profile credentials are only ever visible to Terraform processes of that profile
+    With output, command output is streamed to it line by line instead of being collected; stdout and stderr
+    returned from cmd are then empty. capture_output=True collects the output of the command anyway
+    """
+
+    def __init__(
+        self,
+        env: Dict[str, str],
+        output: Optional[PrefixedOutput] = None,
+        report: Optional[ProfileReport] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.env = env
+        self.output = output
+        self.report = report  # streamed commands are recorded as its phases
+
+    def cmd(self, cmd, *args, **kwargs) -> Tuple[int, str, str]:
+        capture_output = kwargs.pop("capture_output", False) is True
+        cmds = self.generate_cmd_string(cmd, *args, **kwargs)
+        log.debug("command: %s", " ".join(cmds))
+        try:
+            if self.output is not None and not capture_output:
+                return self._stream_phase(cmd, cmds, self.output), "", ""
+            result = subprocess.run(cmds, capture_output=True, cwd=self.working_dir, env=self.env, check=False)
+        finally:
+            self.temp_var_files.clean_up()
+        return result.returncode, result.stdout.decode("utf-8"), result.stderr.decode("utf-8")
+
+    def _stream_phase(self, cmd: str, cmds, output: PrefixedOutput) -> int:
+        if self.report is None:
+            return self._stream(cmds, output)
+
+        with self.report.phase(cmd) as phase:
+            phase.exit_code = self._stream(cmds, output, phase.add_event)
+            # plan with -detailed-exitcode returns 2 when there are changes
+            phase.successful = phase.exit_code == 0 or (cmd == "plan" and phase.exit_code == 2)
+            return phase.exit_code
+
+    def _stream(self, cmds, output: PrefixedOutput, on_event: Optional[EventHandler] = None) -> int:
+        with subprocess.Popen(
+            cmds, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.working_dir, env=self.env
+        ) as process:
+            # both pipes must be drained concurrently, or Terraform blocks once the other pipe buffer fills up
+            stderr_reader = threading.Thread(target=output.pipe, args=(process.stderr, True, on_event), daemon=True)
+            stderr_reader.start()
+            output.pipe(process.stdout, False, on_event)  # type: ignore
+            stderr_reader.join()
+            return process.wait()
+
+
+def parse_event(line: str) -> Optional[TerraformEvent]:
+    """Return message of machine-readable UI output, None for any other line"""
+
+    if not line.startswith("{"):
+        return None
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    return event if isinstance(event, dict) and "@message" in event else None
+
+
+def format_event(event: TerraformEvent) -> str:
+    """Human-readable message, with details of errors and warnings"""
+
+    text = str(event["@message"])
+    detail = event.get("diagnostic", {}).get("detail")
+    return f"{text}: {detail}" if detail else text
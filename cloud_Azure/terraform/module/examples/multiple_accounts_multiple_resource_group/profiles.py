@@ -1,10 +1,24 @@
 import configparser
 import logging
+import os
+import sqlite3
+import sys
+from contextlib import closing
 from dataclasses import asdict, dataclass, field, fields
-from typing import Any, Dict, List, Tuple, Type, TypeVar
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type, TypeVar
 
 log = logging.getLogger(__name__)
 
+SQLITE_SUFFIXES: Tuple[str, ...] = (".db", ".sqlite", ".sqlite3")  # profile files stored in SQLite database
+SQLITE_TIMEOUT_SEC: float = 30.0  # how long to wait for other tools holding the database lock
+SQLITE_SCHEMA_VERSION: int = 2  # 2: tags column
+OPTIONAL_INI_FIELDS: Tuple[str, ...] = ("tags",)  # written to INI files only when set, so that other files don't change
+
+# compact, __dict__-less profile objects where supported (Python 3.10+); there may be tens of thousands of them
+DATACLASS_OPTIONS: Dict[str, Any] = {"slots": True} if sys.version_info >= (3, 10) else {}
+
 
 class ProfileConfigurationError(Exception):
     pass
@@ -20,8 +34,9 @@ class ProfilesIncompleteError(ProfileConfigurationError):
 
 AzureProfileType = TypeVar("AzureProfileType", bound="AzureProfile")
 
+
 # pylint: disable=too-many-instance-attributes
-@dataclass
+@dataclass(**DATACLASS_OPTIONS)
 class AzureProfile:
     name: str = ""
     subscription_id: str = ""
@@ -31,16 +46,119 @@ class AzureProfile:
     location: str = ""
     resource_group_names: List[str] = field(default_factory=list)
     storage_account_names: List[str] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)  # labels for selecting profiles, "name" or "name=value"
 
     @classmethod
     def from_dict(cls: Type[AzureProfileType], data: Dict[str, Any]) -> AzureProfileType:
         # split List[str] type fields which are expected to be CSV
-        for k in [f.name for f in fields(cls) if f.type == List[str] and f.name in data]:
-            data[k] = [name.strip() for name in data[k].split(",") if name]
+        for k in _csv_fields(cls):
+            if k in data:
+                data[k] = [name.strip() for name in data[k].split(",") if name]
 
         return cls(**data)
 
 
+@lru_cache(maxsize=None)
+def _csv_fields(cls: type) -> Tuple[str, ...]:
+    return tuple(f.name for f in fields(cls) if f.type == List[str])
+
+
+@dataclass
+class ProfileSelection:
+    """
+    Profiles matching any of the name globs, any of the locations, and all of the tags; empty criteria match all
+    Tag "name" matches profile tags "name" and "name=<any value>", tag "name=value" matches only the same profile tag
+    """
+
+    names: List[str] = field(default_factory=list)
+    locations: List[str] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
+
+    def matches_name(self, name: str) -> bool:
+        return not self.names or any(fnmatchcase(name, pattern) for pattern in self.names)
+
+    def matches(self, profile: AzureProfile) -> bool:
+        return (
+            self.matches_name(profile.name)
+            and (not self.locations or profile.location.lower() in (l.lower() for l in self.locations))
+            and all(self._has_tag(profile, tag) for tag in self.tags)
+        )
+
+    def missing_names(self, found: Iterable[str]) -> List[str]:
+        """Names given literally (not globs) that are not among found profile names"""
+
+        found_names = set(found)
+        return [n for n in self.names if not any(c in n for c in "*?[") and n not in found_names]
+
+    @staticmethod
+    def _has_tag(profile: AzureProfile, tag: str) -> bool:
+        return any(t == tag or ("=" not in tag and t.partition("=")[0] == tag) for t in profile.tags)
+
+
+class ProfileCollection:
+    """
+    Profiles in insertion order, indexed by name and by principal_id
+    A profile modified in place must be upserted again to keep the principal_id index up to date
+    """
+
+    def __init__(self, profiles: Iterable[AzureProfile] = ()) -> None:
+        self._by_name: Dict[str, AzureProfile] = {}
+        self._names_by_principal: Dict[str, Dict[str, None]] = {}  # ordered set of profile names by principal_id
+        # principal_id each profile is indexed under; profiles modified in place no longer tell the previous one
+        self._principal_by_name: Dict[str, str] = {}
+        self._changed: Dict[str, None] = {}  # set of names of profiles upserted since loading
+        for profile in profiles:
+            self.upsert(profile)
+        self._changed.clear()
+
+    def __iter__(self) -> Iterator[AzureProfile]:
+        return iter(list(self._by_name.values()))  # snapshot, so that upserts while iterating are safe
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._by_name
+
+    def get(self, name: str) -> Optional[AzureProfile]:
+        return self._by_name.get(name)
+
+    def upsert(self, profile: AzureProfile) -> None:
+        """Insert new profile, or overwrite the one with the same name keeping its position"""
+
+        indexed_principal = self._principal_by_name.get(profile.name)
+        self._by_name[profile.name] = profile
+        self._changed[profile.name] = None
+        if indexed_principal == profile.principal_id:
+            return
+
+        self._principal_by_name[profile.name] = profile.principal_id
+        if indexed_principal is None:
+            self._names_by_principal.setdefault(profile.principal_id, {})[profile.name] = None
+        else:
+            self._names_by_principal.get(indexed_principal, {}).pop(profile.name, None)
+            # keep the principal's profiles in collection order, so that find_secret picks the first one
+            self._names_by_principal[profile.principal_id] = {
+                p.name: None for p in self._by_name.values() if p.principal_id == profile.principal_id
+            }
+
+    def take_changed(self) -> List[AzureProfile]:
+        """Return profiles upserted since loading or since the last call, in collection order"""
+
+        changed = [p for p in self._by_name.values() if p.name in self._changed]
+        self._changed.clear()
+        return changed
+
+    def find_secret(self, principal_id: str) -> Optional[Tuple[str, str]]:
+        """Return (profile name, secret) of the first profile with the principal and non-empty secret"""
+
+        for name in self._names_by_principal.get(principal_id, {}):
+            profile = self._by_name[name]
+            if profile.principal_id == principal_id and profile.principal_secret != "":
+                return (name, profile.principal_secret)
+        return None
+
+
 def has_complete_authentication_data(p: AzureProfile) -> bool:
     return p.subscription_id != "" and p.tenant_id != "" and p.principal_id != "" and p.principal_secret != ""
 
@@ -55,7 +173,7 @@ def list_missing_required_fields(profile: AzureProfile) -> List[str]:
         "principal_id",
         "principal_secret",
         "location",
-        "resource_group_names"
+        "resource_group_names",
         # storage_account_names is optional - names can be auto generated
     ]
 
@@ -65,12 +183,14 @@ def list_missing_required_fields(profile: AzureProfile) -> List[str]:
     return list(filter(field_not_set, REQUIRED_AZURE_PROFILE_FIELDS))
 
 
-def save_profiles(file_path: str, profiles: List[AzureProfile]) -> bool:
+def save_profiles(file_path: str, profiles: Iterable[AzureProfile]) -> bool:
     config = configparser.ConfigParser()
     for profile in profiles:
         section = profile.name
         config.add_section(section)
         for k, v in asdict(profile).items():
+            if k in OPTIONAL_INI_FIELDS and not v:
+                continue
             if isinstance(v, list):
                 config[section][k] = ",".join(v)
             else:
@@ -87,19 +207,66 @@ def save_profiles(file_path: str, profiles: List[AzureProfile]) -> bool:
 
 def load_incomplete_profiles(file_path: str) -> List[AzureProfile]:
     """
-    Read profiles from file; the profiles are allowed to have missing fields
+    Read profiles from file of any backend; the profiles are allowed to have missing fields
     Return profile list on success
     Return empty list if file_path doesn't exist or file contains no profiles
     """
 
-    config = configparser.ConfigParser()
+    return profile_backend(file_path).load()
+
+
+def load_ini_profiles(file_path: str) -> List[AzureProfile]:
+    return [profile_from_section(name, data) for name, data in ini_sections(file_path)]
+
+
+def ini_sections(file_path: str) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """
+    Yield (name, fields) of INI file sections one by one, as the file is read, so that callers can start working
+    on early profiles before the whole file is parsed. Every section is parsed by ConfigParser on its own,
+    with the DEFAULT section (if any) prepended
+    Yield nothing if file_path doesn't exist
+    """
+
+    if not os.path.exists(file_path):
+        return
+
+    seen = set()
+    defaults: List[str] = []
+
+    def parse(lines: List[str]) -> Iterator[Tuple[str, Dict[str, str]]]:
+        config = configparser.ConfigParser()
+        try:
+            config.read_string("".join(defaults + lines), source=file_path)
+        except configparser.Error as err:
+            raise ProfilesInvalidError(f"Failed to load '{file_path}'") from err
+        for name in config.sections():
+            if name in seen:
+                raise ProfilesInvalidError(f"Failed to load '{file_path}': duplicate profile '{name}'")
+            seen.add(name)
+            yield name, dict(config[name])
+
     try:
-        # note: config.read silently ignores the fact that file_path doesn't exist, resulting in empty config dict and no error reported
-        config.read(file_path)
-    except configparser.Error as err:
+        with open(file_path, encoding="utf-8") as f:
+            lines: List[str] = []
+            for line in f:
+                match = configparser.ConfigParser.SECTCRE.match(line)
+                if match is not None:
+                    if lines and lines[0].strip() == "[DEFAULT]":
+                        defaults = lines
+                    else:
+                        yield from parse(lines)
+                    lines = []
+                lines.append(line)
+            yield from parse(lines)
+    except OSError as err:
         raise ProfilesInvalidError(f"Failed to load '{file_path}'") from err
 
-    return [AzureProfile.from_dict(dict(v)) for k, v in config.items() if k != "DEFAULT"]
+
+def profile_from_section(name: str, data: Dict[str, str]) -> AzureProfile:
+    try:
+        return AzureProfile.from_dict(data)
+    except TypeError as err:  # unexpected field
+        raise ProfilesInvalidError(f"Profile '{name}' is invalid: {err}") from err
 
 
 def load_complete_profiles(file_path: str) -> List[AzureProfile]:
@@ -117,6 +284,157 @@ def load_complete_profiles(file_path: str) -> List[AzureProfile]:
     return profiles
 
 
+def select_complete_profiles(
+    file_path: str, selection: ProfileSelection, on_invalid: Callable[[str, ProfileConfigurationError], None]
+) -> Iterator[AzureProfile]:
+    """
+    Yield selected profiles one by one as the file is read; the profiles must have all the required fields set and valid
+    Invalid selected profile is passed to on_invalid and skipped. Unreadable file is passed to on_invalid
+    with the file path as name, and ends the iteration
+    """
+
+    sections = profile_backend(file_path).sections()
+    while True:
+        try:
+            name, data = next(sections)
+        except StopIteration:
+            return
+        except ProfilesInvalidError as err:
+            on_invalid(file_path, err)
+            return
+
+        if not selection.matches_name(name):
+            continue  # profiles not selected by name are neither converted nor validated
+        try:
+            profile = profile_from_section(name, data)
+            if selection.matches(profile):
+                validate_profile_configuration(profile)
+                yield profile
+        except ProfileConfigurationError as err:
+            on_invalid(name, err)
+
+
+class ProfileBackend:
+    """Storage of profiles; use profile_backend() to get the one matching file name"""
+
+    incremental: bool = False  # True if upsert stores only the given profiles, without rewriting the rest
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+
+    def load(self) -> List[AzureProfile]:
+        """Return empty list if the file doesn't exist"""
+
+        return [profile_from_section(name, data) for name, data in self.sections()]
+
+    def sections(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        """Yield (name, fields) of stored profiles one by one as they are read; nothing if the file doesn't exist"""
+
+        raise NotImplementedError
+
+    def upsert(self, profiles: Iterable[AzureProfile]) -> bool:
+        """Insert new profiles, or overwrite the ones with the same name; keep all other profiles"""
+
+        raise NotImplementedError
+
+
+class IniProfileBackend(ProfileBackend):
+    """INI file, rewritten as a whole on every change"""
+
+    def sections(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        return ini_sections(self.file_path)
+
+    def upsert(self, profiles: Iterable[AzureProfile]) -> bool:
+        stored = ProfileCollection(self.load())  # re-read, so that profiles saved meanwhile by other tools survive
+        for profile in profiles:
+            stored.upsert(profile)
+        return save_profiles(self.file_path, stored)
+
+
+class SqliteProfileBackend(ProfileBackend):
+    """
+    SQLite database with a row per profile; every upsert is a single transaction, so an interrupted session keeps
+    all profiles stored so far, and concurrent tools wait for each other instead of overwriting each other's changes
+    """
+
+    incremental = True
+
+    def sections(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        if not os.path.exists(self.file_path):
+            return
+
+        columns = _profile_columns()
+        try:
+            with closing(self._connect()) as db:
+                for row in db.execute(f"SELECT {', '.join(columns)} FROM profiles ORDER BY rowid"):
+                    yield row[0], dict(zip(columns, row))
+        except sqlite3.Error as err:
+            raise ProfilesInvalidError(f"Failed to load '{self.file_path}'") from err
+
+    def upsert(self, profiles: Iterable[AzureProfile]) -> bool:
+        columns = _profile_columns()
+        update = f"UPDATE profiles SET {', '.join(f'{c} = ?' for c in columns[1:])} WHERE name = ?"
+        insert = f"INSERT INTO profiles ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        count = 0
+        try:
+            with closing(self._connect()) as db:
+                db.execute("BEGIN IMMEDIATE")  # take the write lock up front, other writers wait
+                try:
+                    for profile in profiles:
+                        values = _profile_values(profile)
+                        # UPDATE then INSERT rather than UPSERT clause, which requires SQLite 3.24+
+                        if db.execute(update, values[1:] + values[:1]).rowcount == 0:
+                            db.execute(insert, values)
+                        count += 1
+                    db.execute("COMMIT")
+                except BaseException:
+                    db.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error:
+            log.exception("Failed to save profiles to '%s'", self.file_path)
+            return False
+
+        log.info("Saved %d profiles to '%s'", count, self.file_path)
+        return True
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.file_path, timeout=SQLITE_TIMEOUT_SEC, isolation_level=None)
+        if db.execute("PRAGMA user_version").fetchone()[0] < SQLITE_SCHEMA_VERSION:
+            self._create_schema(db)
+        return db
+
+    @staticmethod
+    def _create_schema(db: sqlite3.Connection) -> None:
+        """Create the table, or add columns of profile fields added since the database was created"""
+
+        columns = [f"{c} TEXT NOT NULL DEFAULT ''" for c in _profile_columns()[1:]]
+        db.execute("BEGIN IMMEDIATE")
+        db.execute(f"CREATE TABLE IF NOT EXISTS profiles (name TEXT PRIMARY KEY, {', '.join(columns)})")
+        existing = {row[1] for row in db.execute("PRAGMA table_info(profiles)")}
+        for column in columns:
+            if column.split()[0] not in existing:
+                db.execute(f"ALTER TABLE profiles ADD COLUMN {column}")
+        db.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+        db.execute("COMMIT")
+        db.execute("PRAGMA journal_mode = WAL")  # readers don't block the writer; persistent setting of the file
+
+
+def profile_backend(file_path: str) -> ProfileBackend:
+    """SQLite backend for files with SQLITE_SUFFIXES, INI otherwise"""
+
+    if file_path.lower().endswith(SQLITE_SUFFIXES):
+        return SqliteProfileBackend(file_path)
+    return IniProfileBackend(file_path)
+
+
+def _profile_columns() -> List[str]:
+    return [f.name for f in fields(AzureProfile)]  # "name" goes first
+
+
+def _profile_values(profile: AzureProfile) -> List[str]:
+    return [",".join(v) if isinstance(v, list) else v for v in asdict(profile).values()]
+
+
 def validate_profile_configuration(profile: AzureProfile) -> None:
     raise_on_missing_fields(profile)
     raise_on_invalid_storage(profile)
@@ -2,23 +2,43 @@ import argparse
 import logging
 import math
 import os
-import shutil
 import sys
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from getpass import getpass
-from pathlib import Path
-from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
 
 from texttable import Texttable
 
-from azure_client import AzureClient, AzureClientError, LoginCredentials, ServicePrincipal
+from azure_client import AzureClient, AzureClientError, AzureLogin, LoginCredentials, ServicePrincipal
+from backups import DEFAULT_BACKUP_DIRECTORY, DEFAULT_KEEP_LAST, BackupError, BackupOptions, RetentionPolicy
+from discovery import (
+    DEFAULT_MANIFEST_FILE_NAME,
+    ManifestError,
+    discover_profiles,
+    discover_subscriptions,
+    load_manifest,
+)
+from inventory import (
+    DEFAULT_INVENTORY_FILE_NAME,
+    DEFAULT_MAX_AGE_HOURS,
+    Inventory,
+    SnapshotClient,
+    load_inventory,
+    save_inventory,
+    take_inventory,
+)
 from profiles import (
+    SQLITE_SUFFIXES,
     AzureProfile,
+    ProfileCollection,
     ProfileConfigurationError,
+    ProfilesInvalidError,
     has_complete_authentication_data,
     list_missing_required_fields,
     load_incomplete_profiles,
+    load_ini_profiles,
+    profile_backend,
     save_profiles,
     validate_profile_configuration,
 )
@@ -28,11 +48,15 @@ log = logging.getLogger(__name__)
 EX_OK: int = 0  # exit code for successful command
 EX_FAILED: int = 1  # exit code for failed command
 
-BACKUP_PROFILES_DIRECTORY = "backup_profiles"
+BACKUP_PROFILES_DIRECTORY = DEFAULT_BACKUP_DIRECTORY
 DEFAULT_PROFILES_FILE_NAME: str = "profiles.ini"
+DEFAULT_JOBS: int = 1  # profiles validated concurrently
 
 APP_REGISTRATION_NAME: str = "KentikTerraformOnboarder"  # AppRegistration to be created
 
+Client = Union[AzureClient, SnapshotClient]
+Login = Union[Type[AzureClient], AzureLogin, Inventory]  # provides clients: live AzureClient, or SnapshotClient
+
 
 class Action(str, Enum):
     """Action for the tool to perform"""
@@ -40,9 +64,16 @@ class Action(str, Enum):
     ADD = "add"
     COMPLETE = "complete"
     VALIDATE = "validate"
+    INVENTORY = "inventory"
+    DISCOVER = "discover"
+    IMPORT = "import"
+    EXPORT = "export"
+    RESTORE = "restore"
 
 
-def add_new_profiles(file_path: str, names: Iterable[str]) -> bool:
+def add_new_profiles(
+    file_path: str, names: Iterable[str], azure: Login = AzureClient, backups: BackupOptions = BackupOptions()
+) -> bool:
     """
     Add new profiles for all provided names, in interactive manner
     User can break the process at any point by sending keyboard interrupt
@@ -53,21 +84,21 @@ def add_new_profiles(file_path: str, names: Iterable[str]) -> bool:
         return False
 
     cli_tell("[CTRL + D or CTRL + C] to finish")
+    incremental = profile_backend(file_path).incremental
     all_successful = True
     # jscpd:ignore-start
     try:
         for name in names:
-            successful = add_profile(name, profiles)
+            successful = add_profile(name, profiles, azure)
             all_successful = all_successful and successful
+            if incremental and not store_profiles(file_path, profiles, backups):
+                return False
             cli_tell()
     except (EOFError, KeyboardInterrupt):
         log.info("Operation interrupted")
         cli_tell()
 
-    if not backup_file(file_path):
-        log.warning("Failed to create profiles backup")
-
-    if not save_profiles(file_path, profiles):
+    if not store_profiles(file_path, profiles, backups):
         return False
     # jscpd:ignore-end
 
@@ -75,7 +106,7 @@ def add_new_profiles(file_path: str, names: Iterable[str]) -> bool:
     return all_successful
 
 
-def add_profile(profile_name: str, profiles: List[AzureProfile]) -> bool:
+def add_profile(profile_name: str, profiles: ProfileCollection, azure: Login = AzureClient) -> bool:
     """
     Create new profile and add it to the list
     All interactions with user happen here and in cli_* functions
@@ -84,12 +115,12 @@ def add_profile(profile_name: str, profiles: List[AzureProfile]) -> bool:
     cli_tell(f"Profile name: {profile_name}")
 
     # handle possible profile name collision
-    if profile_exists(profile_name, profiles) and cli_ask_overwrite_profile(profile_name) is False:
+    if profile_name in profiles and cli_ask_overwrite_profile(profile_name) is False:
         return True  # it's ok to change mind
 
     try:
         # login to Azure account
-        client = AzureClient.login_user(cli_ask_tenant_id(), cli_ask_subscription_id())
+        client = azure.login_user(cli_ask_tenant_id(), cli_ask_subscription_id())
 
         # find existing or create new Service Principal
         principal = cli_get_or_create_service_principal(client, profiles)
@@ -111,7 +142,7 @@ def add_profile(profile_name: str, profiles: List[AzureProfile]) -> bool:
             resource_group_names=resource_group_names,
             storage_account_names=[],
         )
-        insert_or_overwrite_profile(profiles, profile)
+        profiles.upsert(profile)
 
         cli_tell(f"Profile '{profile_name}' ready")
         return True
@@ -120,7 +151,9 @@ def add_profile(profile_name: str, profiles: List[AzureProfile]) -> bool:
         return False
 
 
-def complete_existing_profiles(file_path: str) -> bool:
+def complete_existing_profiles(
+    file_path: str, azure: Login = AzureClient, backups: BackupOptions = BackupOptions()
+) -> bool:
     """
     Complete missing information in profiles loaded from provided file_path
     User can break the process at any point by sending keyboard interrupt
@@ -136,20 +169,20 @@ def complete_existing_profiles(file_path: str) -> bool:
 
     # jscpd:ignore-start
     cli_tell("[CTRL + D or CTRL + C] to finish")
+    incremental = profile_backend(file_path).incremental
     all_successful = True
     try:
         for profile in profiles:
-            successful = complete_profile(profile, profiles)
+            successful = complete_profile(profile, profiles, azure)
             all_successful = all_successful and successful
+            if incremental and not store_profiles(file_path, profiles, backups):
+                return False
             cli_tell()
     except (EOFError, KeyboardInterrupt):
         log.info("Operation interrupted")
         cli_tell()
 
-    if not backup_file(file_path):
-        log.warning("Failed to create profiles backup")
-
-    if not save_profiles(file_path, profiles):
+    if not store_profiles(file_path, profiles, backups):
         return False
     # jscpd:ignore-stop
 
@@ -157,7 +190,7 @@ def complete_existing_profiles(file_path: str) -> bool:
     return all_successful
 
 
-def complete_profile(profile: AzureProfile, profiles: List[AzureProfile]) -> bool:
+def complete_profile(profile: AzureProfile, profiles: ProfileCollection, azure: Login = AzureClient) -> bool:
     """
     Complete the profile if any information is missing
     All interactions with user happen here and in cli_* functions
@@ -177,6 +210,7 @@ def complete_profile(profile: AzureProfile, profiles: List[AzureProfile]) -> boo
     # avoid logging into Azure if only principal_secret is missing - it can't be retrieved from the account anyway
     if missing_fields == ["principal_secret"]:
         profile.principal_secret = find_secret(profile.principal_id, profiles) or cli_ask_secret()
+        profiles.upsert(profile)
         cli_tell(f"Profile '{profile.name}' information completed: {missing_fields_str}")
         return True
 
@@ -185,11 +219,11 @@ def complete_profile(profile: AzureProfile, profiles: List[AzureProfile]) -> boo
         # login to Azure account
         if has_complete_authentication_data(profile):
             cred = profile_to_credentials(profile)
-            client = AzureClient.login_application(cred)
+            client = azure.login_application(cred)
         else:
             tenant_id = profile.tenant_id or cli_ask_tenant_id()
             subscription_id = profile.subscription_id or cli_ask_subscription_id()
-            client = AzureClient.login_user(tenant_id, subscription_id)
+            client = azure.login_user(tenant_id, subscription_id)
 
         profile.tenant_id = client.tenant_id
         profile.subscription_id = client.subscription_id
@@ -214,6 +248,7 @@ def complete_profile(profile: AzureProfile, profiles: List[AzureProfile]) -> boo
         if not profile.resource_group_names:
             profile.resource_group_names = cli_ask_resource_groups(client, profile.location)
 
+        profiles.upsert(profile)  # principal may have changed
         cli_tell(f"Profile '{profile.name}' information completed: {missing_fields_str}")
         return True
     except AzureClientError:
@@ -221,18 +256,22 @@ def complete_profile(profile: AzureProfile, profiles: List[AzureProfile]) -> boo
         return False
 
 
-def validate_profiles(file_path: str) -> bool:
+def validate_profiles(file_path: str, jobs: int = DEFAULT_JOBS, azure: Login = AzureClient) -> bool:
     """
-    Validate profiles by checking information against Azure API
+    Validate profiles by checking information against Azure API, up to "jobs" profiles concurrently
+    Output of every profile is buffered and printed in profile order, as soon as the profile and all preceding ones
+    are validated. Profiles sharing subscription and principal share AzureClient, thus login and listings
     """
 
     cli_tell(f"Validating '{file_path}'")
     profiles = try_load_profiles(file_path, load_incomplete_profiles)
     all_valid = True
-    for profile in profiles:
-        valid = validate_profile(profile)
-        all_valid = all_valid and valid
-        cli_tell()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for valid, output in executor.map(lambda p: validate_profile_buffered(p, azure), profiles):
+            for line in output:
+                cli_tell(line)
+            all_valid = all_valid and valid
+            cli_tell()
 
     status = "All profiles are valid" if all_valid else "Invalid profiles found"
     cli_tell(f"Finished validating profiles. {status}")
@@ -240,43 +279,213 @@ def validate_profiles(file_path: str) -> bool:
     return all_valid
 
 
-def validate_profile(profile: AzureProfile) -> bool:
+def validate_profile_buffered(profile: AzureProfile, azure: Login = AzureClient) -> Tuple[bool, List[str]]:
+    output: List[str] = []
+    return validate_profile(profile, output.append, azure), output
+
+
+def validate_profile(
+    profile: AzureProfile, tell: Optional[Callable[[str], None]] = None, azure: Login = AzureClient
+) -> bool:
     """
     Check the information in profile against Azure
+    Messages for the user are passed to "tell", cli_tell by default
     """
 
+    tell = tell or cli_tell
     is_valid = True
-    cli_tell(f"Profile name: {profile.name}")
+    tell(f"Profile name: {profile.name}")
 
     try:
         # check invariants
         validate_profile_configuration(profile)
 
-        # check if provided credentials allow to login to Azure
+        # check if provided credentials allow to login to Azure; listing locations below verifies them anyway
         cred = profile_to_credentials(profile)
-        client = AzureClient.login_application(cred)
+        client = azure.login_application(cred, verify_credentials=False)
 
         # check if location is valid
         available_locations = client.list_locations()
         if profile.location not in available_locations:
-            cli_tell(f"The location is invalid in Azure: '{profile.location}'")
+            tell(f"The location is invalid in Azure: '{profile.location}'")
             is_valid = False
         else:
             # check if resource groups exist in location
             invalid_groups = list_invalid_resource_groups(client, profile)
             if invalid_groups:
                 invalid_groups_str = ", ".join(invalid_groups)
-                cli_tell(f"Resource Groups do not exist in Location '{profile.location}': '{invalid_groups_str}'")
+                tell(f"Resource Groups do not exist in Location '{profile.location}': '{invalid_groups_str}'")
                 is_valid = False
 
     except (ProfileConfigurationError, AzureClientError) as err:
-        cli_tell("Validation failed: " + str(err))
+        tell("Validation failed: " + str(err))
         is_valid = False
 
-    cli_tell("Profile is valid" if is_valid else "Profile is invalid")
+    tell("Profile is valid" if is_valid else "Profile is invalid")
     return is_valid
 
 
+def discover_new_profiles(
+    file_path: str,
+    manifest_path: str,
+    jobs: int = DEFAULT_JOBS,
+    azure: AzureLogin = AzureLogin(),
+    backups: BackupOptions = BackupOptions(),
+) -> bool:
+    """
+    Generate profiles for all resource groups selected by the manifest rules, without asking user for anything
+    but interactive login to every tenant. All the profiles are saved at once
+    """
+
+    profiles = try_load_profiles(file_path, load_incomplete_profiles)
+    if profiles is None:
+        return False
+
+    try:
+        rules = load_manifest(manifest_path)
+    except ManifestError:
+        log.exception("Failed to discover profiles")
+        return False
+
+    all_successful = True
+    principals: Dict[str, Tuple[ServicePrincipal, str]] = {}  # one app registration per tenant, for all its rules
+    incremental = profile_backend(file_path).incremental
+    for rule in rules:
+        cli_tell(f"Discovering '{rule.name}' in tenant '{rule.tenant_id}'")
+        try:
+            client = azure.login_user(rule.tenant_id)
+            subscription_ids = discover_subscriptions(client, rule)
+            if rule.tenant_id not in principals:
+                principals[rule.tenant_id] = get_or_create_service_principal(client, profiles)
+            principal, principal_object_id = principals[rule.tenant_id]
+            discovered, successful = discover_profiles(
+                rule, subscription_ids, principal, principal_object_id, jobs, azure
+            )
+        except AzureClientError:
+            log.exception("Failed to discover '%s'", rule.name)
+            all_successful = False
+            continue
+
+        for profile in discovered:
+            profiles.upsert(profile)
+        all_successful = all_successful and successful
+        cli_tell(f"Discovered {len(discovered)} profiles in {len(subscription_ids)} subscriptions")
+        if incremental and not store_profiles(file_path, profiles, backups):
+            return False
+
+    if not store_profiles(file_path, profiles, backups):
+        return False
+
+    cli_tell("Finished discovering profiles")
+    return all_successful
+
+
+def get_or_create_service_principal(client: AzureClient, profiles: ProfileCollection) -> Tuple[ServicePrincipal, str]:
+    """
+    Non-interactive counterpart of cli_get_or_create_service_principal
+    If the secret of existing AppRegistration is not found in profiles, new secret is added to its ServicePrincipal
+    Return the principal and its object ID
+    """
+
+    app_ids = client.find_app_registrations(APP_REGISTRATION_NAME)
+    if len(app_ids) > 1:
+        raise AzureClientError(
+            f"There are {len(app_ids)} AppRegistrations named '{APP_REGISTRATION_NAME}'. 1 is allowed"
+        )
+
+    if app_ids:
+        app_id = app_ids[0]
+        log.debug("Found AppRegistration ID '%s' for '%s'", app_id, APP_REGISTRATION_NAME)
+        object_id = client.find_service_principal_id(app_id)
+        secret = find_secret(app_id, profiles) or client.add_service_principal_secret(object_id)
+        return ServicePrincipal(app_id=app_id, secret=secret), object_id
+
+    app = client.create_app_registration(APP_REGISTRATION_NAME)
+    return app.principal, app.principal_obj_id
+
+
+def take_profiles_inventory(
+    file_path: str, snapshot_path: str, jobs: int = DEFAULT_JOBS, azure: AzureLogin = AzureLogin()
+) -> bool:
+    """
+    Inventory Azure subscriptions accessible with credentials of the profiles, and save the snapshot,
+    so that complete and validate can run against the snapshot, without network calls
+    """
+
+    profiles = try_load_profiles(file_path, load_incomplete_profiles)
+    credentials = [profile_to_credentials(p) for p in profiles if has_complete_authentication_data(p)]
+    if not credentials:
+        cli_tell(f"No profiles with complete authentication data in '{file_path}'")
+        return False
+
+    cli_tell(f"Taking inventory for {len(credentials)} profiles")
+    inventory, successful = take_inventory(credentials, [APP_REGISTRATION_NAME], jobs, azure)
+    if not save_inventory(snapshot_path, inventory):
+        return False
+
+    status = "" if successful else " Inventory is incomplete, see log for details"
+    cli_tell(f"Saved inventory of {len(inventory.subscriptions)} subscriptions to '{snapshot_path}'.{status}")
+    return successful
+
+
+def import_profiles(file_path: str, ini_path: str, backups: BackupOptions = BackupOptions()) -> bool:
+    """Insert or overwrite all profiles of INI file into the profiles file, eg. SQLite database"""
+
+    try:
+        profiles = load_ini_profiles(ini_path)
+    except ProfilesInvalidError:
+        log.exception("Failed to import profiles")
+        return False
+
+    if not profiles:
+        cli_tell(f"No profiles were loaded from '{ini_path}'")
+        return True
+
+    if not store_profiles(file_path, ProfileCollection(profiles), backups, all_profiles=True):
+        return False
+
+    cli_tell(f"Imported {len(profiles)} profiles from '{ini_path}' to '{file_path}'")
+    return True
+
+
+def export_profiles(file_path: str, ini_path: str, backups: BackupOptions = BackupOptions()) -> bool:
+    """Write all profiles of the profiles file, eg. SQLite database, to INI file, replacing its content"""
+
+    try:
+        profiles = load_incomplete_profiles(file_path)
+    except ProfilesInvalidError:
+        log.exception("Failed to export profiles")
+        return False
+
+    if not backup_file(ini_path, backups):
+        log.warning("Failed to create profiles backup")
+
+    if not save_profiles(ini_path, profiles):
+        return False
+
+    cli_tell(f"Exported {len(profiles)} profiles from '{file_path}' to '{ini_path}'")
+    return True
+
+
+def store_profiles(
+    file_path: str, profiles: ProfileCollection, backups: BackupOptions = BackupOptions(), all_profiles: bool = False
+) -> bool:
+    """
+    Store profiles changed since loading or the last store, or all of them; other profiles in the file are kept
+    Files that get rewritten as a whole are backed up first
+    """
+
+    changed = list(profiles) if all_profiles else profiles.take_changed()
+    if not changed:
+        return True
+
+    backend = profile_backend(file_path)
+    if not backend.incremental and not backup_file(file_path, backups):
+        log.warning("Failed to create profiles backup")
+
+    return backend.upsert(changed)
+
+
 def profile_to_credentials(profile: AzureProfile) -> LoginCredentials:
     return LoginCredentials(
         tenant_id=profile.tenant_id,
@@ -285,16 +494,13 @@ def profile_to_credentials(profile: AzureProfile) -> LoginCredentials:
     )
 
 
-def list_invalid_resource_groups(client: AzureClient, p: AzureProfile) -> List[str]:
+def list_invalid_resource_groups(client: Client, p: AzureProfile) -> List[str]:
     if not p.resource_group_names:
         return []
-    available_resource_groups = client.list_resource_groups(p.location)
-    return list(set(p.resource_group_names) - set(available_resource_groups))
+    return client.find_missing_resource_groups(p.location, p.resource_group_names)
 
 
-def cli_get_or_create_service_principal(
-    client: AzureClient, profiles: List[AzureProfile]
-) -> Optional[ServicePrincipal]:
+def cli_get_or_create_service_principal(client: Client, profiles: ProfileCollection) -> Optional[ServicePrincipal]:
 
     # try get existing AppRegistration
     app_ids = client.find_app_registrations(APP_REGISTRATION_NAME)
@@ -342,7 +548,7 @@ def cli_ask_overwrite_profile(profile_name: str) -> bool:
     return answer.lower() == "y"
 
 
-def cli_ask_azure_location(client: AzureClient) -> str:
+def cli_ask_azure_location(client: Client) -> str:
     NUM_COLUMNS_FOR_LOCATIONS_PRINTOUT = 3
     locations = client.list_locations()
     num_locations = len(locations)
@@ -389,7 +595,7 @@ def cli_ask_secret() -> str:
     return getpass("Enter Service Principal secret [empty to skip]: ")
 
 
-def cli_ask_resource_groups(client: AzureClient, location: str) -> List[str]:
+def cli_ask_resource_groups(client: Client, location: str) -> List[str]:
     NUM_COLUMNS = 3
     groups = client.list_resource_groups(location)
     num_groups = len(groups)
@@ -414,66 +620,60 @@ def cli_tell(msg: str = "") -> None:
     print(msg)
 
 
-def try_load_profiles(file_path: str, loader: Callable) -> List[AzureProfile]:
+def try_load_profiles(file_path: str, loader: Callable) -> ProfileCollection:
     """
-    Return profile list on success
-    Return empty list if file_path doesn't exist or file contains no profiles
+    Return profile collection on success
+    Return empty collection if file_path doesn't exist or file contains no profiles
     """
 
     if not os.path.exists(file_path):
         log.debug("File '%s' doesn't exist. Returning empty profile list", file_path)
-        return []
-
-    return loader(file_path)
-
+        return ProfileCollection()
 
-def profile_exists(profile_name: str, profiles: List[AzureProfile]) -> bool:
-    return find_profile(profile_name, profiles) is not None
+    return ProfileCollection(loader(file_path))
 
 
-def find_profile(profile_name: str, profiles: List[AzureProfile]) -> Optional[int]:
-    for i, profile in enumerate(profiles):
-        if profile.name == profile_name:
-            return i
-    return None
-
+def find_secret(app_id: str, profiles: ProfileCollection) -> Optional[str]:
+    found = profiles.find_secret(app_id)
+    if found is None:
+        log.warning("Secret for AppRegistration ID '%s' not found", app_id)
+        return None
 
-def find_secret(app_id: str, profiles: List[AzureProfile]) -> Optional[str]:
-    for profile in profiles:
-        if profile.principal_id == app_id and profile.principal_secret != "":
-            log.info("Secret for AppRegistration ID '%s' found in profile '%s'", app_id, profile.name)
-            return profile.principal_secret
-    log.warning("Secret for AppRegistration ID '%s' not found", app_id)
-    return None
+    profile_name, secret = found
+    log.info("Secret for AppRegistration ID '%s' found in profile '%s'", app_id, profile_name)
+    return secret
 
 
-def insert_or_overwrite_profile(profiles: List[AzureProfile], profile: AzureProfile) -> None:
-    index = find_profile(profile.name, profiles)
-    if index is not None:
-        profiles[index] = profile
-    else:
-        profiles.append(profile)
+def backup_file(file_path: str, backups: BackupOptions = BackupOptions()) -> bool:
+    """Back up the file into the backup store, unless its content is unchanged since the last backup"""
 
+    try:
+        backups.open().backup(file_path)
+    except BackupError:
+        log.exception("Failed to create backup of '%s'", file_path)
+        return False
+    return True
 
-def backup_file(file_path: str) -> bool:
-    """Create file backup with time stamp suffix in the name"""
 
-    if not os.path.exists(file_path):
-        log.info("Source file '%s' doesn't exist. Skipping backup", file_path)
-        return True  # nothing to backup -> OK
+def restore_profiles(file_path: str, backup_id: str, backups: BackupOptions = BackupOptions()) -> bool:
+    """List backups of the file if backup_id is empty, otherwise restore the backup identified by (prefix of) its hash"""
 
-    backup_time = datetime.today().strftime("%Y-%m-%d_%H%M%S")
-    backup_name = f"{file_path}.{backup_time}"
-    backup_dir = Path(BACKUP_PROFILES_DIRECTORY)
-    backup_path = backup_dir.joinpath(backup_name)
     try:
-        backup_dir.mkdir(exist_ok=True)
-        shutil.copyfile(file_path, backup_path)
-    except OSError:
-        log.exception("Failed to create backup '%s' of '%s'", backup_path, file_path)
+        store = backups.open()
+        if not backup_id:
+            entries = store.entries(file_path)
+            cli_tell(f"{len(entries)} backups of '{file_path}', oldest first:")
+            for entry in entries:
+                cli_tell(f"{entry.sha256[:12]}  {entry.created}  {entry.size} bytes")
+            return True
+
+        entry = store.find(backup_id)
+        store.restore(entry, file_path)
+    except BackupError:
+        log.exception("Failed to restore '%s'", file_path)
         return False
 
-    log.info("Created backup '%s' of '%s", backup_path, file_path)
+    cli_tell(f"Restored '{file_path}' from backup {entry.sha256[:12]} of '{entry.file}' created {entry.created}")
     return True
 
 
@@ -519,14 +719,85 @@ def format_item(item_no: int, max_no: int, item: Any) -> str:
     return f"{justified_item_no} {item}"
 
 
-def parse_cmd_line() -> Tuple[str, bool, Action, List[str]]:
+def parse_cmd_line() -> Tuple[Action, argparse.Namespace]:
     parser = argparse.ArgumentParser()
-    parser.add_argument("--filename", default=DEFAULT_PROFILES_FILE_NAME, help="Profiles file name")
+    parser.add_argument(
+        "--filename",
+        default=DEFAULT_PROFILES_FILE_NAME,
+        help=f"Profiles file name; SQLite database if it ends with {', '.join(SQLITE_SUFFIXES)}",
+    )
+    parser.add_argument(
+        "--ini",
+        default=DEFAULT_PROFILES_FILE_NAME,
+        help=f"INI file to import profiles from, or export them to (default: {DEFAULT_PROFILES_FILE_NAME})",
+    )
     parser.add_argument("--profiles", nargs="+", default=[], help="Names of profiles to create")
     parser.add_argument("--verbose", default=False, action="store_true", help="Enable verbose logging")
-    parser.add_argument("action", choices=[Action.ADD.value, Action.COMPLETE.value, Action.VALIDATE.value])
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help="Number of profiles to validate, or of Azure API clients for inventory and discover (default: 1)",
+    )
+    parser.add_argument(
+        "--snapshot",
+        default=DEFAULT_INVENTORY_FILE_NAME,
+        help=f"Inventory snapshot file name (default: {DEFAULT_INVENTORY_FILE_NAME})",
+    )
+    parser.add_argument(
+        "--from-snapshot",
+        default=False,
+        action="store_true",
+        help="Complete or validate profiles using inventory snapshot instead of Azure API",
+    )
+    parser.add_argument(
+        "--max-snapshot-age",
+        type=float,
+        default=DEFAULT_MAX_AGE_HOURS,
+        help=f"Hours after which inventory snapshot is considered stale (default: {DEFAULT_MAX_AGE_HOURS:g})",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=DEFAULT_MANIFEST_FILE_NAME,
+        help=f"Discovery manifest file name (default: {DEFAULT_MANIFEST_FILE_NAME})",
+    )
+    parser.add_argument(
+        "--resource-graph",
+        default=False,
+        action="store_true",
+        help="List resource groups and resources with Azure Resource Graph queries instead of ARM list calls",
+    )
+    parser.add_argument(
+        "--backup-deltas",
+        default=False,
+        action="store_true",
+        help="Store profiles file backups as deltas against the previous backup, if smaller",
+    )
+    parser.add_argument(
+        "--backup-keep",
+        type=int,
+        default=DEFAULT_KEEP_LAST,
+        help=f"Number of backups kept per profiles file, 0 for unlimited (default: {DEFAULT_KEEP_LAST})",
+    )
+    parser.add_argument(
+        "--backup-max-age",
+        type=float,
+        default=0.0,
+        help="Days after which backups are removed; the newest backup is always kept (default: unlimited)",
+    )
+    parser.add_argument("--backup", default="", help="Hash (prefix) of the backup to restore; list backups if omitted")
+    parser.add_argument("action", choices=[a.value for a in Action])
     args = parser.parse_args()
-    return (args.filename, args.verbose, Action(args.action), args.profiles)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.backup_keep < 0 or args.backup_max_age < 0:
+        parser.error("--backup-keep and --backup-max-age can't be negative")
+    if args.from_snapshot and args.action not in (Action.COMPLETE.value, Action.VALIDATE.value):
+        parser.error("--from-snapshot is supported only by complete and validate")
+    same_file = os.path.realpath(args.ini) == os.path.realpath(args.filename)
+    if same_file and args.action in (Action.IMPORT.value, Action.EXPORT.value):
+        parser.error("--ini must be other file than --filename for import and export")
+    return (Action(args.action), args)
 
 
 def setup_logging(verbose: bool) -> None:
@@ -540,14 +811,43 @@ def profile_name_source() -> Iterator[str]:
 
 
 if __name__ == "__main__":
-    profiles_file_name, verbose_logging, action, profile_names = parse_cmd_line()
-    setup_logging(verbose_logging)
-    if action == Action.ADD:
-        execution_successful = add_new_profiles(profiles_file_name, profile_names or profile_name_source())
+    action, cmd_line_args = parse_cmd_line()
+    setup_logging(cmd_line_args.verbose)
+    backup_options = BackupOptions(
+        BACKUP_PROFILES_DIRECTORY,
+        cmd_line_args.backup_deltas,
+        RetentionPolicy(cmd_line_args.backup_keep, cmd_line_args.backup_max_age),
+    )
+    azure_client_login = AzureLogin(use_resource_graph=cmd_line_args.resource_graph)
+    azure_login: Optional[Login] = azure_client_login
+    if cmd_line_args.from_snapshot:
+        azure_login = load_inventory(cmd_line_args.snapshot, cmd_line_args.max_snapshot_age)
+
+    profiles_file_name = cmd_line_args.filename
+    if azure_login is None:
+        execution_successful = False
+    elif action == Action.ADD:
+        execution_successful = add_new_profiles(
+            profiles_file_name, cmd_line_args.profiles or profile_name_source(), azure_login, backup_options
+        )
     elif action == Action.COMPLETE:
-        execution_successful = complete_existing_profiles(profiles_file_name)
+        execution_successful = complete_existing_profiles(profiles_file_name, azure_login, backup_options)
     elif action == Action.VALIDATE:
-        execution_successful = validate_profiles(profiles_file_name)
+        execution_successful = validate_profiles(profiles_file_name, cmd_line_args.jobs, azure_login)
+    elif action == Action.DISCOVER:
+        execution_successful = discover_new_profiles(
+            profiles_file_name, cmd_line_args.manifest, cmd_line_args.jobs, azure_client_login, backup_options
+        )
+    elif action == Action.INVENTORY:
+        execution_successful = take_profiles_inventory(
+            profiles_file_name, cmd_line_args.snapshot, cmd_line_args.jobs, azure_client_login
+        )
+    elif action == Action.IMPORT:
+        execution_successful = import_profiles(profiles_file_name, cmd_line_args.ini, backup_options)
+    elif action == Action.EXPORT:
+        execution_successful = export_profiles(profiles_file_name, cmd_line_args.ini, backup_options)
+    elif action == Action.RESTORE:
+        execution_successful = restore_profiles(profiles_file_name, cmd_line_args.backup, backup_options)
     else:
         log.fatal("Unknown action: %s", action)
         execution_successful = False
@@ -0,0 +1,105 @@
+import logging
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from azure.core.credentials import TokenCredential
+
+from azure_client import ARM_ENDPOINT, ARM_SCOPE, wrap_sdk_api_exceptions
+
+log = logging.getLogger(__name__)
+
+# endpoint can be overridden, eg. to point at a local fake Resource Graph server
+RESOURCE_GRAPH_ENDPOINT: str = os.environ.get("AZURE_RESOURCE_GRAPH_ENDPOINT", ARM_ENDPOINT)
+RESOURCE_GRAPH_API_VERSION: str = "2021-03-01"
+MAX_SUBSCRIPTIONS_PER_QUERY: int = 1000  # Resource Graph limit
+PAGE_SIZE: int = 1000  # Resource Graph limit
+REQUEST_TIMEOUT_SEC: float = 60.0
+
+RESOURCE_GROUPS_QUERY = (
+    "resourcecontainers"
+    " | where type =~ 'microsoft.resources/subscriptions/resourcegroups'{where}"
+    " | project subscriptionId, name, location"
+)
+RESOURCES_QUERY = "resources | where type =~ '{type}'{where} | project subscriptionId, resourceGroup, name"
+
+ResourceGroups = Dict[str, List[Tuple[str, str]]]  # (name, location) by SubscriptionID
+ResourcesByResourceGroup = Dict[str, Dict[str, List[str]]]  # names by resource group (lower case) by SubscriptionID
+
+
+class ResourceGraphClient:
+    """
+    Azure Resource Graph answers inventory questions for many subscriptions with a single paged query,
+    instead of ARM list calls for every subscription and resource group
+    """
+
+    def __init__(self, credential: TokenCredential, endpoint: Optional[str] = None) -> None:
+        self._credential = credential
+        self._url = (
+            f"{endpoint or RESOURCE_GRAPH_ENDPOINT}/providers/Microsoft.ResourceGraph/resources"
+            f"?api-version={RESOURCE_GRAPH_API_VERSION}"
+        )
+        self._session = requests.Session()
+
+    def resource_groups(
+        self, subscription_ids: List[str], tag_name: str = "", tag_value: Optional[str] = None
+    ) -> ResourceGroups:
+        """Optionally, only resource groups having the tag (with the value, if given)"""
+
+        where = ""
+        if tag_name:
+            tag = f"tags['{kql_escape(tag_name)}']"
+            where = f" and isnotnull({tag})" if tag_value is None else f" and {tag} == '{kql_escape(tag_value)}'"
+        result: ResourceGroups = {s: [] for s in subscription_ids}
+        for row in self.query(RESOURCE_GROUPS_QUERY.format(where=where), subscription_ids):
+            result.setdefault(row["subscriptionId"], []).append((row["name"], row["location"]))
+        return result
+
+    def resources_by_resource_group(
+        self, resource_type: str, subscription_ids: List[str], resource_group: str = ""
+    ) -> ResourcesByResourceGroup:
+        """Names of resources of given type, optionally only in given resource group, sorted"""
+
+        where = f" and resourceGroup =~ '{kql_escape(resource_group)}'" if resource_group else ""
+        query = RESOURCES_QUERY.format(type=kql_escape(resource_type), where=where)
+        result: ResourcesByResourceGroup = {s: {} for s in subscription_ids}
+        for row in self.query(query, subscription_ids):
+            by_group = result.setdefault(row["subscriptionId"], {})
+            by_group.setdefault(row["resourceGroup"].lower(), []).append(row["name"])
+        for by_group in result.values():
+            for names in by_group.values():
+                names.sort()
+        return result
+
+    def query(self, query: str, subscription_ids: List[str]) -> Iterator[Dict[str, Any]]:
+        """Yield result rows of the query over all pages, for any number of subscriptions"""
+
+        for i in range(0, len(subscription_ids), MAX_SUBSCRIPTIONS_PER_QUERY):
+            subscriptions = subscription_ids[i : i + MAX_SUBSCRIPTIONS_PER_QUERY]
+            skip_token: Optional[str] = None
+            while True:
+                page = self._page(query, subscriptions, skip_token)
+                yield from page["data"]
+                skip_token = page.get("$skipToken")
+                if not skip_token:
+                    break
+
+    @wrap_sdk_api_exceptions("Failed to query Azure Resource Graph")
+    def _page(self, query: str, subscription_ids: List[str], skip_token: Optional[str]) -> Dict[str, Any]:
+        options: Dict[str, Any] = {"resultFormat": "objectArray", "$top": PAGE_SIZE}
+        if skip_token:
+            options["$skipToken"] = skip_token
+        body = {"subscriptions": subscription_ids, "query": query, "options": options}
+        token = self._credential.get_token(ARM_SCOPE).token
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        result = self._session.post(self._url, json=body, headers=headers, timeout=REQUEST_TIMEOUT_SEC)
+        result.raise_for_status()
+        page = result.json()
+        log.debug("Resource Graph returned %d of %s records", page.get("count", 0), page.get("totalRecords", "?"))
+        return page
+
+
+def kql_escape(value: str) -> str:
+    """Escape value for use in single-quoted KQL string literal"""
+
+    return value.replace("\\", "\\\\").replace("'", "\\'")
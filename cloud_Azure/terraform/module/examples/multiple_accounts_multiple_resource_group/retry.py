@@ -0,0 +1,115 @@
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional, TypeVar
+
+log = logging.getLogger(__name__)
+
+TRANSIENT_HTTP_STATUSES = frozenset([408, 429, 500, 502, 503, 504])  # worth retrying: throttling, server trouble
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay_sec: float = 1.0  # backoff before 2nd attempt; doubled for every next attempt
+    max_delay_sec: float = 30.0  # backoff cap
+    deadline_sec: float = 120.0  # time budget for the whole operation, including all attempts
+
+
+@dataclass(frozen=True)
+class ErrorClass:
+    """Result of error classification: should the operation be retried, and after how long if the server says so"""
+
+    transient: bool
+    retry_after_sec: Optional[float] = None
+
+
+PERMANENT = ErrorClass(transient=False)
+TRANSIENT = ErrorClass(transient=True)
+
+ErrorClassifier = Callable[[Exception], ErrorClass]
+RetryHandler = Callable[[int, Exception], None]  # called with the failed attempt number before every retry
+
+
+def call_with_retry(
+    func: Callable[[], T],
+    classify: ErrorClassifier,
+    policy: RetryPolicy = RetryPolicy(),
+    description: str = "operation",
+    on_retry: Optional[RetryHandler] = None,
+) -> T:
+    """
+    Call func; retry it on errors classified as transient, with exponential backoff and full jitter,
+    so that parallel workers hitting the same throttling don't retry in lockstep.
+    Server provided Retry-After takes precedence over backoff.
+    The error is re-raised when it's permanent, attempts are exhausted, or next attempt wouldn't fit the deadline
+    on_retry is notified of every retry, eg. for counting them in metrics
+    """
+
+    start = time.monotonic()
+    attempt = 1
+    while True:
+        try:
+            return func()
+        except Exception as err:  # pylint: disable=broad-except # classified below, re-raised unless transient
+            error_class = classify(err)
+            if not error_class.transient or attempt >= policy.max_attempts:
+                raise
+
+            delay = backoff_delay(policy, attempt, error_class.retry_after_sec)
+            remaining = policy.deadline_sec - (time.monotonic() - start)
+            if delay > remaining:
+                log.warning("[%s] Giving up: next attempt in %.1fs would exceed the deadline", description, delay)
+                raise
+
+            log.warning(
+                "[%s] Transient error (attempt %d/%d): %s. Retrying in %.1fs",
+                description,
+                attempt,
+                policy.max_attempts,
+                err,
+                delay,
+            )
+            if on_retry is not None:
+                on_retry(attempt, err)
+            time.sleep(delay)
+            attempt += 1
+
+
+def backoff_delay(policy: RetryPolicy, attempt: int, retry_after_sec: Optional[float] = None) -> float:
+    if retry_after_sec is not None:
+        # honor the server, with a bit of jitter to spread the workers waiting for the same moment
+        return retry_after_sec + random.uniform(0, policy.base_delay_sec)
+
+    ceiling = min(policy.max_delay_sec, policy.base_delay_sec * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    Return delay in seconds requested by the server, None if not requested
+    Azure uses standard Retry-After (seconds) and also retry-after-ms/x-ms-retry-after-ms (milliseconds)
+    Retry-After in HTTP-date format is not used by Azure and is ignored
+    """
+
+    if headers is None:
+        return None
+
+    for name, scale in (("retry-after-ms", 0.001), ("x-ms-retry-after-ms", 0.001), ("Retry-After", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            log.debug("Unsupported %s header value: '%s'", name, value)
+    return None
+
+
+def classify_http_status(status: Optional[int], headers=None) -> ErrorClass:
+    if status not in TRANSIENT_HTTP_STATUSES:
+        return PERMANENT
+    return ErrorClass(transient=True, retry_after_sec=parse_retry_after(headers))
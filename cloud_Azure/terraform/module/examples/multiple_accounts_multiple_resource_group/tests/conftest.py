@@ -0,0 +1,130 @@
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+import pytest
+from azure.core.credentials import AccessToken
+
+# the example is a directory of scripts, not a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+RESOURCE_GRAPH_PATH = "/providers/Microsoft.ResourceGraph/resources"
+POLL_INTERVAL_SEC = 0.01  # fake server stops this fast
+KQL_STRING = r"'((?:[^'\\]|\\.)*)'"  # single-quoted KQL string literal, backslash-escaped
+
+
+def kql_unescape(value: str) -> str:
+    return re.sub(r"\\(.)", r"\1", value)
+
+
+class FakeCredential:
+    """azure-identity credential stand-in; records requested scopes"""
+
+    def __init__(self) -> None:
+        self.scopes: List[str] = []
+
+    def get_token(self, *scopes: str, **_kwargs: Any) -> AccessToken:
+        self.scopes.extend(scopes)
+        return AccessToken("fake-token", int(time.time()) + 3600)
+
+
+class FakeResourceGraph:
+    """
+    Local Resource Graph endpoint answering the resource group and resource queries of ResourceGraphClient
+    from the tables below, honoring subscriptions, type, resource group and tag filters, $top and $skipToken;
+    request bodies are recorded
+    """
+
+    def __init__(self) -> None:
+        # (subscription, name, location, tags)
+        self.resource_groups: List[Tuple[str, str, str, Dict[str, str]]] = []
+        # (subscription, resource group, name, type)
+        self.resources: List[Tuple[str, str, str, str]] = []
+        self.requests: List[Dict[str, Any]] = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(POLL_INTERVAL_SEC,), daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def respond(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        self.requests.append(body)
+        rows = list(self._rows(body["query"], set(body["subscriptions"])))
+        options = body.get("options", {})
+        skip = int(options.get("$skipToken") or 0)
+        top = int(options["$top"])
+        page: Dict[str, Any] = {"data": rows[skip : skip + top], "totalRecords": len(rows)}
+        page["count"] = len(page["data"])
+        if skip + top < len(rows):
+            page["$skipToken"] = str(skip + top)
+        return page
+
+    def _rows(self, query: str, subscriptions: set) -> Iterator[Dict[str, Any]]:
+        if query.startswith("resourcecontainers"):
+            tag = re.search(rf"tags\[{KQL_STRING}\]( == {KQL_STRING})?", query)
+            for subscription, name, location, tags in self.resource_groups:
+                if subscription not in subscriptions:
+                    continue
+                if tag:
+                    tag_name, tag_value = kql_unescape(tag.group(1)), tag.group(3)
+                    if tag_name not in tags or (tag_value is not None and tags[tag_name] != kql_unescape(tag_value)):
+                        continue
+                yield {"subscriptionId": subscription, "name": name, "location": location}
+        elif query.startswith("resources"):
+            resource_type = kql_unescape(re.search(rf"type =~ {KQL_STRING}", query).group(1))
+            group = re.search(rf"resourceGroup =~ {KQL_STRING}", query)
+            for subscription, resource_group, name, type_ in self.resources:
+                if subscription not in subscriptions or type_.lower() != resource_type.lower():
+                    continue
+                if group and resource_group.lower() != kql_unescape(group.group(1)).lower():
+                    continue
+                yield {"subscriptionId": subscription, "resourceGroup": resource_group, "name": name}
+
+
+def _make_handler(graph: FakeResourceGraph) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:  # pylint: disable=invalid-name
+            path = self.path.split("?")[0]
+            if path != RESOURCE_GRAPH_PATH or self.headers.get("Authorization") != "Bearer fake-token":
+                self.send_response(404 if path != RESOURCE_GRAPH_PATH else 401)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            payload = json.dumps(graph.respond(body)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def fake_graph() -> Iterator[FakeResourceGraph]:
+    graph = FakeResourceGraph()
+    graph.start()
+    yield graph
+    graph.stop()
+
+
+@pytest.fixture
+def credential() -> FakeCredential:
+    return FakeCredential()
@@ -0,0 +1,136 @@
+import sys
+from types import SimpleNamespace
+from typing import Any, Iterator, List
+
+import pytest
+from azure.core.exceptions import ClientAuthenticationError, HttpResponseError
+
+import azure_client
+from azure_client import AzureClient, AzureClientError
+from conftest import FakeCredential
+from retry import RetryPolicy
+
+SUBSCRIPTION = "00000000-0000-0000-0000-000000000001"
+
+
+def http_error(status: int, code: str = "") -> HttpResponseError:
+    err = HttpResponseError(f"{status} {code}")
+    err.status_code = status
+    err.response = SimpleNamespace(status_code=status, headers={})
+    err.error = SimpleNamespace(code=code)
+    return err
+
+
+class Failing:
+    """Callable raising given errors on the first calls, then returning the result"""
+
+    def __init__(self, errors: List[Exception], result: Any = None) -> None:
+        self.errors = list(errors)
+        self.result = result
+        self.calls: List[Any] = []
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        self.calls.append(kwargs or args)
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(azure_client, "SDK_RETRY_POLICY", RetryPolicy(max_attempts=3, base_delay_sec=0.001))
+
+
+def client_with_role_assignments(create: Failing) -> AzureClient:
+    client = AzureClient(FakeCredential(), "tenant", SUBSCRIPTION, verify_credentials=False)
+    client._auth_client_instance = SimpleNamespace(role_assignments=SimpleNamespace(create=create))
+    return client
+
+
+@pytest.mark.parametrize("error", [http_error(429), http_error(503), http_error(400, "PrincipalNotFound")])
+def test_owner_role_assignment_is_retried_with_the_same_name(error: HttpResponseError) -> None:
+    create = Failing([error])
+
+    client_with_role_assignments(create).ensure_owner_role("principal")
+
+    assert len(create.calls) == 2
+    assert create.calls[0]["role_assignment_name"] == create.calls[1]["role_assignment_name"]
+
+
+def test_existing_owner_role_assignment_is_tolerated_after_retry() -> None:
+    create = Failing([http_error(503), http_error(409, "RoleAssignmentExists")])
+
+    client_with_role_assignments(create).ensure_owner_role("principal")
+
+    assert len(create.calls) == 2
+
+
+def test_owner_role_assignment_fails_on_permanent_error() -> None:
+    create = Failing([http_error(403, "AuthorizationFailed")])
+
+    with pytest.raises(AzureClientError, match="Failed to assign Owner role"):
+        client_with_role_assignments(create).ensure_owner_role("principal")
+    assert len(create.calls) == 1
+
+
+def subscription_client(list_subscriptions: Failing) -> Any:
+    return SimpleNamespace(subscriptions=SimpleNamespace(list=list_subscriptions))
+
+
+def subscriptions(*ids: str) -> Iterator[Any]:
+    return iter([SimpleNamespace(subscription_id=i) for i in ids])
+
+
+def test_select_subscription_id_retries_transient_errors() -> None:
+    list_subscriptions = Failing([http_error(503)], subscriptions(SUBSCRIPTION))
+
+    assert AzureClient._select_subscription_id(subscription_client(list_subscriptions)) == SUBSCRIPTION
+    assert len(list_subscriptions.calls) == 2
+
+
+@pytest.mark.parametrize(
+    "error, message",
+    [
+        (http_error(503), "listing subscriptions failed"),
+        (ClientAuthenticationError("invalid client secret"), "Provided credentials are invalid"),
+        (http_error(401), "Provided credentials are invalid"),
+    ],
+)
+def test_select_subscription_id_reports_invalid_credentials_for_permanent_errors_only(
+    error: Exception, message: str
+) -> None:
+    list_subscriptions = Failing([error] * 3, subscriptions(SUBSCRIPTION))
+
+    with pytest.raises(AzureClientError, match=message):
+        AzureClient._select_subscription_id(subscription_client(list_subscriptions))
+
+
+def test_select_subscription_id_without_subscriptions() -> None:
+    list_subscriptions = Failing([], subscriptions())
+
+    with pytest.raises(AzureClientError, match="no subscriptions available"):
+        AzureClient._select_subscription_id(subscription_client(list_subscriptions))
+
+
+@pytest.fixture
+def fresh_token_cache_options() -> Iterator[None]:
+    azure_client.token_cache_options.cache_clear()
+    yield
+    azure_client.token_cache_options.cache_clear()
+
+
+def test_token_cache_falls_back_to_memory_without_private_probe(
+    monkeypatch: pytest.MonkeyPatch, fresh_token_cache_options: None
+) -> None:
+    monkeypatch.delenv(azure_client.UNENCRYPTED_TOKEN_CACHE_VARIABLE, raising=False)
+    monkeypatch.setitem(sys.modules, "azure.identity._persistent_cache", None)  # import fails
+
+    assert azure_client.token_cache_options() == {}
+
+
+def test_token_cache_unencrypted_when_allowed(monkeypatch: pytest.MonkeyPatch, fresh_token_cache_options: None) -> None:
+    monkeypatch.setenv(azure_client.UNENCRYPTED_TOKEN_CACHE_VARIABLE, "1")
+
+    options = azure_client.token_cache_options()["cache_persistence_options"]
+
+    assert options.name == azure_client.TOKEN_CACHE_NAME and options.allow_unencrypted_storage
@@ -0,0 +1,38 @@
+import json
+from pathlib import Path
+
+from backups import BackupOptions, BackupStore, RetentionPolicy
+
+
+def write_and_back_up(store: BackupStore, path: Path, versions: range) -> None:
+    for version in versions:
+        path.write_text("".join(f"[profile-{i}]\nlocation = eastus\n" for i in range(20)) + f"version = {version}\n")
+        store.backup(str(path))
+
+
+def test_options_apply_to_their_store_only(tmp_path: Path) -> None:
+    profiles = tmp_path / "profiles.ini"
+    directory = tmp_path / "backups"
+    options = BackupOptions(str(directory), use_deltas=True, retention=RetentionPolicy(keep_last=2))
+
+    write_and_back_up(options.open(), profiles, range(3))
+    assert len(options.open().entries()) == 2
+    assert any(base is not None for base in json.loads((directory / "index.json").read_text())["bases"].values())
+
+    write_and_back_up(BackupStore(str(directory)), profiles, range(3, 6))  # default options: full content, keep 50
+    index = json.loads((directory / "index.json").read_text())
+    assert len(index["backups"]) == 5
+    newest = index["backups"][-1]["sha256"]
+    assert index["bases"][newest] is None
+
+
+def test_restore_through_options(tmp_path: Path) -> None:
+    profiles = tmp_path / "profiles.ini"
+    options = BackupOptions(str(tmp_path / "backups"), use_deltas=True)
+    write_and_back_up(options.open(), profiles, range(2))
+    store = options.open()
+    first = store.entries(str(profiles))[0]
+
+    store.restore(first, str(profiles))
+
+    assert profiles.read_text().endswith("version = 0\n")
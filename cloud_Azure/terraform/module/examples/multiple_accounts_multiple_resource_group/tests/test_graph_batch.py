@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import pytest
+
+import azure_client
+from azure_client import AzureClient, graph_batch_request
+from conftest import FakeCredential
+from retry import RetryPolicy
+
+Response = Dict[str, Any]
+
+
+class FakeGraphClient:
+    """MS Graph client stand-in answering $batch requests with prepared statuses, one list per batch sent"""
+
+    def __init__(self, statuses: List[Dict[str, int]]) -> None:
+        self.statuses = statuses
+        self.batches: List[List[Dict[str, Any]]] = []
+
+    def post(self, url: str, json: Dict[str, Any], headers: Dict[str, str]) -> Any:
+        assert url == "/$batch"
+        self.batches.append(json["requests"])
+        statuses = self.statuses[min(len(self.batches), len(self.statuses)) - 1]
+        responses = [self._response(r["id"], statuses.get(r["id"], 200)) for r in json["requests"]]
+        return SimpleNamespace(raise_for_status=lambda: None, json=lambda: {"responses": responses})
+
+    @staticmethod
+    def _response(request_id: str, status: int) -> Response:
+        response: Response = {"id": request_id, "status": status, "body": {"value": request_id}}
+        if status == 429:
+            response["headers"] = {"Retry-After": "0"}
+        return response
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(azure_client, "SDK_RETRY_POLICY", RetryPolicy(max_attempts=3, base_delay_sec=0.001))
+
+
+def send_batch(graph: FakeGraphClient) -> Dict[str, Response]:
+    client = AzureClient(FakeCredential(), "tenant", "subscription", verify_credentials=False)
+    client._graph_client_instance = graph
+    requests = [
+        graph_batch_request("secret", "POST", "/servicePrincipals/p/addPassword", {}),
+        graph_batch_request("permission", "POST", "/servicePrincipals/g/appRoleAssignedTo", {}, depends_on=["secret"]),
+    ]
+    return client._graph_batch(requests)
+
+
+def test_throttled_request_is_sent_again_with_requests_depending_on_it() -> None:
+    graph = FakeGraphClient([{"secret": 429, "permission": 424}, {}])
+
+    responses = send_batch(graph)
+
+    assert {i: r["status"] for i, r in responses.items()} == {"secret": 200, "permission": 200}
+    assert [[r["id"] for r in batch] for batch in graph.batches] == [["secret", "permission"]] * 2
+    assert graph.batches[1][1]["dependsOn"] == ["secret"]
+
+
+def test_only_failed_request_is_sent_again_without_dependency_on_successful_one() -> None:
+    graph = FakeGraphClient([{"permission": 503}, {}])
+
+    responses = send_batch(graph)
+
+    assert responses["permission"]["status"] == 200
+    assert [r["id"] for r in graph.batches[1]] == ["permission"]
+    assert "dependsOn" not in graph.batches[1][0]
+
+
+def test_last_responses_are_returned_when_retries_are_exhausted() -> None:
+    graph = FakeGraphClient([{"secret": 504, "permission": 424}])
+
+    responses = send_batch(graph)
+
+    assert len(graph.batches) == 3
+    assert (responses["secret"]["status"], responses["permission"]["status"]) == (504, 424)
+
+
+def test_permanent_failure_is_not_sent_again() -> None:
+    graph = FakeGraphClient([{"secret": 400, "permission": 424}])
+
+    responses = send_batch(graph)
+
+    assert len(graph.batches) == 1
+    assert responses["secret"]["status"] == 400
@@ -0,0 +1,41 @@
+from pathlib import Path
+from typing import Dict
+
+from metrics import save_prometheus
+from run_report import STATUS_SUCCESSFUL, PhaseReport, ProfileReport, RunReport
+
+
+def read_samples(path: Path) -> Dict[str, float]:
+    lines = [line for line in path.read_text(encoding="utf-8").splitlines() if not line.startswith("#")]
+    samples: Dict[str, float] = {}
+    for line in lines:
+        sample, value = line.rsplit(" ", 1)
+        assert sample not in samples, f"duplicate sample {sample}"
+        samples[sample] = float(value)
+    return samples
+
+
+def test_phases_repeated_in_profile_are_aggregated(tmp_path: Path) -> None:
+    report = RunReport("apply")
+    profile = ProfileReport("p1", "ws-p1", status=STATUS_SUCCESSFUL, duration_sec=10.0)
+    profile.phases = [
+        PhaseReport("az login", successful=True, duration_sec=1.5, retries=1),
+        PhaseReport("terraform apply", successful=False, duration_sec=2.0, exit_code=1),
+        PhaseReport("az login", successful=True, duration_sec=0.5, retries=2),
+        PhaseReport("terraform apply", successful=True, duration_sec=3.0, exit_code=0),
+    ]
+    report.add(profile)
+    path = tmp_path / "metrics.prom"
+
+    assert save_prometheus(report, str(path), "azure")
+
+    samples = read_samples(path)
+    labels = 'onboarder="azure",action="apply",profile="p1",phase'
+    assert samples[f'onboarder_profile_phase_duration_seconds{{{labels}="az login"}}'] == 2.0
+    assert samples[f'onboarder_profile_phase_count{{{labels}="az login"}}'] == 2
+    assert samples[f'onboarder_profile_phase_retries{{{labels}="az login"}}'] == 3
+    assert samples[f'onboarder_profile_phase_duration_seconds{{{labels}="terraform apply"}}'] == 5.0
+    assert samples[f'onboarder_profile_terraform_exit_code{{{labels}="terraform apply"}}'] == 0
+    assert f'onboarder_profile_terraform_exit_code{{{labels}="az login"}}' not in samples
+    assert samples['onboarder_phase_count{onboarder="azure",action="apply",phase="terraform apply"}'] == 2
+    assert samples['onboarder_phase_failures{onboarder="azure",action="apply",phase="terraform apply"}'] == 1
@@ -0,0 +1,34 @@
+import io
+from contextlib import redirect_stdout
+
+import pytest
+
+from profile_terraform import PrefixedOutput, PrefixedStream
+
+
+def test_prefixed_stream_writes_complete_lines_live(capfd: pytest.CaptureFixture) -> None:
+    log_file = io.StringIO()
+    stream = PrefixedStream(PrefixedOutput("p1", log_file), is_stderr=False)
+
+    with redirect_stdout(stream):
+        print("Profile: ", end="")
+        assert capfd.readouterr().out == ""  # incomplete line is held
+        print('"p1"\nTerraform plan...')
+        assert capfd.readouterr().out == '[p1] Profile: "p1"\n[p1] Terraform plan...\n'
+        print("partial", end="")
+    stream.flush()
+
+    assert capfd.readouterr().out == "[p1] partial\n"
+    assert log_file.getvalue() == 'Profile: "p1"\nTerraform plan...\npartial\n'
+
+
+def test_prefixed_output_pipe_formats_terraform_events(capfd: pytest.CaptureFixture) -> None:
+    log_file = io.StringIO()
+    events = []
+    event_line = '{"@message": "Plan: 1 to add", "type": "change_summary", "changes": {"add": 1}}\n'
+
+    PrefixedOutput("p1", log_file).pipe(io.BytesIO(f"plain\n{event_line}".encode()), True, events.append)
+
+    assert capfd.readouterr().err == "[p1] plain\n[p1] Plan: 1 to add\n"
+    assert log_file.getvalue() == f"plain\n{event_line}"
+    assert [e["type"] for e in events] == ["change_summary"]
@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from profiles import AzureProfile, ProfileCollection, ini_sections, load_ini_profiles, save_profiles
+
+
+def profile(name: str, principal_id: str = "", secret: str = "") -> AzureProfile:
+    return AzureProfile(name=name, principal_id=principal_id, principal_secret=secret)
+
+
+def test_find_secret_returns_first_profile_with_secret_in_collection_order() -> None:
+    profiles = ProfileCollection([profile("a", "p1"), profile("b", "p1", "s-b"), profile("c", "p1", "s-c")])
+
+    assert profiles.find_secret("p1") == ("b", "s-b")
+    assert profiles.find_secret("p2") is None
+
+
+def test_find_secret_after_profile_modified_in_place_and_upserted() -> None:
+    """As complete_profile does: the stored profile object itself gets the principal, then is upserted"""
+
+    profiles = ProfileCollection([profile("a"), profile("b", "p1", "s-b")])
+    stored = profiles.get("a")
+    stored.principal_id = "X"
+    stored.principal_secret = "s-x"
+    profiles.upsert(stored)
+
+    assert profiles.find_secret("X") == ("a", "s-x")
+    assert profiles.find_secret("") is None
+
+
+def test_find_secret_after_principal_changed_in_place() -> None:
+    profiles = ProfileCollection([profile("a", "p1", "s-a"), profile("b", "p2", "s-b")])
+    stored = profiles.get("a")
+    stored.principal_id = "p2"
+    profiles.upsert(stored)
+
+    assert profiles.find_secret("p1") is None
+    assert profiles.find_secret("p2") == ("a", "s-a")  # "a" comes first in the collection
+
+
+def test_upsert_replacing_profile_keeps_position_and_reindexes_principal() -> None:
+    profiles = ProfileCollection([profile("a", "p1", "s-a"), profile("b", "p2", "s-b")])
+    profiles.upsert(profile("a", "p2", "s-a2"))
+
+    assert [p.name for p in profiles] == ["a", "b"]
+    assert profiles.find_secret("p1") is None
+    assert profiles.find_secret("p2") == ("a", "s-a2")
+    assert [p.name for p in profiles.take_changed()] == ["a"]
+
+
+def test_save_profiles_writes_tags_only_when_set(tmp_path: Path) -> None:
+    path = tmp_path / "profiles.ini"
+    tagged = AzureProfile(name="tagged", resource_group_names=["rg-1", "rg-2"], tags=["env=prod", "team"])
+
+    assert save_profiles(str(path), [profile("plain", "p1", "s1"), tagged])
+
+    sections = dict(ini_sections(str(path)))
+    assert "tags" not in sections["plain"] and sections["plain"]["resource_group_names"] == ""
+    assert sections["tagged"]["tags"] == "env=prod,team"
+    assert [p.tags for p in load_ini_profiles(str(path))] == [[], ["env=prod", "team"]]
@@ -0,0 +1,31 @@
+import argparse
+import sys
+from typing import List, Tuple
+
+import pytest
+
+from profiles_tool import Action, parse_cmd_line
+
+
+def parse(monkeypatch: pytest.MonkeyPatch, args: List[str]) -> Tuple[Action, argparse.Namespace]:
+    monkeypatch.setattr(sys, "argv", ["profiles_tool.py"] + args)
+    return parse_cmd_line()
+
+
+@pytest.mark.parametrize("action", ["import", "export"])
+def test_import_and_export_reject_ini_same_as_profiles_file(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture, action: str
+) -> None:
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, [action])
+    with pytest.raises(SystemExit):
+        parse(monkeypatch, ["--filename", "profiles.ini", "--ini", "./profiles.ini", action])
+
+    assert "--ini must be other file than --filename" in capsys.readouterr().err
+
+
+def test_import_from_default_ini_to_database(monkeypatch: pytest.MonkeyPatch) -> None:
+    action, args = parse(monkeypatch, ["--filename", "profiles.db", "import"])
+
+    assert action == Action.IMPORT
+    assert args.ini == "profiles.ini"
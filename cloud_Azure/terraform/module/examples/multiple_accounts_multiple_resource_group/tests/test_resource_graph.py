@@ -0,0 +1,202 @@
+import re
+from types import SimpleNamespace
+from typing import Any, Callable, Iterator, List, Optional
+
+import pytest
+
+import resource_graph
+from azure_client import NETWORK_SECURITY_GROUP_TYPE, VIRTUAL_NETWORK_TYPE, AzureClient
+from conftest import FakeCredential, FakeResourceGraph
+from resource_graph import ResourceGraphClient, kql_escape
+
+SUBSCRIPTION = "00000000-0000-0000-0000-000000000001"
+OTHER_SUBSCRIPTION = "00000000-0000-0000-0000-000000000002"
+EMPTY_SUBSCRIPTION = "00000000-0000-0000-0000-000000000003"
+
+
+@pytest.fixture(autouse=True)
+def populate_fake_graph(fake_graph: FakeResourceGraph) -> None:
+    fake_graph.resource_groups = [
+        (SUBSCRIPTION, "rg-b", "EastUS", {"env": "prod"}),
+        (SUBSCRIPTION, "RG-A", "eastus", {"env": "dev"}),
+        (SUBSCRIPTION, "rg-w", "westeurope", {"owner": "o'brien"}),
+        (SUBSCRIPTION, "rg-x", "westeurope", {}),
+        (OTHER_SUBSCRIPTION, "rg-other", "eastus", {}),
+    ]
+    fake_graph.resources = [
+        (SUBSCRIPTION, "RG-A", "nsg-2", NETWORK_SECURITY_GROUP_TYPE),
+        (SUBSCRIPTION, "rg-a", "nsg-1", NETWORK_SECURITY_GROUP_TYPE),
+        (SUBSCRIPTION, "rg-w", "nsg-3", NETWORK_SECURITY_GROUP_TYPE),
+        (SUBSCRIPTION, "rg-w", "vnet-1", VIRTUAL_NETWORK_TYPE),
+        (OTHER_SUBSCRIPTION, "rg-other", "nsg-x", NETWORK_SECURITY_GROUP_TYPE),
+    ]
+
+
+@pytest.fixture
+def graph_client(fake_graph: FakeResourceGraph, credential: FakeCredential) -> ResourceGraphClient:
+    return ResourceGraphClient(credential, endpoint=fake_graph.url)
+
+
+def test_kql_escape() -> None:
+    assert kql_escape("plain") == "plain"
+    assert kql_escape("o'brien") == "o\\'brien"
+    assert kql_escape("back\\slash'") == "back\\\\slash\\'"
+
+
+def test_query_follows_skip_token_pages(
+    graph_client: ResourceGraphClient, fake_graph: FakeResourceGraph, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(resource_graph, "PAGE_SIZE", 2)
+
+    groups = graph_client.resource_groups([SUBSCRIPTION, OTHER_SUBSCRIPTION])
+
+    assert len(groups[SUBSCRIPTION]) == 4 and len(groups[OTHER_SUBSCRIPTION]) == 1
+    assert [r["options"].get("$skipToken") for r in fake_graph.requests] == [None, "2", "4"]
+    assert all(r["options"]["$top"] == 2 for r in fake_graph.requests)
+
+
+def test_query_splits_subscriptions_into_batches(
+    graph_client: ResourceGraphClient, fake_graph: FakeResourceGraph, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(resource_graph, "MAX_SUBSCRIPTIONS_PER_QUERY", 1)
+
+    rows = list(
+        graph_client.query(resource_graph.RESOURCE_GROUPS_QUERY.format(where=""), [SUBSCRIPTION, OTHER_SUBSCRIPTION])
+    )
+
+    assert len(rows) == 5
+    assert [r["subscriptions"] for r in fake_graph.requests] == [[SUBSCRIPTION], [OTHER_SUBSCRIPTION]]
+
+
+def test_resource_groups_by_subscription(graph_client: ResourceGraphClient, credential: FakeCredential) -> None:
+    groups = graph_client.resource_groups([SUBSCRIPTION, OTHER_SUBSCRIPTION, EMPTY_SUBSCRIPTION])
+
+    assert groups == {
+        SUBSCRIPTION: [("rg-b", "EastUS"), ("RG-A", "eastus"), ("rg-w", "westeurope"), ("rg-x", "westeurope")],
+        OTHER_SUBSCRIPTION: [("rg-other", "eastus")],
+        EMPTY_SUBSCRIPTION: [],
+    }
+    assert credential.scopes == ["https://management.azure.com/.default"]
+
+
+def test_resource_groups_with_tag_are_queried_with_escaped_tag(
+    graph_client: ResourceGraphClient, fake_graph: FakeResourceGraph
+) -> None:
+    assert graph_client.resource_groups([SUBSCRIPTION], "owner", "o'brien") == {SUBSCRIPTION: [("rg-w", "westeurope")]}
+    assert "tags['owner'] == 'o\\'brien'" in fake_graph.requests[-1]["query"]
+
+    assert graph_client.resource_groups([SUBSCRIPTION], "env") == {
+        SUBSCRIPTION: [("rg-b", "EastUS"), ("RG-A", "eastus")]
+    }
+    assert "isnotnull(tags['env'])" in fake_graph.requests[-1]["query"]
+
+
+def test_resources_are_grouped_by_lower_case_resource_group_and_sorted(graph_client: ResourceGraphClient) -> None:
+    nsgs = graph_client.resources_by_resource_group(NETWORK_SECURITY_GROUP_TYPE, [SUBSCRIPTION, EMPTY_SUBSCRIPTION])
+
+    assert nsgs == {SUBSCRIPTION: {"rg-a": ["nsg-1", "nsg-2"], "rg-w": ["nsg-3"]}, EMPTY_SUBSCRIPTION: {}}
+
+
+def test_resources_in_resource_group_are_queried_with_escaped_name(
+    graph_client: ResourceGraphClient, fake_graph: FakeResourceGraph
+) -> None:
+    nsgs = graph_client.resources_by_resource_group(NETWORK_SECURITY_GROUP_TYPE, [SUBSCRIPTION], "Rg-A")
+    assert nsgs == {SUBSCRIPTION: {"rg-a": ["nsg-1", "nsg-2"]}}
+
+    graph_client.resources_by_resource_group(NETWORK_SECURITY_GROUP_TYPE, [SUBSCRIPTION], "it's")
+    assert "resourceGroup =~ 'it\\'s'" in fake_graph.requests[-1]["query"]
+
+
+class FakeResourceManagementClient:
+    """ARM ResourceManagementClient stand-in serving the same inventory as the fake Resource Graph"""
+
+    def __init__(self, graph: FakeResourceGraph, subscription_id: str) -> None:
+        self.resource_groups = SimpleNamespace(list=self._list_resource_groups)
+        self.resources = SimpleNamespace(list=self._list_resources, list_by_resource_group=self._list_by_resource_group)
+        self._graph = graph
+        self._subscription_id = subscription_id
+
+    def _list_resource_groups(self, filter: Optional[str] = None) -> Iterator[Any]:  # pylint: disable=redefined-builtin
+        tag = re.match(r"tagName eq '((?:[^']|'')*)'( and tagValue eq '((?:[^']|'')*)')?$", filter or "")
+        for subscription, name, location, tags in self._graph.resource_groups:
+            if subscription != self._subscription_id:
+                continue
+            if tag:
+                tag_name, tag_value = tag.group(1).replace("''", "'"), tag.group(3)
+                if tag_name not in tags or (tag_value is not None and tags[tag_name] != tag_value.replace("''", "'")):
+                    continue
+            yield SimpleNamespace(name=name, location=location)
+
+    def _list_resources(self, filter: str) -> Iterator[Any]:  # pylint: disable=redefined-builtin
+        resource_type = re.match(r"resourceType eq '(.*)'$", filter).group(1)
+        for subscription, group, name, type_ in self._graph.resources:
+            if subscription == self._subscription_id and type_ == resource_type:
+                resource_id = f"/subscriptions/{subscription}/resourceGroups/{group}/providers/{type_}/{name}"
+                yield SimpleNamespace(id=resource_id, name=name)
+
+    def _list_by_resource_group(self, resource_group: str, resource_filter: str) -> Iterator[Any]:
+        for r in self._list_resources(resource_filter):
+            if r.id.split("/")[4].lower() == resource_group.lower():
+                yield r
+
+
+@pytest.fixture
+def clients(
+    fake_graph: FakeResourceGraph, credential: FakeCredential, monkeypatch: pytest.MonkeyPatch
+) -> List[AzureClient]:
+    """ARM-backed client and Resource Graph-backed client of the same subscription"""
+
+    monkeypatch.setattr(resource_graph, "RESOURCE_GRAPH_ENDPOINT", fake_graph.url)
+    arm = AzureClient(credential, "tenant", SUBSCRIPTION, verify_credentials=False)
+    arm._resource_client_instance = FakeResourceManagementClient(fake_graph, SUBSCRIPTION)
+    graph = AzureClient(credential, "tenant", SUBSCRIPTION, verify_credentials=False, use_resource_graph=True)
+    return [arm, graph]
+
+
+@pytest.mark.parametrize(
+    "call",
+    [
+        lambda c: c.list_resource_groups("eastus"),
+        lambda c: c.list_resource_groups("WestEurope"),
+        lambda c: c.list_resource_groups("japaneast"),
+        lambda c: c.resource_groups_by_location(),
+        lambda c: c.resource_groups_with_tag("env"),
+        lambda c: c.resource_groups_with_tag("owner", "o'brien"),
+        lambda c: c.find_missing_resource_groups("eastus", ["rg-a", "rg-b", "rg-w", "missing"]),
+        lambda c: c.list_network_security_groups("rg-A"),
+        lambda c: c.list_network_security_groups("rg-x"),
+        lambda c: c.network_security_groups_by_resource_group(),
+        lambda c: c.list_virtual_networks("rg-w"),
+        lambda c: c.virtual_networks_by_resource_group(),
+    ],
+)
+def test_azure_client_resource_graph_results_match_arm(clients: List[AzureClient], call: Callable) -> None:
+    arm_result, graph_result = (call(c) for c in clients)
+
+    assert graph_result == arm_result
+    assert type(graph_result) is type(arm_result)
+    if isinstance(arm_result, dict):
+        assert all(isinstance(v, list) for v in graph_result.values())
+
+
+def test_azure_client_resource_graph_lists_resource_groups_once(
+    clients: List[AzureClient], fake_graph: FakeResourceGraph
+) -> None:
+    _, graph = clients
+
+    assert graph.list_resource_groups("eastus") == ["RG-A", "rg-b"]
+    assert graph.list_resource_groups("westeurope") == ["rg-w", "rg-x"]
+    assert graph.find_missing_resource_groups("eastus", ["rg-a", "nope"]) == ["nope"]
+    assert len(fake_graph.requests) == 1
+    assert fake_graph.requests[0]["subscriptions"] == [SUBSCRIPTION]
+
+
+def test_resource_graph_is_used_only_by_clients_created_with_it(
+    clients: List[AzureClient], fake_graph: FakeResourceGraph, credential: FakeCredential
+) -> None:
+    arm, graph = clients
+    other = AzureClient(credential, "tenant", SUBSCRIPTION, verify_credentials=False)
+
+    assert (arm.use_resource_graph, graph.use_resource_graph, other.use_resource_graph) == (False, True, False)
+    arm.list_resource_groups("eastus")
+    assert not fake_graph.requests